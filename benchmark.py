@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+#Run a scripted observer path without window and record the timings of the per-frame engine passes.
+#Without GPU, the procedural heightmaps are generated on the CPU, the other offscreen generators are not available.
+
+from panda3d.core import LVector3d
+from direct.interval.IntervalGlobal import Sequence, Func, Wait
+
+from main import CosmoniumApp, parser
+from cosmonium.benchmark import Benchmark, load_results, compare_results
+from cosmonium.celestia import cel_parser, cel_engine
+from cosmonium import settings
+
+import sys
+import os
+
+class BenchmarkApp(CosmoniumApp):
+    def __init__(self, args):
+        self.args = args
+        self.benchmark = None
+        self.regressions = None
+        args.headless = True
+        settings.cpu_noise = True
+        CosmoniumApp.__init__(self, args)
+
+    def app_panda_config(self, data):
+        CosmoniumApp.app_panda_config(self, data)
+        data.append("audio-library-name null")
+        #The simulated time advances by a fixed step so the observer path is the same on all machines
+        data.append("clock-mode non-real-time")
+        data.append("clock-frame-rate %d" % self.args.frame_rate)
+
+    def default_sequence(self):
+        body = self.universe.find_by_name(self.app_config.default)
+        if body is None:
+            print("Could not find", self.app_config.default)
+            return None
+        return Sequence(Func(self.select_body, body),
+                        Func(self.autopilot.go_to_front, 0.0),
+                        Wait(1.0),
+                        Func(self.autopilot.orbit, LVector3d(0, 0, 1), 0.5, 5.0),
+                        Wait(5.0),
+                        Func(self.autopilot.go_to_surface, 5.0),
+                        Wait(6.0),
+                        Func(self.autopilot.change_distance, 1.0, 2.0),
+                        Wait(3.0),
+                        name='benchmark')
+
+    def start_universe(self):
+        if self.app_config.script is not None:
+            print("Running", self.app_config.script)
+            sequence = cel_engine.build_sequence(self, cel_parser.load(self.app_config.script))
+            name = os.path.basename(self.app_config.script)
+        else:
+            sequence = self.default_sequence()
+            name = self.app_config.default
+        if sequence is None:
+            sys.exit(1)
+        sequence.append(Func(self.benchmark_done))
+        self.benchmark = Benchmark(name, self.args.warmup)
+        self.benchmark.start()
+        self.run_script(sequence)
+
+    def benchmark_done(self):
+        self.benchmark.stop()
+        if self.args.output is not None:
+            self.benchmark.save(self.args.output)
+        self.regressions = []
+        if self.args.baseline is not None:
+            baseline = load_results(self.args.baseline)
+            if baseline is None:
+                sys.exit(2)
+            self.regressions = compare_results(self.benchmark.get_results(), baseline, self.args.tolerance)
+            for (name, base_time, new_time) in self.regressions:
+                print("Regression in %s: %.3f ms -> %.3f ms" % (name, base_time, new_time))
+        sys.exit(1 if len(self.regressions) > 0 else 0)
+
+parser.add_argument("--output",
+                    help="JSON file where the benchmark results are written",
+                    default=None)
+parser.add_argument("--baseline",
+                    help="JSON file with the reference results to compare to",
+                    default=None)
+parser.add_argument("--tolerance",
+                    help="Allowed relative slowdown of a pass compared to the baseline",
+                    type=float,
+                    default=0.2)
+parser.add_argument("--frame-rate",
+                    help="Number of frames per simulated second",
+                    type=int,
+                    default=30)
+parser.add_argument("--warmup",
+                    help="Number of frames ignored at the start of the benchmark",
+                    type=int,
+                    default=10)
+args = parser.parse_args()
+
+app = BenchmarkApp(args)
+app.run()
@@ -21,21 +21,89 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 from panda3d.core import LPoint3d, LQuaternion, LColor, LVector3, LVector3d
-from panda3d.core import GeomVertexFormat, GeomVertexData, GeomVertexWriter, GeomVertexRewriter, InternalName
+from panda3d.core import GeomVertexFormat, GeomVertexData, GeomVertexWriter
 from panda3d.core import Geom, GeomNode, GeomLines
-from panda3d.core import NodePath
+from panda3d.core import NodePath, PandaNode, Filename, Loader, LoaderOptions
 
 from .foundation import VisibleObject, ObjectLabel, LabelledObject
-from .astro.orbits import FixedOrbit, InfinitePosition
+from .astro.orbits import FixedOrbit, InfinitePosition, EllipticalOrbit
 from .astro import units
 from .bodyclass import bodyClasses
 from .shaders import BasicShader, FlatLightingModel, LargeObjectVertexControl
 from .appearances import ModelAppearance
 from .mesh import load_panda_model
+from .geometry import write_vertex_data, set_cached_indices, set_primitive_indices, make_polylines_indices
+from .lrucache import LRUCache
+from .cache import create_path_for
 from .utils import srgb_to_linear
 from . import settings
 
 from math import sin, cos, atan2, pi
+import hashlib
+import numpy
+import os
+
+def make_lines_geom(positions, indices):
+    vertex_data = GeomVertexData('vertexData', GeomVertexFormat.getV3(), Geom.UHStatic)
+    vertex_data.unclean_set_num_rows(len(positions))
+    lines = GeomLines(Geom.UHStatic)
+    set_primitive_indices(lines, indices)
+    geom = Geom(vertex_data)
+    geom.addPrimitive(lines)
+    if len(positions) > 0:
+        write_vertex_data(geom, {'vertex': positions})
+    return geom
+
+class AnnotationGeomCache(object):
+    """Process wide cache of the static annotation geoms. The geoms are built on the unit sphere
+    and are instanced with their own orientation, scale and color.
+    The geoms built only from parameters can also be stored in the cache directory."""
+    def __init__(self):
+        self.geoms = {}
+
+    def get_bam_path(self, key):
+        md5 = hashlib.md5(("%s:%r" % (settings.version, key)).encode()).hexdigest()
+        return os.path.join(create_path_for('annotations'), md5 + '.bam')
+
+    def load(self, key):
+        path = self.get_bam_path(key)
+        if not os.path.exists(path): return None
+        root = Loader.get_global_ptr().load_sync(Filename.from_os_specific(path), LoaderOptions(LoaderOptions.LF_no_cache))
+        if root is None:
+            print("Could not load annotation", path)
+            return None
+        root = NodePath(root)
+        geoms = []
+        for i in range(root.find_all_matches('**/+GeomNode').get_num_paths()):
+            geoms.append(root.find('**/geom-%d' % i).node().get_geom(0))
+        return geoms
+
+    def store(self, key, geoms):
+        root = NodePath(PandaNode('annotation'))
+        for (i, geom) in enumerate(geoms):
+            node = GeomNode('geom-%d' % i)
+            node.add_geom(geom)
+            root.attach_new_node(node)
+        path = self.get_bam_path(key)
+        if not root.write_bam_file(Filename.from_os_specific(path)):
+            print("Could not store annotation", path)
+
+    def get(self, key, generator, *args, **kwargs):
+        """Return the list of geoms for the given key, the generator is only called the first time.
+        When persistent is set, the geoms are also stored in the cache directory."""
+        geoms = self.geoms.get(key)
+        if geoms is None:
+            persistent = kwargs.get('persistent', False) and settings.store_annotations
+            if persistent:
+                geoms = self.load(key)
+            if geoms is None:
+                geoms = generator(*args)
+                if persistent:
+                    self.store(key, geoms)
+            self.geoms[key] = geoms
+        return geoms
+
+annotationGeomCache = AnnotationGeomCache()
 
 class AnnotationLabel(ObjectLabel):
     def update_instance(self, camera_pos, orientation):
@@ -68,7 +136,7 @@ class Orbit(VisibleObject):
         VisibleObject.__init__(self, body.get_ascii_name() + '-orbit')
         self.body = body
         self.owner = body
-        self.nbOfPoints = 360
+        self.nbOfPoints = settings.orbit_points
         self.orbit = self.find_orbit(self.body)
         self.color = None
         self.fade = 0.0
@@ -114,30 +182,60 @@ class Orbit(VisibleObject):
         if self.instance:
             self.instance.setColor(srgb_to_linear(self.color * self.fade))
 
-    def create_instance(self):
-        self.vertexData = GeomVertexData('vertexData', GeomVertexFormat.getV3(), Geom.UHStatic)
-        self.vertexWriter = GeomVertexWriter(self.vertexData, 'vertex')
-        delta = self.body.parent.get_local_position()
+    def get_nb_points(self):
+        if isinstance(self.orbit, EllipticalOrbit) and self.orbit.eccentricity < 1.0:
+            #The curvature at the ends of the orbit grows with the eccentricity
+            factor = (1.0 - self.orbit.eccentricity * self.orbit.eccentricity) ** -0.25
+        else:
+            factor = 2.0
+        return min(int(self.nbOfPoints * factor), settings.orbit_max_points)
+
+    def sample_positions(self, nb_points):
+        if isinstance(self.orbit, EllipticalOrbit):
+            return self.orbit.sample_shape(nb_points)
         if self.orbit.is_periodic():
             epoch = self.context.time.time_full - self.orbit.period
-            step = self.orbit.period / (self.nbOfPoints - 1)
+            step = self.orbit.period / (nb_points - 1)
         else:
             #TODO: Properly calculate orbit start and end time
             epoch = self.orbit.get_time_of_perihelion() - self.orbit.period * 5.0
-            step = self.orbit.period * 10.0 / (self.nbOfPoints - 1)
-        for i in range(self.nbOfPoints):
+            step = self.orbit.period * 10.0 / (nb_points - 1)
+        positions = numpy.empty((nb_points, 3))
+        for i in range(nb_points):
             time = epoch + step * i
-            pos = self.orbit.get_position_at(time) - delta
-            self.vertexWriter.addData3f(*pos)
-        self.lines = GeomLines(Geom.UHStatic)
-        for i in range(self.nbOfPoints-1):
-            self.lines.addVertex(i)
-            self.lines.addVertex(i+1)
-        if self.orbit.is_periodic():
-            self.lines.addVertex(self.nbOfPoints-1)
-            self.lines.addVertex(0)
-        self.geom = Geom(self.vertexData)
-        self.geom.addPrimitive(self.lines)
+            positions[i] = tuple(self.orbit.get_frame_rotation_at(time).xform(self.orbit.get_frame_position_at(time)))
+        return positions
+
+    def create_geom(self):
+        periodic = self.orbit.is_periodic()
+        nb_points = self.get_nb_points()
+        if isinstance(self.orbit, EllipticalOrbit):
+            #The shape of the orbit only depends on its elements, the geom can be shared and reused
+            key = (self.orbit.get_shape_key(), nb_points)
+            geom = orbitGeomCache.get(None, key)
+            if geom is not None:
+                return geom
+        else:
+            key = None
+        vertex_data = GeomVertexData('vertexData', GeomVertexFormat.getV3(), Geom.UHStatic)
+        vertex_data.unclean_set_num_rows(nb_points)
+        lines = GeomLines(Geom.UHStatic)
+        set_cached_indices(lines, ('orbit', nb_points, periodic), self.make_lines, nb_points, periodic)
+        geom = Geom(vertex_data)
+        geom.addPrimitive(lines)
+        write_vertex_data(geom, {'vertex': self.sample_positions(nb_points)})
+        if key is not None:
+            orbitGeomCache.add(None, key, geom, nb_points * 3 * 4)
+        return geom
+
+    def make_lines(self, lines, nb_points, periodic):
+        for i in range(nb_points - 1):
+            lines.addVertices(i, i + 1)
+        if periodic:
+            lines.addVertices(nb_points - 1, 0)
+
+    def create_instance(self):
+        self.geom = self.create_geom()
         self.node = GeomNode(self.body.get_ascii_name() + '-orbit')
         self.node.addGeom(self.geom)
         self.instance = NodePath(self.node)
@@ -155,22 +253,9 @@ class Orbit(VisibleObject):
         self.shader.update(self, self.appearance)
 
     def update_geom(self):
-        geom = self.node.modify_geom(0)
-        vdata = geom.modify_vertex_data()
-        vwriter = GeomVertexRewriter(vdata, InternalName.make('vertex'))
-        #TODO: refactor with above code !!!
-        delta = self.body.parent.get_local_position()
-        if self.orbit.is_periodic():
-            epoch = self.context.time.time_full - self.orbit.period
-            step = self.orbit.period / (self.nbOfPoints - 1)
-        else:
-            #TODO: Properly calculate orbit start and end time
-            epoch = self.orbit.get_time_of_perihelion() - self.orbit.period * 5.0
-            step = self.orbit.period * 10.0 / (self.nbOfPoints - 1)
-        for i in range(self.nbOfPoints):
-            time = epoch + step * i
-            pos = self.orbit.get_position_at(time) - delta
-            vwriter.setData3f(*pos)
+        self.geom = self.create_geom()
+        self.node.remove_all_geoms()
+        self.node.addGeom(self.geom)
 
     def check_visibility(self, pixel_size):
         if self.parent.parent.visible and self.parent.shown and self.orbit:
@@ -188,16 +273,22 @@ class Orbit(VisibleObject):
 
     def update_instance(self, camera_pos, orientation):
         if self.instance:
+            #The vertices are in the orbit frame, the frame is applied on the instance
+            frame = self.orbit.frame
+            parent = self.body.parent
+            offset = frame.get_center() - parent.get_local_position()
             self.place_instance_params(self.instance,
-                                       self.body.parent.scene_position,
-                                       self.body.parent.scene_scale_factor,
-                                       LQuaternion())
+                                       parent.scene_position + offset * parent.scene_scale_factor,
+                                       parent.scene_scale_factor,
+                                       frame.get_orientation())
             self.shader.update(self, self.appearance)
 
     def update_user_parameters(self):
         if self.instance is not None:
             self.update_geom()
 
+orbitGeomCache = LRUCache('Orbits', settings.orbit_cache_max_entries, settings.orbit_cache_max_size * 1024 * 1024)
+
 class RotationAxis(VisibleObject):
     default_shown = False
     ignore_light = True
@@ -292,63 +383,49 @@ class Grid(VisibleObject):
         self.orientation = orientation
         self.color = color
 
+    def create_geoms(self):
+        angles = numpy.linspace(0, 2 * pi, self.nbOfPoints, endpoint=False)
+        #Rings
+        rings = numpy.arange(1, self.nbOfRings + 1) * pi / (self.nbOfRings + 1)
+        ring_points = numpy.empty((self.nbOfRings, self.nbOfPoints, 3))
+        ring_points[:, :, 0] = numpy.outer(numpy.sin(rings), numpy.cos(angles))
+        ring_points[:, :, 1] = numpy.outer(numpy.sin(rings), numpy.sin(angles))
+        ring_points[:, :, 2] = -numpy.cos(rings)[:, numpy.newaxis]
+        #Sectors, the segments near the poles are removed
+        sectors = numpy.arange(self.nbOfSectors) * 2 * pi / self.nbOfSectors
+        sector_angles = angles[self.points_to_remove:self.nbOfPoints // 2 - self.points_to_remove + 1]
+        sector_points = numpy.empty((self.nbOfSectors, len(sector_angles), 3))
+        sector_points[:, :, 0] = numpy.outer(numpy.cos(sectors), numpy.sin(sector_angles))
+        sector_points[:, :, 1] = numpy.outer(numpy.sin(sectors), numpy.sin(sector_angles))
+        sector_points[:, :, 2] = numpy.cos(sector_angles)[numpy.newaxis, :]
+        #The equator and the first sector are highlighted
+        equator = self.nbOfRings // 2
+        rings_selection = numpy.arange(self.nbOfRings) != equator
+        lines = make_lines_geom(numpy.concatenate((ring_points[rings_selection].reshape(-1, 3), sector_points[1:].reshape(-1, 3))),
+                                numpy.concatenate((make_polylines_indices([self.nbOfPoints] * (self.nbOfRings - 1), closed=True),
+                                                   make_polylines_indices([len(sector_angles)] * (self.nbOfSectors - 1)) + (self.nbOfRings - 1) * self.nbOfPoints)))
+        highlight = make_lines_geom(numpy.concatenate((ring_points[equator], sector_points[0])),
+                                    numpy.concatenate((make_polylines_indices([self.nbOfPoints], closed=True),
+                                                       make_polylines_indices([len(sector_angles)]) + self.nbOfPoints)))
+        return [lines, highlight]
+
     def create_instance(self):
-        self.vertexData = GeomVertexData('vertexData', GeomVertexFormat.getV3c4(), Geom.UHStatic)
-        self.vertexWriter = GeomVertexWriter(self.vertexData, 'vertex')
-        self.colorwriter = GeomVertexWriter(self.vertexData, 'color')
-        for r in range(1, self.nbOfRings + 1):
-            for i in range(self.nbOfPoints):
-                angle = 2 * pi / self.nbOfPoints * i
-                x = cos(angle) * sin( pi * r / (self.nbOfRings + 1) )
-                y = sin(angle) * sin( pi * r / (self.nbOfRings + 1) )
-                z = sin( -pi / 2 + pi * r / (self.nbOfRings + 1) )
-
-                self.vertexWriter.addData3f((self.context.observer.infinity * x, self.context.observer.infinity * y, self.context.observer.infinity * z))
-                if r == self.nbOfRings / 2 + 1:
-                    self.colorwriter.addData4(srgb_to_linear((self.color.x * 1.5, 0, 0, 1)))
-                else:
-                    self.colorwriter.addData4(srgb_to_linear(self.color))
-        for s in range(self.nbOfSectors):
-            for i in range(self.points_to_remove, self.nbOfPoints // 2 - self.points_to_remove + 1):
-                angle = 2 * pi / self.nbOfPoints * i
-                x = cos(2*pi * s / self.nbOfSectors) * sin(angle)
-                y = sin(2*pi * s / self.nbOfSectors) * sin(angle)
-                z = cos(angle)
-
-                self.vertexWriter.addData3f((self.context.observer.infinity * x , self.context.observer.infinity * y, self.context.observer.infinity * z))
-                if s == 0:
-                    self.colorwriter.addData4(srgb_to_linear((self.color.x * 1.5, 0, 0, 1)))
-                else:
-                    self.colorwriter.addData4(srgb_to_linear(self.color))
-        self.lines = GeomLines(Geom.UHStatic)
-        index = 0
-        for r in range(self.nbOfRings):
-            for i in range(self.nbOfPoints-1):
-                self.lines.addVertex(index)
-                self.lines.addVertex(index+1)
-                self.lines.closePrimitive()
-                index += 1
-            self.lines.addVertex(index)
-            self.lines.addVertex(index - self.nbOfPoints + 1)
-            self.lines.closePrimitive()
-            index += 1
-        for r in range(self.nbOfSectors):
-            for i in range(self.nbOfPoints // 2 - self.points_to_remove * 2):
-                self.lines.addVertex(index)
-                self.lines.addVertex(index+1)
-                self.lines.closePrimitive()
-                index += 1
-            index += 1
-        self.geom = Geom(self.vertexData)
-        self.geom.addPrimitive(self.lines)
+        key = ('grid', self.nbOfRings, self.nbOfSectors, self.nbOfPoints)
+        (lines, highlight) = annotationGeomCache.get(key, self.create_geoms, persistent=True)
         self.node = GeomNode("grid")
-        self.node.addGeom(self.geom)
+        self.node.addGeom(lines)
         self.instance = NodePath(self.node)
+        self.instance.setColor(srgb_to_linear(self.color))
+        highlight_node = GeomNode("grid-highlight")
+        highlight_node.addGeom(highlight)
+        self.highlight = self.instance.attachNewNode(highlight_node)
+        self.highlight.setColor(srgb_to_linear((self.color.x * 1.5, 0, 0, 1)))
         self.instance.setRenderModeThickness(settings.grid_thickness)
         #myMaterial = Material()
         #myMaterial.setEmission((1.0, 1.0, 1.0, 1))
         #self.instance.setMaterial(myMaterial)
         self.instance.reparentTo(self.context.annotation)
+        self.instance.setScale(self.context.observer.infinity)
         self.instance.setQuat(LQuaternion(*self.orientation))
 
     def set_orientation(self, orientation):
@@ -383,39 +460,27 @@ class Asterism(VisibleObject):
             decl /= len(self.segments[0])
             self.position = InfinitePosition(right_asc=ra, right_asc_unit=units.Rad, declination=decl, declination_unit=units.Rad)
 
-    def create_instance(self):
-        self.vertexData = GeomVertexData('vertexData', GeomVertexFormat.getV3c4(), Geom.UHStatic)
-        self.vertexWriter = GeomVertexWriter(self.vertexData, 'vertex')
-        self.colorwriter = GeomVertexWriter(self.vertexData, 'color')
-        #TODO: Ugly hack to calculate star position from the sun...
-        old_cam_pos = self.context.observer.camera_global_pos
-        self.context.observer.camera_global_pos = LPoint3d()
-        center = LPoint3d()
-        for segment in self.segments:
-            if len(segment) < 2: continue
+    def create_geoms(self):
+        segments = [segment for segment in self.segments if len(segment) >= 2]
+        positions = []
+        for segment in segments:
             for star in segment:
                 #TODO: Temporary workaround to have star pos
                 star.update(0)
-                star.update_obs(self.context.observer)
-                position, distance, scale_factor = self.get_real_pos_rel(star.rel_position, star.distance_to_obs, star.vector_to_obs)
-                self.vertexWriter.addData3f(*position)
-                self.colorwriter.addData4(srgb_to_linear(self.color))
-        self.context.observer.camera_global_pos = old_cam_pos
-        self.lines = GeomLines(Geom.UHStatic)
-        index = 0
-        for segment in self.segments:
-            if len(segment) < 2: continue
-            for i in range(len(segment)-1):
-                self.lines.addVertex(index)
-                self.lines.addVertex(index+1)
-                self.lines.closePrimitive()
-                index += 1
-            index += 1
-        self.geom = Geom(self.vertexData)
-        self.geom.addPrimitive(self.lines)
+                positions.append(tuple(star._global_position + star._local_position))
+        positions = numpy.array(positions, dtype=numpy.float64).reshape(-1, 3)
+        #Only the direction of the stars is kept, the segments are drawn at infinity
+        positions /= numpy.sqrt((positions ** 2).sum(axis=1))[:, numpy.newaxis]
+        return [make_lines_geom(positions, make_polylines_indices([len(segment) for segment in segments]))]
+
+    def create_instance(self):
+        key = ('asterism', self.get_name(), tuple(tuple(star.get_name() for star in segment) for segment in self.segments))
+        (lines,) = annotationGeomCache.get(key, self.create_geoms)
         self.node = GeomNode("asterism")
-        self.node.addGeom(self.geom)
+        self.node.addGeom(lines)
         self.instance = NodePath(self.node)
+        self.instance.setColor(srgb_to_linear(self.color))
+        self.instance.setScale(self.context.observer.infinity)
         self.instance.setRenderModeThickness(settings.asterism_thickness)
         self.instance.reparentTo(self.context.annotation)
         self.instance.setBin('background', settings.asterisms_depth)
@@ -472,26 +537,17 @@ class Boundary(VisibleObject):
     def set_points_list(self, points):
         self.points = points
 
+    def create_geoms(self):
+        positions = numpy.array([tuple(point.project(0, self.context.observer.camera_global_pos, 1.0)) for point in self.points], dtype=numpy.float64).reshape(-1, 3)
+        return [make_lines_geom(positions, make_polylines_indices([len(self.points)]))]
+
     def create_instance(self):
-        self.vertexData = GeomVertexData('vertexData', GeomVertexFormat.getV3c4(), Geom.UHStatic)
-        self.vertexWriter = GeomVertexWriter(self.vertexData, 'vertex')
-        self.colorwriter = GeomVertexWriter(self.vertexData, 'color')
-        for point in self.points:
-            position = point.project(0, self.context.observer.camera_global_pos, self.context.observer.infinity)
-            self.vertexWriter.addData3f(*position)
-            self.colorwriter.addData4(srgb_to_linear(self.color))
-        self.lines = GeomLines(Geom.UHStatic)
-        index = 0
-        for i in range(len(self.points)-1):
-            self.lines.addVertex(index)
-            self.lines.addVertex(index+1)
-            self.lines.closePrimitive()
-            index += 1
-        self.geom = Geom(self.vertexData)
-        self.geom.addPrimitive(self.lines)
+        (lines,) = annotationGeomCache.get(('boundary', self.get_name(), len(self.points)), self.create_geoms)
         self.node = GeomNode("boundary")
-        self.node.addGeom(self.geom)
+        self.node.addGeom(lines)
         self.instance = NodePath(self.node)
+        self.instance.setColor(srgb_to_linear(self.color))
+        self.instance.setScale(self.context.observer.infinity)
         self.instance.setRenderModeThickness(settings.boundary_thickness)
         self.instance.reparentTo(self.context.annotation)
         self.instance.setBin('background', settings.boundaries_depth)
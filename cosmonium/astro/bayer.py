@@ -22,6 +22,8 @@ from __future__ import print_function
 from __future__ import absolute_import
 
 from .. import settings
+import unicodedata
+import sys
 import re
 
 # The greek letter encoding follows gthe SIMBAD convention : http://simbad.u-strasbg.fr/guide/chA.htx
@@ -53,6 +55,18 @@ for constellation in constellations:
 
 greek_abv_match = re.compile("^([A-Z][A-Z\.]{0,2})(\d*) ([A-Za-z]{3})")
 
+greek_search_match = re.compile("^([A-Z]+\.?)(\d*) ")
+
+greek_bayer_key_match = re.compile("^([A-Z]+\.?)(\d*) ([A-Z]{3})( |$)")
+
+greek_utf8_abv_map = {}
+for (abv, letter) in greek_utf8_map.items():
+    greek_utf8_abv_map[letter] = abv
+
+greek_search_canonize = dict(greek_canonize)
+for (abv, text) in greek_word_map.items():
+    greek_search_canonize[text.upper()] = abv
+
 greek_word_match = re.compile("^([A-Za-z]+)(\d*) ")
 
 superscripts= [u'⁰', u'¹', u'²', u'³', u'⁴', u'⁵', u'⁶', u'⁷', u'⁸', u'⁹']
@@ -68,6 +82,55 @@ def canonize_name(name):
                 name = name.replace(greek, greek_canonize[greek], 1)
     return name
 
+def search_key(name):
+    """Return the plain key of a name, in upper case, without diacritics and with the
+    greek letters replaced by their abbreviation."""
+    if sys.version_info[0] < 3 and isinstance(name, str):
+        name = name.decode('utf-8')
+    name = unicodedata.normalize('NFKD', name)
+    key = ''
+    for char in name:
+        if unicodedata.combining(char): continue
+        abv = greek_utf8_abv_map.get(char)
+        if abv is not None:
+            key += abv
+        else:
+            key += char
+    return key.upper()
+
+def greek_variants(key, greek):
+    """Return the key with the greek word replaced by its canonical abbreviation and by its full name."""
+    abv = greek_search_canonize.get(greek, greek)
+    if abv not in greek_word_map:
+        return []
+    rest = key[len(greek):]
+    return [abv + rest, greek_word_map[abv].upper() + rest]
+
+def search_keys(name):
+    """Return the keys under which a name is indexed. Bayer designations are also indexed with the
+    canonical abbreviation and the full name of their greek letter, so that 'alpha cen', 'Alp Cen',
+    'Alph' and u'α Cen' all find 'ALF Cen'. The other names are only indexed by their plain key."""
+    key = search_key(name)
+    keys = [key]
+    match = greek_bayer_key_match.match(key)
+    if match and match.group(3).lower() in constellations_map:
+        for variant in greek_variants(key, match.group(1)):
+            if variant not in keys:
+                keys.append(variant)
+    return keys
+
+def query_keys(text):
+    """Return the keys to search for the given text. When the text starts with a complete greek
+    word, it is also searched with the other forms of the greek letter."""
+    key = search_key(text)
+    keys = [key]
+    match = greek_search_match.match(key)
+    if match:
+        for variant in greek_variants(key, match.group(1)):
+            if variant not in keys:
+                keys.append(variant)
+    return keys
+
 def decode_name(name):
     if not settings.convert_utf8: return name
     match = greek_abv_match.match(name)
@@ -25,3 +25,4 @@ except ImportError as e:
     print("WARNING: Could not load Kepler C implementation, fallback on python implementation")
     print("\t", e)
     from .pyastro.pykepler import kepler_pos
+from .pyastro.npkepler import kepler_pos_array, kepler_hyperbolic_array, kepler_parabolic_array
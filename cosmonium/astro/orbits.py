@@ -20,16 +20,17 @@
 from __future__ import print_function
 from __future__ import absolute_import
 
-from panda3d.core import LPoint3d, LVector3d, LQuaterniond
+from panda3d.core import LPoint3d, LVector3d, LQuaterniond, LMatrix3d
 
 from ..parameters import ParametersGroup, UserParameter, AutoUserParameter
 
 from . import units
 from .frame import J2000EclipticReferenceFrame, J2000EquatorialReferenceFrame
-from .kepler import kepler_pos
+from .kepler import kepler_pos, kepler_pos_array, kepler_hyperbolic_array, kepler_parabolic_array
 from .astro import calc_orientation
 
-from math import pi, asin, atan2
+from math import pi, asin, atan2, sqrt
+import numpy
 
 class Orbit(object):
     dynamic = False
@@ -200,6 +201,8 @@ class EllipticalOrbit(Orbit):
         self.arg_of_periapsis = arg_of_periapsis * pi / 180
         self.mean_anomaly = mean_anomaly * pi / 180
         self.epoch = epoch
+        self.cached_time = None
+        self.cached_position = None
         self.update_rotation()
 
     def set_period(self, period):
@@ -235,6 +238,7 @@ class EllipticalOrbit(Orbit):
         return group
 
     def update_user_parameters(self):
+        self.cached_time = None
         self.update_rotation()
 
     def is_periodic(self):
@@ -250,12 +254,69 @@ class EllipticalOrbit(Orbit):
         return abs(self.apocenter_distance)
 
     def get_frame_position_at(self, time):
+        if time == self.cached_time:
+            return LPoint3d(self.cached_position)
         mean_anomaly = (time - self.epoch) * self.mean_motion + self.mean_anomaly
         return kepler_pos(self.pericenter_distance, self.eccentricity, mean_anomaly)
 
+    @classmethod
+    def propagate(cls, orbits, time):
+        """Solve the position of all the given orbits at the given time in one call.
+        The positions are cached and returned by get_frame_position_at()."""
+        count = len(orbits)
+        pericenter_distance = numpy.fromiter((orbit.pericenter_distance for orbit in orbits), numpy.float64, count)
+        eccentricity = numpy.fromiter((orbit.eccentricity for orbit in orbits), numpy.float64, count)
+        epoch = numpy.fromiter((orbit.epoch for orbit in orbits), numpy.float64, count)
+        mean_motion = numpy.fromiter((orbit.mean_motion for orbit in orbits), numpy.float64, count)
+        mean_anomaly = numpy.fromiter((orbit.mean_anomaly for orbit in orbits), numpy.float64, count)
+        mean_anomaly += (time - epoch) * mean_motion
+        positions = kepler_pos_array(pericenter_distance, eccentricity, mean_anomaly)
+        for (orbit, position) in zip(orbits, positions.tolist()):
+            orbit.cached_time = time
+            orbit.cached_position = LPoint3d(*position)
+
     def get_frame_rotation_at(self, time):
         return self.rotation
 
+    def get_shape_key(self):
+        return (self.pericenter_distance, self.eccentricity, self.inclination, self.ascending_node, self.arg_of_periapsis)
+
+    def sample_shape(self, nb_points):
+        """Return nb_points positions along the orbit in the orbit frame as an (N, 3) array.
+        The samples are denser where the curvature is high and near the pericenter.
+        Non periodic orbits are sampled over ten periods around the time of perihelion."""
+        e = self.eccentricity
+        q = self.pericenter_distance
+        positions = numpy.zeros((nb_points, 3))
+        if e < 1.0:
+            a = q / (1.0 - e)
+            b = a * sqrt(1.0 - e * e)
+            u = numpy.linspace(0.0, 2 * pi, nb_points, endpoint=False)
+            #Eccentric anomaly giving a constant turn of the tangent between samples
+            curvature_anomaly = numpy.mod(numpy.arctan2(b * numpy.sin(u), a * numpy.cos(u)), 2 * pi)
+            #Eccentric anomaly giving a constant step of true anomaly
+            true_anomaly = 2 * numpy.arctan2(sqrt(1.0 - e) * numpy.sin(u / 2), sqrt(1.0 + e) * numpy.cos(u / 2))
+            ecc_anom = (curvature_anomaly + true_anomaly) / 2
+            positions[:, 0] = a * (numpy.cos(ecc_anom) - e)
+            positions[:, 1] = b * numpy.sin(ecc_anom)
+        elif e > 1.0:
+            a = q / (e - 1.0)
+            b = a * sqrt(e * e - 1.0)
+            max_anom = kepler_hyperbolic_array(numpy.array([e]), numpy.array([10 * pi]))[0]
+            ecc_anom = numpy.linspace(-max_anom, max_anom, nb_points)
+            positions[:, 0] = a * (e - numpy.cosh(ecc_anom))
+            positions[:, 1] = b * numpy.sinh(ecc_anom)
+        else:
+            max_anom = kepler_parabolic_array(numpy.array([10 * pi]))[0]
+            true_anom = numpy.linspace(-max_anom, max_anom, nb_points)
+            r = 2 * q / (1 + numpy.cos(true_anom))
+            positions[:, 0] = r * numpy.cos(true_anom)
+            positions[:, 1] = r * numpy.sin(true_anom)
+        rotation = LMatrix3d()
+        self.rotation.extract_to_matrix(rotation)
+        matrix = numpy.array([[rotation[i][j] for j in range(3)] for i in range(3)])
+        return positions.dot(matrix)
+
 def create_elliptical_orbit(semi_major_axis=None,
                             semi_major_axis_units=units.AU,
                             pericenter_distance=None,
@@ -0,0 +1,157 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from .pykepler import THRESH, MIN_THRESH, MAX_DEFAULT_ITERATIONS, MAX_ITERATIONS
+
+from math import pi
+import numpy
+
+#Vectorized version of pykepler, all the orbits are solved together
+
+MAX_SERIES_TERMS = 200
+
+def near_parabolic_array(ecc_anom, e):
+    anom2 = numpy.where(e > 1.0, ecc_anom * ecc_anom, -ecc_anom * ecc_anom)
+    term = e * anom2 * ecc_anom / 6.0
+    rval = (1.0 - e) * ecc_anom - term
+    n = 4
+    active = numpy.abs(term) > 1e-15
+    while active.any() and n < MAX_SERIES_TERMS:
+        term = numpy.where(active, term * anom2 / (n * (n + 1)), 0.0)
+        rval -= term
+        n += 2
+        active = numpy.abs(term) > 1e-15
+    return rval
+
+def kepler_elliptic_array(ecc, mean_anom):
+    ecc = numpy.asarray(ecc, dtype=numpy.float64)
+    mean_anom = numpy.asarray(mean_anom, dtype=numpy.float64)
+    tmod = numpy.fmod(mean_anom, pi * 2.0)
+    tmod = numpy.where(tmod > pi, tmod - 2.0 * pi, tmod)
+    tmod = numpy.where(tmod < -pi, tmod + 2.0 * pi, tmod)
+    offset = mean_anom - tmod
+    mean_anom = tmod
+    result = numpy.empty_like(mean_anom)
+
+    low = ecc < 0.9
+    if low.any():
+        e = ecc[low]
+        m = mean_anom[low]
+        curr = numpy.arctan2(numpy.sin(m), numpy.cos(m) - e)
+        active = numpy.ones(len(m), dtype=bool)
+        n_iter = 0
+        while active.any() and n_iter < MAX_ITERATIONS:
+            err = (curr - e * numpy.sin(curr) - m) / (1.0 - e * numpy.cos(curr))
+            curr = numpy.where(active, curr - err, curr)
+            active &= numpy.abs(err) > THRESH
+            n_iter += 1
+        result[low] = curr
+
+    high = ~low
+    if high.any():
+        e = ecc[high]
+        m = mean_anom[high]
+        is_negative = m < 0.0
+        m = numpy.abs(m)
+        curr = m.copy()
+        thresh = numpy.maximum(THRESH * numpy.abs(1.0 - e), MIN_THRESH)
+        start = (e > 0.8) & (m < pi / 3.0)
+        trial = m / numpy.abs(1.0 - e)
+        trial = numpy.where(trial * trial > 6.0 * numpy.abs(1.0 - e), numpy.cbrt(6.0 * m), trial)
+        curr = numpy.where(start, trial, curr)
+        thresh = numpy.where(start, numpy.minimum(thresh, THRESH), thresh)
+        active = numpy.ones(len(m), dtype=bool)
+        n_iter = 0
+        while active.any() and n_iter < MAX_ITERATIONS:
+            if n_iter > MAX_DEFAULT_ITERATIONS:
+                err = near_parabolic_array(curr, e) - m
+            else:
+                err = curr - e * numpy.sin(curr) - m
+            delta_curr = -err / (1.0 - e * numpy.cos(curr))
+            curr = numpy.where(active, curr + delta_curr, curr)
+            active &= numpy.abs(delta_curr) > thresh
+            n_iter += 1
+        result[high] = numpy.where(is_negative, -curr, curr)
+    return result + offset
+
+def kepler_parabolic_array(mean_anom):
+    a = 3.0 / (2 * numpy.sqrt(2)) * numpy.asarray(mean_anom, dtype=numpy.float64)
+    b = numpy.cbrt(a + numpy.sqrt(a * a + 1))
+    true_anom = 2 * numpy.arctan(b - 1 / b)
+    return true_anom
+
+def kepler_hyperbolic_array(ecc, mean_anom):
+    ecc = numpy.asarray(ecc, dtype=numpy.float64)
+    mean_anom = numpy.asarray(mean_anom, dtype=numpy.float64)
+    is_negative = mean_anom < 0.0
+    m = numpy.abs(mean_anom)
+    thresh = numpy.maximum(THRESH * numpy.abs(1.0 - ecc), MIN_THRESH)
+    far = m / ecc > 3.0
+    trial = m / numpy.abs(1.0 - ecc)
+    trial = numpy.where(trial * trial > 6. * numpy.abs(1.0 - ecc), numpy.cbrt(6. * m), trial)
+    with numpy.errstate(divide='ignore'):
+        curr = numpy.where(far, numpy.log(m / ecc) + 0.85, trial)
+    thresh = numpy.where(far, thresh, numpy.minimum(thresh, THRESH))
+    active = m != 0.0
+    curr = numpy.where(active, curr, 0.0)
+    near = ecc < 1.01
+    n_iter = 0
+    while active.any() and n_iter < MAX_ITERATIONS:
+        err = ecc * numpy.sinh(curr) - curr - m
+        if n_iter > MAX_DEFAULT_ITERATIONS and near.any():
+            err = numpy.where(near, -near_parabolic_array(curr, ecc) - m, err)
+        delta_curr = -err / (ecc * numpy.cosh(curr) - 1.0)
+        curr = numpy.where(active, curr + delta_curr, curr)
+        active &= numpy.abs(delta_curr) > thresh
+        n_iter += 1
+    return numpy.where(is_negative, -curr, curr)
+
+def kepler_pos_array(pericenter, ecc, mean_anom):
+    """Return the positions in the orbital plane of all the given orbits as an (N, 3) array."""
+    pericenter = numpy.asarray(pericenter, dtype=numpy.float64)
+    ecc = numpy.asarray(ecc, dtype=numpy.float64)
+    mean_anom = numpy.asarray(mean_anom, dtype=numpy.float64)
+    positions = numpy.zeros((len(ecc), 3), dtype=numpy.float64)
+
+    elliptic = ecc < 1.0
+    if elliptic.any():
+        e = ecc[elliptic]
+        ecc_anom = kepler_elliptic_array(e, mean_anom[elliptic])
+        a = pericenter[elliptic] / (1.0 - e)
+        positions[elliptic, 0] = a * (numpy.cos(ecc_anom) - e)
+        positions[elliptic, 1] = a * numpy.sqrt(1 - e * e) * numpy.sin(ecc_anom)
+
+    parabolic = ecc == 1.0
+    if parabolic.any():
+        true_anom = kepler_parabolic_array(mean_anom[parabolic])
+        r = 2 * pericenter[parabolic] / (1 + numpy.cos(true_anom))
+        positions[parabolic, 0] = r * numpy.cos(true_anom)
+        positions[parabolic, 1] = r * numpy.sin(true_anom)
+
+    hyperbolic = ecc > 1.0
+    if hyperbolic.any():
+        e = ecc[hyperbolic]
+        ecc_anom = kepler_hyperbolic_array(e, mean_anom[hyperbolic])
+        a = pericenter[hyperbolic] / (e - 1.0)
+        positions[hyperbolic, 0] = a * (e - numpy.cosh(ecc_anom))
+        positions[hyperbolic, 1] = a * numpy.sqrt(e * e - 1) * numpy.sinh(ecc_anom)
+    return positions
@@ -0,0 +1,123 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from panda3d.core import PandaSystem
+
+from .bodies import StellarObject
+from . import pstats
+from . import settings
+
+import platform
+import numpy
+import json
+
+class Benchmark(object):
+    """Record the wall time of the passes of Cosmonium.time_task and the number of processed bodies
+    for each frame, between start() and stop()."""
+    passes = ['time_task', 'update_octree', 'update_universe', 'update_obs', 'update_visibility', 'update_instances']
+    counters = ['nb_update', 'nb_obs', 'nb_visibility', 'nb_instance']
+
+    def __init__(self, name, warmup_frames=10):
+        self.name = name
+        self.warmup_frames = warmup_frames
+        self.nb_frames = 0
+        self.timings = dict((name, []) for name in self.passes)
+        self.counts = dict((name, []) for name in self.counters)
+        self.task = None
+
+    def start(self):
+        pstats.frame_timings.clear()
+        pstats.record_timings = True
+        #Must run after the time task
+        self.task = taskMgr.add(self.frame_task, 'benchmark-frame', sort=1)
+
+    def stop(self):
+        pstats.record_timings = False
+        if self.task is not None:
+            taskMgr.remove(self.task)
+            self.task = None
+
+    def frame_task(self, task):
+        self.nb_frames += 1
+        if self.nb_frames > self.warmup_frames:
+            for name in self.passes:
+                self.timings[name].append(pstats.frame_timings.get(name, 0.0))
+            for name in self.counters:
+                self.counts[name].append(getattr(StellarObject, name))
+        return task.cont
+
+    def get_results(self):
+        """Return the statistics of the recorded frames, the timings are in ms."""
+        passes = {}
+        for name in self.passes:
+            timings = numpy.array(self.timings[name]) * 1000.0
+            if len(timings) == 0: continue
+            passes[name] = {'mean': float(timings.mean()),
+                            'median': float(numpy.median(timings)),
+                            'p95': float(numpy.percentile(timings, 95)),
+                            'max': float(timings.max())}
+        counters = {}
+        for name in self.counters:
+            if len(self.counts[name]) == 0: continue
+            counters[name] = float(numpy.mean(self.counts[name]))
+        return {'name': self.name,
+                'frames': self.nb_frames - self.warmup_frames,
+                'version': settings.version,
+                'python': platform.python_version(),
+                'panda': PandaSystem.getVersionString(),
+                'passes': passes,
+                'counters': counters}
+
+    def save(self, filename):
+        print("Writing benchmark results to", filename)
+        with open(filename, 'w') as f:
+            json.dump(self.get_results(), f, indent=2, sort_keys=True)
+
+def load_results(filename):
+    try:
+        with open(filename) as f:
+            return json.load(f)
+    except (IOError, ValueError) as e:
+        print("Could not read benchmark results", filename, ':', e)
+        return None
+
+def compare_results(results, baseline, tolerance=0.2, min_delta=0.05):
+    """Compare the median time of each pass with the baseline and return the list of
+    (pass, baseline median, median) that are slower by more than the given ratio.
+    Differences smaller than min_delta ms are ignored as noise."""
+    regressions = []
+    for (name, stats) in sorted(results['passes'].items()):
+        base_stats = baseline.get('passes', {}).get(name)
+        if base_stats is None:
+            print("%-20s %8.3f ms (no baseline)" % (name, stats['median']))
+            continue
+        delta = stats['median'] - base_stats['median']
+        ratio = delta / base_stats['median'] if base_stats['median'] > 0 else 0.0
+        print("%-20s %8.3f ms (baseline %8.3f ms, %+.1f%%)" % (name, stats['median'], base_stats['median'], ratio * 100))
+        if delta > min_delta and ratio > tolerance:
+            regressions.append((name, base_stats['median'], stats['median']))
+    for (name, count) in sorted(results['counters'].items()):
+        base_count = baseline.get('counters', {}).get(name)
+        if base_count is not None and base_count != count:
+            print("%-20s %8.1f bodies (baseline %8.1f), the benchmark scene has changed" % (name, count, base_count))
+    return regressions
@@ -29,7 +29,7 @@ from .surfaces import FlatSurface
 from .appearances import Appearance
 from .annotations import ReferenceAxis, RotationAxis, Orbit
 from .astro.frame import SynchroneReferenceFrame
-from .astro.orbits import FixedOrbit, FixedPosition
+from .astro.orbits import FixedOrbit, FixedPosition, EllipticalOrbit
 from .astro.rotations import UnknownRotation
 from .astro.astro import abs_to_app_mag, lum_to_abs_mag, abs_mag_to_lum, temp_to_radius
 from .astro.spectraltype import SpectralType, spectralTypeStringDecoder
@@ -432,6 +432,11 @@ class StellarObject(LabelledObject):
     def first_update(self, time):
         self.update(time)
 
+    def collect_orbits(self, orbits):
+        """Collect the elliptical orbits that will be evaluated by update()."""
+        if isinstance(self.orbit, EllipticalOrbit):
+            orbits.append(self.orbit)
+
     def update(self, time):
         StellarObject.nb_update += 1
         self._orientation = self.rotation.get_rotation_at(time)
@@ -666,13 +671,16 @@ class StellarBody(StellarObject):
         self.remove_component(self.clouds)
         self.remove_component(self.atmosphere)
 
-    def configure_shape(self):
+    def get_shape_scale(self):
         if self.scale is not None:
-            scale = self.scale
+            return self.scale
         elif self.oblateness is not None:
-            scale = LVector3(1.0, 1.0, 1.0 - self.oblateness) * self.radius
+            return LVector3(1.0, 1.0, 1.0 - self.oblateness) * self.radius
         else:
-            scale = LVector3(self.radius, self.radius, self.radius)
+            return LVector3(self.radius, self.radius, self.radius)
+
+    def configure_shape(self):
+        scale = self.get_shape_scale()
         #TODO: should be done on all components
         if self.surface is not None:
             self.surface.set_scale(scale)
@@ -781,27 +789,6 @@ class ReflectiveBody(StellarBody):
         phase = (1.0 + angle) / 2.0
         return phase
 
-    def check_cast_shadow_on(self, body):
-        position = self.get_local_position()
-        body_position = body.get_local_position()
-        pa = body_position - position
-        self_radius = self.get_apparent_radius()
-        #TODO: should be refactored somehow
-        self_ar = self.radius / pa.length()
-        star_ar = self.star.get_apparent_radius() / (self.star._local_position - body_position).length()
-        ar_ratio = star_ar / self_ar
-        #TODO: No longer valid if we are using HDR
-        if ar_ratio * ar_ratio > 255:
-            #the shadow coef is smaller than the min change in pixel color
-            #the umbra will have no visible impact
-            return False
-        distance_vector = pa - self.vector_to_star * self.vector_to_star.dot(pa)
-        distance = distance_vector.length()
-        projected = self.vector_to_star * self.vector_to_star.dot(body_position)
-        face = self.vector_to_star.dot(projected - position)
-        radius = (1 + ar_ratio) * self_radius + body.get_apparent_radius()
-        return face < 0.0 and distance < radius
-
     def start_shadows_update(self):
         self.surface.start_shadows_update()
         #TODO: this should be done by looping over components
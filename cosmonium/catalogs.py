@@ -16,15 +16,85 @@
 #You should have received a copy of the GNU General Public License
 #along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
 #
+from panda3d.core import LPoint3d
+
 from .utils import int_to_color
+from .astro.bayer import search_keys, query_keys
+
+from bisect import bisect_left
+from heapq import merge
+from itertools import islice
+from operator import itemgetter
+
+class PrefixIndex(object):
+    """Sorted index of names used for prefix searches.
+    The names are indexed using their search keys, see bayer.search_keys().
+    New names are appended to a pending list which is merged when the index is searched."""
+    def __init__(self):
+        self.keys = []
+        self.entries = []
+        self.pending = []
+
+    def add(self, name, value):
+        for key in search_keys(name):
+            self.pending.append((key, name, value))
+
+    def flush(self):
+        if not self.pending: return
+        self.entries += self.pending
+        self.pending = []
+        #The entries are already sorted, the sort only has to merge the new ones
+        self.entries.sort(key=itemgetter(0))
+        self.keys = [entry[0] for entry in self.entries]
+
+    def remove(self, name, value):
+        self.flush()
+        for key in search_keys(name):
+            position = bisect_left(self.keys, key)
+            while position < len(self.keys) and self.keys[position] == key:
+                entry = self.entries[position]
+                if entry[1] == name and entry[2] is value:
+                    del self.keys[position]
+                    del self.entries[position]
+                else:
+                    position += 1
+
+    def iter_search(self, key):
+        """Iterate over the (key, name, value) entries whose key starts with the given key, in key order.
+        A name indexed under several keys is only returned once."""
+        self.flush()
+        found = set()
+        position = bisect_left(self.keys, key)
+        while position < len(self.keys) and self.keys[position].startswith(key):
+            entry = self.entries[position]
+            position += 1
+            if (entry[1], entry[2]) in found: continue
+            found.add((entry[1], entry[2]))
+            yield entry
+
+    def search(self, key, limit=None):
+        """Return the (key, name, value) entries whose key starts with the given key, in key order."""
+        return list(islice(self.iter_search(key), limit))
+
+def unique_values(entries, limit=None):
+    result = []
+    found = set()
+    for (key, name, value) in entries:
+        if value in found: continue
+        found.add(value)
+        result.append((name, value))
+        if limit is not None and len(result) >= limit: break
+    return result
 
 class ObjectsDB(object):
     def __init__(self):
         self.db = {}
+        self.index = PrefixIndex()
 
     def add(self, body):
         for name in body.names:
             self.db[name.upper()] = body
+            self.index.add(name, body)
 
     def get(self, name):
         return self.db.get(name.upper(), None)
@@ -32,19 +102,142 @@ class ObjectsDB(object):
     def remove(self, body):
         for name in body.names:
             self.db.pop(name.upper(), None)
+            self.index.remove(name, body)
 
-    def startswith(self, text):
-        text = text.upper()
-        result = []
-        for (key, value) in self.db.items():
-            if key.startswith(text):
-                result.append(value)
-        return result
+    def startswith(self, text, limit=None):
+        #The same body can be found under several names, so the limit can not be used directly on the index
+        entries = merge(*[self.index.iter_search(key) for key in query_keys(text)], key=itemgetter(0))
+        return [value for (name, value) in unique_values(entries, limit)]
+
+class CatalogEntry(object):
+    """Placeholder of a body of a lazy catalog, used as octree leaf until the body is created."""
+    __slots__ = ('catalog', 'index', 'update_id')
+
+    def __init__(self, catalog, index):
+        self.catalog = catalog
+        self.index = index
+        self.update_id = 0
+
+    @property
+    def abs_magnitude(self):
+        return self.catalog.get_abs_magnitude(self.index)
+
+    @property
+    def _global_position(self):
+        return self.catalog.get_global_position(self.index)
+
+    @property
+    def _extend(self):
+        return self.catalog.get_extend(self.index)
+
+    def get_global_position(self):
+        return self.catalog.get_global_position(self.index)
+
+    def get_abs_magnitude(self):
+        return self.catalog.get_abs_magnitude(self.index)
+
+    def get_extend(self):
+        return self.catalog.get_extend(self.index)
+
+    def get_name(self):
+        return self.catalog.get_name(self.index)
+
+    def get_body(self):
+        return self.catalog.get_body(self.index)
+
+class LazyCatalog(object):
+    """Catalog of bodies which are only created when looked up or visible.
+    Sub-classes must implement get_nb_entries(), create_body() and the accessors
+    used by the octree."""
+    def __init__(self, parent):
+        self.parent = parent
+        self.bodies = {}
+        self.indexes = {}
+        self.removed = set()
+        self.entries = {}
+
+    def get_nb_entries(self):
+        return 0
+
+    def get_leaf(self, index):
+        """Return the octree leaf of the entry, it is only created when the octree reaches it."""
+        entry = self.entries.get(index)
+        if entry is None:
+            entry = CatalogEntry(self, index)
+            self.entries[index] = entry
+        return entry
+
+    def get_entries(self):
+        return [self.get_leaf(index) for index in range(self.get_nb_entries())]
+
+    def get_arrays(self):
+        """Return the positions, absolute magnitudes and extends of all the entries,
+        or None if the catalog can not provide them as arrays."""
+        return None
+
+    def get_global_position(self, index):
+        return LPoint3d()
+
+    def get_abs_magnitude(self, index):
+        return 99.0
+
+    def get_extend(self, index):
+        return 0.0
+
+    def get_name(self, index):
+        return None
+
+    def find_index(self, name_up):
+        return None
+
+    def search(self, key):
+        """Return an iterator over the (key, name, index) entries whose key starts with the given key, in key order."""
+        return iter(())
+
+    def create_body(self, index):
+        return None
+
+    def get_body(self, index):
+        body = self.bodies.get(index)
+        if body is None and index not in self.removed:
+            body = self.create_body(index)
+            self.bodies[index] = body
+            self.indexes[body] = index
+            self.parent.add_child_fast(body)
+        return body
+
+    def owns(self, body):
+        return body in self.indexes
+
+    def get(self, name_up):
+        index = self.find_index(name_up)
+        if index is not None:
+            return self.get_body(index)
+        else:
+            return None
+
+    def search_not_created(self, key):
+        """Iterate over the (key, name, (catalog, index)) entries of the bodies not yet created."""
+        #The bodies already created are registered in the objects DB
+        for (entry_key, name, index) in self.search(key):
+            if index not in self.bodies and index not in self.removed:
+                yield (entry_key, name, (self, index))
+
+    def remove(self, body):
+        index = self.indexes.pop(body, None)
+        if index is not None:
+            del self.bodies[index]
+            self.removed.add(index)
 
 class GlobalObjectsDB(object):
     def __init__(self):
         self.db = {}
+        self.index = PrefixIndex()
         self.oids = []
+        self.catalogs = []
+
+    def add_catalog(self, catalog):
+        self.catalogs.append(catalog)
 
     def add(self, body):
         body.oid = len(self.oids)
@@ -52,9 +245,16 @@ class GlobalObjectsDB(object):
         self.oids.append(body)
         for name in body.names:
             self.db[name.upper()] = body
+            self.index.add(name, body)
 
     def get(self, name):
-        return self.db.get(name.upper(), None)
+        name_up = name.upper()
+        result = self.db.get(name_up, None)
+        if result is None:
+            for catalog in self.catalogs:
+                result = catalog.get(name_up)
+                if result is not None: break
+        return result
 
     def get_oid(self, oid):
         if oid < len(self.oids):
@@ -65,14 +265,32 @@ class GlobalObjectsDB(object):
     def remove(self, body):
         for name in body.names:
             self.db.pop(name.upper(), None)
+            self.index.remove(name, body)
         self.oids[body.oid] = None
+        for catalog in self.catalogs:
+            catalog.remove(body)
 
-    def startswith(self, text):
-        text = text.upper()
-        result = []
-        for (key, value) in self.db.items():
-            if key.startswith(text):
-                result.append(value)
-        return result
+    def list_startswith(self, text, limit=None):
+        """Return the sorted list of (name, value) whose name starts with the given text.
+        The value is either the body or, for the bodies of a catalog not yet created, a (catalog, index) pair
+        which is only turned into a body by resolve().
+        The search is case and diacritic insensitive and accepts the various forms of Bayer names."""
+        sources = []
+        for key in query_keys(text):
+            sources.append(self.index.iter_search(key))
+            for catalog in self.catalogs:
+                sources.append(catalog.search_not_created(key))
+        #Each source is sorted, the merge stops as soon as enough entries are found
+        return unique_values(merge(*sources, key=itemgetter(0)), limit)
+
+    def resolve(self, value):
+        """Return the body of a value returned by list_startswith(), the body of a catalog entry is created if needed."""
+        if isinstance(value, tuple):
+            (catalog, index) = value
+            value = catalog.get_body(index)
+        return value
+
+    def startswith(self, text, limit=None):
+        return [self.resolve(value) for (name, value) in self.list_startswith(text, limit)]
 
 objectsDB = GlobalObjectsDB()
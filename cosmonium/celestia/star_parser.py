@@ -19,14 +19,15 @@
 
 from __future__ import print_function
 
-from panda3d.core import LVector3d
+from panda3d.core import LPoint3d
 
 from ..universe import Universe
 from ..bodies import Star
+from ..catalogs import LazyCatalog, PrefixIndex
 from ..astro.spectraltype import spectralTypeStringDecoder, spectralTypeIntDecoder
 from ..astro.orbits import FixedPosition
 from ..astro.rotations import UnknownRotation
-from ..astro.astro import app_to_abs_mag
+from ..astro.astro import app_to_abs_mag, magnitude_brightness_ratio
 from ..astro import bayer
 from ..astro import units
 from ..dircontext import defaultDirContext
@@ -34,6 +35,7 @@ from ..dircontext import defaultDirContext
 from .bodies import celestiaStarSurfaceFactory
 
 from time import time
+import numpy
 import struct
 import sys
 import io
@@ -80,6 +82,108 @@ def load_text(filename, names, universe, context=defaultDirContext):
         print("File not found", filename)
         return {}
 
+star_dtype = numpy.dtype([('catNo', '<i4'),
+                         ('x', '<f4'), ('y', '<f4'), ('z', '<f4'),
+                         ('abs_magnitude', '<i2'),
+                         ('spectral_type', '<i2')])
+
+class CelestiaStarCatalog(LazyCatalog):
+    """Columnar view of a Celestia binary star catalog, the stars are created on demand."""
+    hip_re = re.compile(r'^HIP (\d+)$')
+
+    def __init__(self, universe, data, names):
+        LazyCatalog.__init__(self, universe)
+        self.data = data
+        self.names = names
+        self.cat_nos = numpy.asarray(data['catNo'])
+        self.order = numpy.argsort(self.cat_nos, kind='stable')
+        self.sorted_cat_nos = self.cat_nos[self.order]
+        self.positions = numpy.empty((len(data), 3), dtype=numpy.float64)
+        self.positions[:, 0] = data['x']
+        self.positions[:, 1] = data['z']
+        self.positions[:, 1] *= -1
+        self.positions[:, 2] = data['y']
+        self.positions *= units.Ly
+        self.abs_magnitudes = data['abs_magnitude'] / 256.0
+        codes, self.spectral_indexes = numpy.unique(data['spectral_type'], return_inverse=True)
+        self.spectral_types = [spectralTypeIntDecoder.decode(int(code)) for code in codes]
+        self.extends = self.calc_radius()
+        self.names_index = {}
+        self.prefix_index = PrefixIndex()
+        for (catNo, aliases) in names.items():
+            index = self.find_cat_no(catNo)
+            if index is None: continue
+            for name in aliases:
+                self.names_index[name.upper()] = catNo
+                self.prefix_index.add(name, index)
+
+    def calc_radius(self):
+        temperatures = numpy.array([spectral_type.temperature for spectral_type in self.spectral_types], dtype=numpy.float64)
+        white_dwarfs = numpy.array([spectral_type.white_dwarf for spectral_type in self.spectral_types], dtype=bool)
+        temperature_ratio = units.sun_temperature / temperatures[self.spectral_indexes]
+        luminosity_ratio = numpy.power(magnitude_brightness_ratio, units.sun_abs_magnitude - self.abs_magnitudes)
+        radius = temperature_ratio * temperature_ratio * numpy.sqrt(luminosity_ratio) * units.sun_radius
+        #TODO: Find radius-luminosity relationship or use mass
+        radius[white_dwarfs[self.spectral_indexes]] = 7000.0
+        return radius
+
+    def get_nb_entries(self):
+        return len(self.cat_nos)
+
+    def find_cat_no(self, catNo):
+        pos = numpy.searchsorted(self.sorted_cat_nos, catNo)
+        if pos < len(self.sorted_cat_nos) and self.sorted_cat_nos[pos] == catNo:
+            return int(self.order[pos])
+        return None
+
+    def find_index(self, name_up):
+        catNo = self.names_index.get(name_up)
+        if catNo is None:
+            match = self.hip_re.match(name_up)
+            if match is None: return None
+            catNo = int(match.group(1))
+        return self.find_cat_no(catNo)
+
+    def search(self, key):
+        #Only the named stars are listed, the anonymous stars can only be found using their full name
+        return self.prefix_index.iter_search(key)
+
+    def get_arrays(self):
+        return (self.positions, self.abs_magnitudes, self.extends)
+
+    def get_global_position(self, index):
+        position = self.positions[index]
+        return LPoint3d(position[0], position[1], position[2])
+
+    def get_abs_magnitude(self, index):
+        return float(self.abs_magnitudes[index])
+
+    def get_extend(self, index):
+        return float(self.extends[index])
+
+    def get_name(self, index):
+        catNo = int(self.cat_nos[index])
+        if catNo in self.names:
+            return self.names[catNo][0]
+        else:
+            return "HIP %d" % catNo
+
+    def create_body(self, index):
+        catNo = int(self.cat_nos[index])
+        if catNo in self.names:
+            name = self.names[catNo]
+        else:
+            name = "HIP %d" % catNo
+        orbit = FixedPosition(position=self.get_global_position(index))
+        star = Star(name,
+                    radius=self.get_extend(index),
+                    surface_factory=celestiaStarSurfaceFactory,
+                    spectral_type=self.spectral_types[self.spectral_indexes[index]],
+                    abs_magnitude=self.get_abs_magnitude(index),
+                    orbit=orbit,
+                    rotation=UnknownRotation())
+        return star
+
 def do_load_bin(filepath, names, universe):
     start = time()
     print("Loading", filepath)
@@ -87,6 +191,7 @@ def do_load_bin(filepath, names, universe):
     data = open(filepath, 'rb')
     field=data.read(8+2+4)
     header, version, count = struct.unpack("<8shi", field)
+    data.close()
     if not header == b"CELSTARS":
         print("Invalid header", header)
         return
@@ -94,24 +199,12 @@ def do_load_bin(filepath, names, universe):
         print("Invalid version", version)
         return
     print("Found", count, "stars")
-    fmt="<ifffhh"
-    size=struct.calcsize(fmt)
-    for i in range(count):
-        fields = data.read(size)
-        catNo, x, y, z, abs_magnitude, spectral_type = struct.unpack(fmt, fields)
-        if catNo in names:
-            name = names[catNo]
-        else:
-            name = "HIP %d" % catNo
-        position = LVector3d(x * units.Ly, -z * units.Ly, y * units.Ly)
-        orbit = FixedPosition(position=position)
-        star = Star(name,
-                    surface_factory=celestiaStarSurfaceFactory,
-                    spectral_type=spectralTypeIntDecoder.decode(spectral_type),
-                    abs_magnitude=abs_magnitude / 256.0,
-                    orbit=orbit,
-                    rotation=UnknownRotation())
-        universe.add_child_fast(star)
+    try:
+        stars = numpy.memmap(filepath, dtype=star_dtype, mode='r', offset=len(field), shape=(count,))
+    except (OSError, ValueError) as e:
+        print("Could not map", filepath, e)
+        stars = numpy.fromfile(filepath, dtype=star_dtype, count=count, offset=len(field))
+    universe.add_catalog(CelestiaStarCatalog(universe, stars, names))
     end = time()
     print("Load time:", end - start)
 
@@ -35,14 +35,19 @@ from .foundation import BaseObject
 from .dircontext import defaultDirContext
 from .opengl import request_opengl_config, check_opengl_config, create_main_window, check_and_create_rendering_buffers
 from .bodies import StellarBody, ReflectiveBody
-from .systems import StellarSystem, SimpleSystem
+from .systems import StellarSystem, SimpleSystem, ShadowPairScheduler
 from .universe import Universe
-from .annotations import Grid
+from .annotations import Grid, orbitGeomCache
 from .pointsset import PointsSet
 from .sprites import RoundDiskPointSprite, GaussianPointSprite, ExpPointSprite, MergeSprite
 from .astro.frame import J2000EquatorialReferenceFrame, J2000EclipticReferenceFrame
 from .astro.frame import AbsoluteReferenceFrame, SynchroneReferenceFrame, RelativeReferenceFrame
 from .celestia.cel_url import CelUrl
+from .snapshot import UniverseSnapshot
+from .profiler import FrameProfiler
+from .procedural.patchcache import patchCache
+from .procedural import npnoise
+from .textures import textureTileCache
 
 #import orbits and rotations elements to add them to the DB
 from .astro.tables import uniform, vsop87, wgccre
@@ -58,6 +63,7 @@ from .nav import FreeNav, WalkNav
 from .astro import units
 from .fonts import fontsManager
 from .pstats import pstat
+from .shaders import shaderSources
 from . import utils
 from . import workers
 from . import cache
@@ -84,7 +90,7 @@ class CosmoniumBase(ShowBase):
         self.print_info()
         self.panda_config()
         ShowBase.__init__(self, windowType='none')
-        if not self.app_config.test_start:
+        if not self.app_config.headless:
             create_main_window(self)
             check_opengl_config(self)
         else:
@@ -98,6 +104,8 @@ class CosmoniumBase(ShowBase):
         self.disableMouse()
         self.render_textures = check_and_create_rendering_buffers(self)
         cache.init_cache()
+        if settings.cache_shaders and settings.preload_shaders:
+            shaderSources.preload(self.win)
         self.register_events()
 
         self.world = self.render.attachNewNode("world")
@@ -107,8 +115,9 @@ class CosmoniumBase(ShowBase):
         self.world.setShaderAuto()
         self.annotation.setShaderAuto()
 
-        workers.asyncTextureLoader = workers.AsyncTextureLoader(self)
+        workers.asyncTextureLoader = workers.AsyncTextureLoader(self, settings.loader_threads)
         workers.syncTextureLoader = workers.SyncTextureLoader()
+        self.finalExitCallbacks.append(npnoise.close_pool)
 
     def panda_config(self):
         data = []
@@ -172,7 +181,7 @@ class CosmoniumBase(ShowBase):
             ShowBase.ignore(self, event)
 
     def register_events(self):
-        if not self.app_config.test_start:
+        if not self.app_config.headless:
             self.buttonThrowers[0].node().setKeystrokeEvent('keystroke')
             self.accept(self.win.getWindowEvent(), self.window_event)
         self.accept('keystroke', self.keystroke_event)
@@ -251,6 +260,22 @@ class CosmoniumBase(ShowBase):
     def connect_pstats(self):
         PStatClient.connect()
 
+    def toggle_profiler(self):
+        if self.profiler is None:
+            self.profiler = FrameProfiler(self.universe, settings.profiler_frames)
+        if self.profiler.is_running():
+            print("Stopping frame profiler")
+            self.profiler.stop()
+        else:
+            print("Starting frame profiler")
+            self.profiler.start()
+
+    def export_profiler(self):
+        if self.profiler is None:
+            print("Frame profiler not started")
+            return
+        self.profiler.export_default()
+
     def toggle_wireframe(self):
         self.world.clear_render_mode()
         if self.wireframe_filled:
@@ -295,6 +320,7 @@ class Cosmonium(CosmoniumBase):
         self.nav = None
         self.gui = None
         self.last_visibles = []
+        self.profiler = None
         self.visibles = []
         self.nearest_system = None
         self.nearest_body = None
@@ -308,7 +334,7 @@ class Cosmonium(CosmoniumBase):
 
         self.universe = Universe(self)
 
-        self.splash = Splash() if not self.app_config.test_start else NoSplash()
+        self.splash = Splash() if not self.app_config.headless else NoSplash()
 
         if not settings.debug_sync_load:
             self.async_start = workers.AsyncMethod("async_start", self, self.load_task, self.configure_scene)
@@ -319,14 +345,32 @@ class Cosmonium(CosmoniumBase):
     def load_task(self):
         self.init_universe()
 
-        self.load_universe()
+        universe_id = self.get_universe_id()
+        if settings.cache_universe and universe_id is not None:
+            snapshot = UniverseSnapshot(universe_id)
+        else:
+            snapshot = None
+        universe = snapshot.load() if snapshot is not None else None
+        if universe is not None:
+            self.universe = universe
+            if self.universe.octree is None:
+                self.splash.set_text("Building octree...")
+                self.universe.create_octree()
+        else:
+            if snapshot is not None:
+                snapshot.start_recording()
+            self.load_universe()
+            if snapshot is not None:
+                snapshot.stop_recording()
 
-        self.universe.recalc_recursive()
+            self.universe.recalc_recursive()
 
-        self.splash.set_text("Building octree...")
-        self.universe.create_octree()
-        #self.universe.octree.print_summary()
-        #self.universe.octree.print_stats()
+            self.splash.set_text("Building octree...")
+            self.universe.create_octree()
+            #self.universe.octree.print_summary()
+            #self.universe.octree.print_stats()
+            if snapshot is not None:
+                snapshot.store(self.universe)
 
         self.sun = self.universe.find_by_path('Sol')
         if not self.sun:
@@ -385,6 +429,8 @@ class Cosmonium(CosmoniumBase):
         self.time_task(None)
 
         taskMgr.add(self.time_task, "time-task")
+        if settings.profiler:
+            self.toggle_profiler()
 
         self.start_universe()
 
@@ -709,7 +755,10 @@ class Cosmonium(CosmoniumBase):
         self.haloset.update()
         self.gui.update_status()
 
+    @pstat
     def time_task(self, task):
+        #The timings of the previous frame have been consumed by the profiler tasks
+        pstats.frame_timings.clear()
         dt = globalClock.getDt()
 
         self.time.update_time(dt)
@@ -720,10 +769,14 @@ class Cosmonium(CosmoniumBase):
         obs = pstats.levelpstat('obs', 'Bodies')
         visibility = pstats.levelpstat('visibility', 'Bodies')
         instance = pstats.levelpstat('instance', 'Bodies')
+        shadow_tested = pstats.levelpstat('shadow-tested', 'Bodies')
+        shadow_accepted = pstats.levelpstat('shadow-accepted', 'Bodies')
         StellarObject.nb_update = 0
         StellarObject.nb_obs = 0
         StellarObject.nb_visibility = 0
         StellarObject.nb_instance = 0
+        ShadowPairScheduler.nb_tested = 0
+        ShadowPairScheduler.nb_accepted = 0
 
         if self.trigger_check_settings:
             self.universe.check_settings()
@@ -791,6 +844,11 @@ class Cosmonium(CosmoniumBase):
         obs.set_level(StellarObject.nb_obs)
         visibility.set_level(StellarObject.nb_visibility)
         instance.set_level(StellarObject.nb_instance)
+        shadow_tested.set_level(ShadowPairScheduler.nb_tested)
+        shadow_accepted.set_level(ShadowPairScheduler.nb_accepted)
+        patchCache.update_stats()
+        textureTileCache.update_stats()
+        orbitGeomCache.update_stats()
 
         if settings.color_picking:
             self.oid_texture.clear_image()
@@ -801,6 +859,9 @@ class Cosmonium(CosmoniumBase):
         print("Global:")
         print("\tscale", settings.scale)
         print("\tPlanes", self.camLens.getNear(), self.camLens.getFar())
+        print("Caches:")
+        for cache in (textureTileCache, patchCache, orbitGeomCache):
+            print("\t%s: %d/%d entries, %.1f/%.1f MB" % (cache.name, len(cache.entries), cache.max_entries, cache.size / 1024.0 / 1024.0, cache.max_size / 1024.0 / 1024.0))
         print("Camera:")
         print("\tGlobal position", self.observer.camera_global_pos)
         print("\tLocal position", self.observer.get_camera_pos(), '(Frame:', self.observer.camera_pos, ')')
@@ -876,6 +937,11 @@ class Cosmonium(CosmoniumBase):
     def init_universe(self):
         pass
 
+    def get_universe_id(self):
+        """Return a value identifying the set of files loaded by load_universe(),
+        or None if the universe can not be stored in a snapshot."""
+        return None
+
     def load_universe(self):
         pass
 
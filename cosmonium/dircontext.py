@@ -27,6 +27,9 @@ import os
 from copy import deepcopy
 
 class DirContext(object):
+    #When not None, the data files found are recorded in this set
+    data_sources = None
+
     def __init__(self, context=None):
         if context is not None:
             self.category_paths = deepcopy(context.category_paths)
@@ -80,7 +83,10 @@ class DirContext(object):
         return self.find_file('models', pattern)
 
     def find_data(self, pattern):
-        return self.find_file('data', pattern)
+        filepath = self.find_file('data', pattern)
+        if filepath is not None and DirContext.data_sources is not None:
+            DirContext.data_sources.add(os.path.abspath(filepath))
+        return filepath
 
     def find_script(self, pattern):
         return self.find_file('scripts', pattern)
@@ -20,10 +20,10 @@
 from __future__ import print_function
 from __future__ import absolute_import
 
-from panda3d.core import TextureStage, Texture, TexGenAttrib, GeomVertexRewriter
-from panda3d.core import GeomVertexArrayFormat, InternalName, GeomVertexFormat, GeomVertexData, GeomVertexWriter, OmniBoundingVolume
+from panda3d.core import TextureStage, Texture, TexGenAttrib
+from panda3d.core import GeomVertexArrayFormat, InternalName, GeomVertexFormat, GeomVertexData, OmniBoundingVolume
 from panda3d.core import GeomPoints, Geom, GeomNode
-from panda3d.core import LVecBase3, LPoint3d, LPoint3, LColor, LVector3d
+from panda3d.core import LVecBase3, LPoint3, LColor, LVector3d
 from panda3d.core import NodePath, StackedPerlinNoise3
 
 from .appearances import AppearanceBase
@@ -34,6 +34,8 @@ from .textures import TransparentTexture, DirectTextureSource
 from .shaders import PointControl
 from .utils import TransparencyBlend
 from .parameters import AutoUserParameter, UserParameter
+from .geometry import write_vertex_data
+from .cache import create_path_for
 
 from .bodies import DeepSpaceObject
 from .shaders import BasicShader, FlatLightingModel
@@ -41,9 +43,12 @@ from .utils import mag_to_scale_nolimit
 from .astro import units
 from . import settings
 
-from math import cos, sin, pi, log, tan, tanh, sqrt, exp, atan, atanh
-from random import random, gauss, choice, seed
+from math import pi, log, tan, tanh, sqrt
 from cosmonium.utils import srgb_to_linear
+from collections import OrderedDict
+import hashlib
+import numpy
+import os
 
 class Galaxy(DeepSpaceObject):
     has_rotation_axis = False
@@ -127,11 +132,14 @@ class GalaxyAppearance(AppearanceBase):
                 ]
 
 class GalaxyShapeBase(Shape):
-    templates = {}
+    #LRU cache of the point clouds, the most recently used are at the end
+    templates = OrderedDict()
+    template_params = ()
+    vertex_format = None
+
     def __init__(self, radius=1.0, scale=None):
         Shape.__init__(self)
         self.radius = radius
-        self.seed = random()
         if scale is None:
             self.radius = radius
             self.scale = LVecBase3(self.radius, self.radius, self.radius)
@@ -140,12 +148,18 @@ class GalaxyShapeBase(Shape):
             self.radius = max(scale) * radius
         self.nb_points = 1
         self.size = 1.0
+        #Only the template of the parameters loaded from the catalog is stored in the cache directory
+        self.catalog_template_id = None
         self.yellow_color = srgb_to_linear((255.0 / 255, 248.0 / 255, 231.0 / 255, 1.0))
         self.blue_color = srgb_to_linear((102.0 / 255, 153.0 / 255, 255.0 / 255, 1.0))
 
     def shape_id(self):
         return ''
 
+    def template_id(self):
+        """Identify the point cloud of the shape, the galaxies with the same template id share the same geom."""
+        return '%s:%s' % (self.shape_id(), ':'.join(repr(getattr(self, name)) for name in self.template_params))
+
     def get_apparent_radius(self):
         return self.radius
 
@@ -155,76 +169,119 @@ class GalaxyShapeBase(Shape):
     def is_flat(self):
         return False
 
-    def create_points(self, radius=1.0):
+    def create_points(self, rng, radius=1.0):
         return None
 
     def apply(self):
         self.instance.node().setBounds(OmniBoundingVolume())
         self.instance.node().setFinal(True)
 
+    def get_template_path(self, template_id):
+        md5 = hashlib.md5(("%s:%s" % (settings.version, template_id)).encode()).hexdigest()
+        return os.path.join(create_path_for('galaxies'), md5 + '.npz')
+
+    def load_template(self, template_id):
+        path = self.get_template_path(template_id)
+        if not os.path.exists(path): return None
+        try:
+            data = numpy.load(path)
+            return (data['points'], data['colors'], data['sizes'], float(data['size']))
+        except (IOError, ValueError, KeyError) as e:
+            print("Could not load galaxy template", path, ':', e)
+            return None
+
+    def store_template(self, template_id, points, colors, sizes, size):
+        path = self.get_template_path(template_id)
+        try:
+            numpy.savez(path, points=points, colors=colors, sizes=sizes, size=size)
+        except IOError as e:
+            print("Could not store galaxy template", path, ':', e)
+
+    def get_template(self):
+        template_id = self.template_id()
+        if self.catalog_template_id is None:
+            self.catalog_template_id = template_id
+        templates = GalaxyShapeBase.templates
+        template = templates.pop(template_id, None)
+        if template is None:
+            #The templates created by editing the parameters are not persisted
+            persist = settings.cache_galaxies and template_id == self.catalog_template_id
+            data = self.load_template(template_id) if persist else None
+            if data is None:
+                #The seed only depends on the template, the same shape always gives the same galaxy
+                seed = int(hashlib.md5(template_id.encode()).hexdigest()[:16], 16)
+                (points, colors, sizes) = self.create_points(numpy.random.default_rng(seed))
+                data = (points, colors, sizes, self.size)
+                if persist:
+                    self.store_template(template_id, *data)
+            (points, colors, sizes, size) = data
+            template = (self.makeGeom(points, colors, sizes), size)
+        templates[template_id] = template
+        while len(templates) > settings.galaxy_templates_max:
+            templates.popitem(last=False)
+        return template
+
     def create_instance(self):
-        shape_id = self.shape_id()
-        if shape_id in GalaxyShapeBase.templates:
-            template =  GalaxyShapeBase.templates[shape_id]
-        else:
-            seed(self.seed)
-            self.gnode = GeomNode('galaxy')
-            self.geom = self.makeGeom(*self.create_points())
-            self.gnode.addGeom(self.geom)
-            template = NodePath(self.gnode)
-            # Disable caching
-            #GalaxyShapeBase.templates[shape_id] = template
+        (geom, self.size) = self.get_template()
+        self.gnode = GeomNode('galaxy')
+        self.gnode.addGeom(geom)
         self.instance = NodePath('galaxy')
-        template.instanceTo(self.instance)
+        self.instance.attach_new_node(self.gnode)
         self.apply()
-        self.update_geom(*self.create_points())
         return self.instance
 
     def update_shape(self):
-        seed(self.seed)
-        self.update_geom(*self.create_points())
+        (geom, self.size) = self.get_template()
+        self.gnode.set_geom(0, geom)
+
+    @classmethod
+    def get_vertex_format(cls):
+        if GalaxyShapeBase.vertex_format is None:
+            array = GeomVertexArrayFormat()
+            array.addColumn(InternalName.make('vertex'), 3, Geom.NTFloat32, Geom.CPoint)
+            array.addColumn(InternalName.make('color'), 4, Geom.NTFloat32, Geom.CColor)
+            array.addColumn(InternalName.make('size'), 1, Geom.NTFloat32, Geom.COther)
+            format = GeomVertexFormat()
+            format.addArray(array)
+            GalaxyShapeBase.vertex_format = GeomVertexFormat.registerFormat(format)
+        return GalaxyShapeBase.vertex_format
 
     def makeGeom(self, points, colors, sizes):
-        #format = GeomVertexFormat.getV3c4()
-        array = GeomVertexArrayFormat()
-        array.addColumn(InternalName.make('vertex'), 3, Geom.NTFloat32, Geom.CPoint)
-        array.addColumn(InternalName.make('color'), 4, Geom.NTFloat32, Geom.CColor)
-        array.addColumn(InternalName.make('size'), 1, Geom.NTFloat32, Geom.COther)
-        format = GeomVertexFormat()
-        format.addArray(array)
-        format = GeomVertexFormat.registerFormat(format)
-        vdata = GeomVertexData('vdata', format, Geom.UH_static)
+        vdata = GeomVertexData('vdata', self.get_vertex_format(), Geom.UH_static)
         vdata.unclean_set_num_rows(len(points))
-        self.vwriter = GeomVertexWriter(vdata, 'vertex')
-        self.colorwriter = GeomVertexWriter(vdata, 'color')
-        self.sizewriter = GeomVertexWriter(vdata, 'size')
         geompoints = GeomPoints(Geom.UH_static)
-        geompoints.reserve_num_vertices(len(points))
-        index = 0
-        for (point, color, size) in zip(points, colors, sizes):
-            self.vwriter.addData3f(*point)
-            self.colorwriter.addData4f(*color)
-            self.sizewriter.addData1f(size)
-            geompoints.addVertex(index)
-            #geompoints.closePrimitive()
-            index += 1
+        geompoints.set_nonindexed_vertices(0, len(points))
         geom = Geom(vdata)
         geom.addPrimitive(geompoints)
+        if len(points) > 0:
+            write_vertex_data(geom, {'vertex': points, 'color': colors, 'size': sizes[:, numpy.newaxis]})
         return geom
 
-    def update_geom(self, points, colors, sizes):
-        geom = self.instance.children[0].node().modify_geom(0)
-        vdata = geom.modify_vertex_data()
-        vdata.unclean_set_num_rows(len(points))
-        vwriter = GeomVertexRewriter(vdata, InternalName.make('vertex'))
-        colorwriter = GeomVertexWriter(vdata, InternalName.make('color'))
-        sizewriter = GeomVertexWriter(vdata, InternalName.make('size'))
-        for (point, color, size) in zip(points, colors, sizes):
-            vwriter.addData3f(*point)
-            colorwriter.addData4f(*color)
-            sizewriter.addData1f(size)
+def vector_length(points):
+    return numpy.sqrt((points ** 2).sum(axis=1))
+
+def color_array(color):
+    color = numpy.array(tuple(color), dtype=numpy.float64)
+    if len(color) < 4:
+        color = numpy.append(color, (1.0,) * (4 - len(color)))
+    return color
+
+def scaled_colors(color, coefs):
+    colors = color_array(color)[numpy.newaxis, :] * coefs[:, numpy.newaxis]
+    colors[:, 3] = 1.0
+    return colors
+
+def gaussian_points(rng, count, radius, spread_x, spread_y, spread_z):
+    #The spreads can be negative with some shape functions, the distribution is the same
+    points = numpy.empty((count, 3))
+    points[:, 0] = rng.normal(0.0, abs(spread_x), count)
+    points[:, 1] = rng.normal(0.0, abs(spread_y), count)
+    points[:, 2] = rng.normal(0.0, abs(spread_z), count)
+    return points * radius
 
 class EllipticalGalaxyShape(GalaxyShapeBase):
+    template_params = ('nb_points', 'spread', 'zspread', 'sprite_size', 'sersic', 'color')
+
     def __init__(self, factor, radius=1.0, scale=None, nb_points=4000, spread=0.4, zspread=0.2, sprite_size=400, sersic=4.0):
         GalaxyShapeBase.__init__(self, radius, scale)
         self.factor = factor
@@ -238,27 +295,12 @@ class EllipticalGalaxyShape(GalaxyShapeBase):
     def shape_id(self):
         return 'elliptical-%g' % self.factor
 
-    def create_points(self, radius=1.0):
-        points = []
-        colors = []
-        sizes = []
+    def create_points(self, rng, radius=1.0):
         nb_points = self.nb_points
-        sprite_size = self.sprite_size
-        half_sprite_size = self.sprite_size / 2.0
-        color = self.color
-        spread = self.spread
-        spreadf = self.spread * self.factor
-        zspreadf = self.zspread * self.factor
-        sersic_inv = 1. / self.sersic
-        for i in range(nb_points):
-            x = gauss(0.0, spread)
-            y = gauss(0.0, spreadf)
-            z = gauss(0.0, zspreadf)
-            point = LPoint3d(x * radius, y * radius, z * radius)
-            points.append(point)
-            colors.append(color * (0.9 - pow(point.length(), sersic_inv)))
-            size = sprite_size + gauss(0, half_sprite_size)
-            sizes.append(size)
+        points = gaussian_points(rng, nb_points, radius, self.spread, self.spread * self.factor, self.zspread * self.factor)
+        coefs = 0.9 - numpy.power(vector_length(points), 1. / self.sersic)
+        colors = color_array(self.color)[numpy.newaxis, :] * coefs[:, numpy.newaxis]
+        sizes = self.sprite_size + rng.normal(0, abs(self.sprite_size) / 2.0, nb_points)
         return (points, colors, sizes)
 
     def get_user_parameters(self):
@@ -272,6 +314,8 @@ class EllipticalGalaxyShape(GalaxyShapeBase):
 
 class IrregularGalaxyShape(GalaxyShapeBase):
     noise = None
+    template_params = ('nb_points', 'spread', 'zspread', 'sprite_size', 'sersic', 'color1', 'color2')
+
     def __init__(self, radius=1.0, scale=None, nb_points=4000, spread=0.4, zspread=0.2, sprite_size=400, sersic=4.0):
         GalaxyShapeBase.__init__(self, radius, scale)
         self.nb_points = nb_points
@@ -285,32 +329,27 @@ class IrregularGalaxyShape(GalaxyShapeBase):
     def shape_id(self):
         return 'irregular'
 
-    def create_points(self, radius=1.0):
+    def create_points(self, rng, radius=1.0):
         if IrregularGalaxyShape.noise is None:
             IrregularGalaxyShape.noise = StackedPerlinNoise3(1, 1, 1, 8, 4, 0.7)
-        points = []
-        colors = []
-        sizes = []
+        noise = self.noise
         nb_points = self.nb_points
-        sprite_size = self.sprite_size
-        colors_list = [self.color1, self.color2]
-        spread = self.spread
-        zspread = self.zspread
-        sersic_inv = 1. / self.sersic
+        selected = []
         count = 0
         while count < nb_points:
-            p = LPoint3(gauss(0.0, spread), gauss(0.0, spread), gauss(0.0, zspread))
-            value = self.noise(p) * 0.5 + 0.5
-            if value < 0.5:
-                points.append(p * radius)
-                color = choice(colors_list)
-                color = color * (1 - 0.9 * pow(p.length(), sersic_inv))
-                color[3] = 1.0
-                colors.append(color)
-                size = sprite_size + gauss(0, sprite_size)
-                sizes.append(size)
-                count += 1
-        return (points, colors, sizes)
+            #Generate the candidates in batches, about half of them are rejected by the noise
+            candidates = gaussian_points(rng, (nb_points - count) * 2 + 16, 1.0, self.spread, self.spread, self.zspread)
+            values = numpy.array([noise(LPoint3(*p)) for p in candidates.tolist()]) * 0.5 + 0.5
+            candidates = candidates[values < 0.5][:nb_points - count]
+            selected.append(candidates)
+            count += len(candidates)
+        points = numpy.concatenate(selected) if selected else numpy.empty((0, 3))
+        base_colors = numpy.array([color_array(self.color1), color_array(self.color2)])
+        colors = base_colors[rng.integers(0, 2, len(points))]
+        colors *= (1 - 0.9 * numpy.power(vector_length(points), 1. / self.sersic))[:, numpy.newaxis]
+        colors[:, 3] = 1.0
+        sizes = self.sprite_size + rng.normal(0, abs(self.sprite_size), len(points))
+        return (points * radius, colors, sizes)
 
     def get_user_parameters(self):
         return [
@@ -323,6 +362,10 @@ class IrregularGalaxyShape(GalaxyShapeBase):
                 ]
 
 class SpiralGalaxyShapeBase(GalaxyShapeBase):
+    arm_spread = 5
+    template_params = ('nb_points_bulge', 'nb_points_arms', 'spread', 'zspread', 'max_angle', 'sprite_size',
+                       'sersic_bulge', 'sersic_disk', 'bulge_color', 'arms_color', 'arm_spread')
+
     def __init__(self, radius=1.0, scale=None, nb_points_bulge=200, nb_points_arms=1000, spread=0.4, zspread=0.01, sprite_size=400, max_angle=2 * pi, sersic_bulge=4.0, sersic_disk=1.0):
         GalaxyShapeBase.__init__(self, radius, scale)
         self.nb_points_bulge = nb_points_bulge
@@ -339,93 +382,71 @@ class SpiralGalaxyShapeBase(GalaxyShapeBase):
     def is_flat(self):
         return True
 
-    def create_bulge(self, count, radius, spread, zspread, points, colors, sizes):
-        sprite_size = self.sprite_size
-        bulge_color = self.bulge_color
-        sersic_inv = 1. / self.sersic_bulge
-        for i in range(count):
-            x = gauss(0.0, spread)
-            y = gauss(0.0, spread)
-            z = gauss(0.0, zspread)
-            point = LPoint3d(x * radius, y * radius, z * radius)
-            points.append(point)
-            color = bulge_color * (1 - pow(point.length(), sersic_inv)) * 2
-            color[3] = 1.0
-            colors.append(color)
-            size = sprite_size + gauss(0, sprite_size)
-            sizes.append(size)
-
-    def create_spiral(self, count,radius, spread, zspread, points, colors, sizes):
-        func = self.shape_func
-        sprite_size = self.sprite_size
-        arm_color = self.arms_color
-        sersic_inv = 1. / self.sersic_disk
-        distance = 0
-        for i in (-1.0, 1.0):
-            for c in range(count):
-                t = sqrt(random())
-                angle = t * self.max_angle
-                shape = func(angle)
-                x = i * cos(angle) * shape + gauss(0.0, spread)
-                y = i * sin(angle) * shape + gauss(0.0, spread)
-                z = gauss(0.0, zspread)
-                point = LPoint3d(x * radius, y * radius, z * radius)
-                points.append(point)
-                distance = max(distance, point.length())
-                color = arm_color * (1 - 0.9 * pow(distance, sersic_inv))
-                color[3] = 1.0
-                colors.append(color)
-                size = sprite_size + gauss(0, sprite_size)
-                sizes.append(size)
-        self.size = distance
-
-    def create_spiral_distance(self, count, radius, spread, zspread, points, colors, sizes):
-        sprite_size = self.sprite_size
-        arm_color = self.arms_color
-        disk_color = self.bulge_color
+    def create_bulge(self, rng, count, radius, spread, zspread):
+        points = gaussian_points(rng, count, radius, spread, spread, zspread)
+        colors = scaled_colors(self.bulge_color, (1 - numpy.power(vector_length(points), 1. / self.sersic_bulge)) * 2)
+        sizes = self.sprite_size + rng.normal(0, abs(self.sprite_size), count)
+        return (points, colors, sizes)
+
+    def create_spiral(self, rng, count, radius, spread, zspread):
+        nb_points = count * 2
+        t = numpy.sqrt(rng.random(nb_points))
+        angles = t * self.max_angle
+        shapes = numpy.array([self.shape_func(angle) for angle in angles.tolist()])
+        sides = numpy.repeat([-1.0, 1.0], count)
+        points = numpy.empty((nb_points, 3))
+        points[:, 0] = sides * numpy.cos(angles) * shapes + rng.normal(0.0, abs(spread), nb_points)
+        points[:, 1] = sides * numpy.sin(angles) * shapes + rng.normal(0.0, abs(spread), nb_points)
+        points[:, 2] = rng.normal(0.0, abs(zspread), nb_points)
+        points *= radius
+        #The color uses the farthest distance found so far
+        distances = numpy.maximum.accumulate(vector_length(points))
+        colors = scaled_colors(self.arms_color, 1 - 0.9 * numpy.power(distances, 1. / self.sersic_disk))
+        sizes = self.sprite_size + rng.normal(0, abs(self.sprite_size), nb_points)
+        self.size = distances[-1] if nb_points > 0 else 0
+        return (points, colors, sizes)
+
+    def create_spiral_distance(self, rng, count, radius, spread, zspread):
+        nb_points = count * 2
         bulge_size = self.bulge_size()
-        sersic_inv = 1. / self.sersic_disk
-        distance = 0
-        for c in range(count * 2):
-            r = sqrt(random() + bulge_size*bulge_size)
-            theta = random() * 2 * pi
-            x = r * cos(theta)
-            y = r * sin(theta)
-            z = gauss(0.0, zspread)
-            coef = 0.0
-            for c in (0, 1.):
-                arm_angle = self.inv_shape_func(r) * max(self.max_angle, 0.001) / (2 * pi)
-                mtheta = c * pi + theta
-                delta = abs(mtheta - arm_angle)
-                for i in range(int(self.max_angle / (2 * pi)) + 1):
-                    delta = min(delta, abs(mtheta - arm_angle - (i + 1) * 2 * pi), abs(mtheta - arm_angle + (i  + 1) * 2 * pi))
-                coef = max(pow(max(1 - delta / pi, 0.0), self.arm_spread), coef)
-            point = LPoint3d(x * radius, y * radius, z * radius)
-            points.append(point)
-            distance = max(distance, point.length())
-            color = disk_color * (1 - coef) + arm_color * coef
-            color = color * (1 - 0.9 * pow(r, sersic_inv))
-            color[3] = 1.0
-            colors.append(color)
-            size = sprite_size + gauss(0, sprite_size)
-            sizes.append(size)
-        self.size = distance
-
-    def create_points(self, radius=1.0):
-        points = []
-        colors = []
-        sizes = []
+        r = numpy.sqrt(rng.random(nb_points) + bulge_size * bulge_size)
+        theta = rng.random(nb_points) * 2 * pi
+        points = numpy.empty((nb_points, 3))
+        points[:, 0] = r * numpy.cos(theta)
+        points[:, 1] = r * numpy.sin(theta)
+        points[:, 2] = rng.normal(0.0, abs(zspread), nb_points)
+        arm_angle = self.inv_shape_func(r) * max(self.max_angle, 0.001) / (2 * pi)
+        coefs = numpy.zeros(nb_points)
+        for c in (0, 1.):
+            mtheta = c * pi + theta
+            delta = numpy.abs(mtheta - arm_angle)
+            for i in range(int(self.max_angle / (2 * pi)) + 1):
+                delta = numpy.minimum(delta, numpy.minimum(numpy.abs(mtheta - arm_angle - (i + 1) * 2 * pi), numpy.abs(mtheta - arm_angle + (i  + 1) * 2 * pi)))
+            coefs = numpy.maximum(numpy.power(numpy.maximum(1 - delta / pi, 0.0), self.arm_spread), coefs)
+        points *= radius
+        disk_color = color_array(self.bulge_color)
+        arm_color = color_array(self.arms_color)
+        colors = disk_color * (1 - coefs[:, numpy.newaxis]) + arm_color * coefs[:, numpy.newaxis]
+        colors *= (1 - 0.9 * numpy.power(r, 1. / self.sersic_disk))[:, numpy.newaxis]
+        colors[:, 3] = 1.0
+        sizes = self.sprite_size + rng.normal(0, abs(self.sprite_size), nb_points)
+        self.size = vector_length(points).max() if nb_points > 0 else 0
+        return (points, colors, sizes)
+
+    def create_disk(self, rng, count, radius, spread, zspread):
+        return self.create_spiral_distance(rng, count, radius, spread, zspread)
+
+    def create_points(self, rng, radius=1.0):
         nb_points_bulge = self.nb_points_bulge
         nb_points_arms = self.nb_points_arms
         spread = self.bulge_size() / 2
         zspread = spread / 2.0
-        self.create_bulge(nb_points_bulge, radius, spread, zspread, points, colors, sizes)
-        if True:
-            self.create_spiral_distance(nb_points_arms, radius, self.spread, self.zspread, points, colors, sizes)
-        else:
-            self.create_spiral(nb_points_arms, radius, self.spread, self.zspread, points, colors, sizes)
+        (bulge_points, bulge_colors, bulge_sizes) = self.create_bulge(rng, nb_points_bulge, radius, spread, zspread)
+        (disk_points, disk_colors, disk_sizes) = self.create_disk(rng, nb_points_arms, radius, self.spread, self.zspread)
         self.nb_points = nb_points_bulge + nb_points_arms
-        return (points, colors, sizes)
+        return (numpy.concatenate((bulge_points, disk_points)),
+                numpy.concatenate((bulge_colors, disk_colors)),
+                numpy.concatenate((bulge_sizes, disk_sizes)))
 
     def get_user_parameters(self):
         return [
@@ -454,7 +475,7 @@ class FullSpiralGalaxyShape(SpiralGalaxyShapeBase):
         return 1.0 / log(self.B * max(0.00001, tan(angle / (2 * self.N))))
 
     def inv_shape_func(self, distance):
-        return atan(exp(1.0 / distance) / self.B) * 2 * self.N
+        return numpy.arctan(numpy.exp(1.0 / distance) / self.B) * 2 * self.N
 
     def get_user_parameters(self):
         params = SpiralGalaxyShapeBase.get_user_parameters(self)
@@ -479,7 +500,7 @@ class FullRingGalaxyShape(SpiralGalaxyShapeBase):
         return 1.0 / log(self.B * max(0.00001, tanh(angle / (2 * self.N))))
 
     def inv_shape_func(self, distance):
-        return atanh(exp(1.0 / distance) / self.B) * 2 * self.N
+        return numpy.arctanh(numpy.exp(1.0 / distance) / self.B) * 2 * self.N
 
     def get_user_parameters(self):
         params = SpiralGalaxyShapeBase.get_user_parameters(self)
@@ -519,7 +540,7 @@ class SpiralGalaxyShape(SpiralGalaxyShapeBase):
 
     def inv_shape_func(self, distance):
         pitch = self.pitch
-        return pitch * exp((1 - self.bar_radius / distance) / (pitch * tan(pitch)))
+        return pitch * numpy.exp((1 - self.bar_radius / distance) / (pitch * tan(pitch)))
 
     def get_user_parameters(self):
         params = SpiralGalaxyShapeBase.get_user_parameters(self)
@@ -538,23 +559,19 @@ class LenticularGalaxyShape(SpiralGalaxyShapeBase):
     def bulge_size(self):
         return self.bulge_radius
 
-    def create_spiral(self, count, radius, spread, zspread, points, colors, sizes):
-        sprite_size = self.sprite_size
-        disk_color = self.yellow_color
-        sersic_inv = 1. / self.sersic_disk
-        for r in range(count * 2):
-            distance = self.bulge_radius + abs(gauss(0, (1 - self.bulge_radius)))
-            angle = random() * 2.0 * pi
-            x = distance * cos(angle) + gauss(0.0, spread)
-            y = distance * sin(angle) + gauss(0.0, spread)
-            z = gauss(0.0, zspread)
-            point = LPoint3d(x * radius, y * radius, z * radius)
-            points.append(point)
-            color = disk_color * (1 - 0.9 * pow(point, sersic_inv))
-            color[3] = 1.0
-            colors.append(color)
-            size = sprite_size + gauss(0, sprite_size)
-            sizes.append(size)
+    def create_disk(self, rng, count, radius, spread, zspread):
+        nb_points = count * 2
+        distances = self.bulge_radius + numpy.abs(rng.normal(0, (1 - self.bulge_radius), nb_points))
+        angles = rng.random(nb_points) * 2.0 * pi
+        points = numpy.empty((nb_points, 3))
+        points[:, 0] = distances * numpy.cos(angles) + rng.normal(0.0, abs(spread), nb_points)
+        points[:, 1] = distances * numpy.sin(angles) + rng.normal(0.0, abs(spread), nb_points)
+        points[:, 2] = rng.normal(0.0, abs(zspread), nb_points)
+        points *= radius
+        colors = scaled_colors(self.yellow_color, 1 - 0.9 * numpy.power(vector_length(points), 1. / self.sersic_disk))
+        sizes = self.sprite_size + rng.normal(0, abs(self.sprite_size), nb_points)
+        self.size = vector_length(points).max() if nb_points > 0 else 0
+        return (points, colors, sizes)
 
 class GalaxyPointControl(PointControl):
     use_vertex = True
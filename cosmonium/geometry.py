@@ -30,6 +30,7 @@ from panda3d.egg import EggData, EggVertexPool, EggVertex, EggPolygon, loadEggDa
 from . import settings
 
 from math import sin, cos, pi, atan2, sqrt, asin
+import numpy
 
 def empty_node(prefix, color=False):
     path = NodePath(prefix + '_path')
@@ -85,6 +86,74 @@ def empty_geom(prefix, nb_data, nb_vertices, points=False, normal=True, texture=
         prim.reserve_num_vertices(nb_vertices)
     return (gvw, gcw, gtw, gnw, gtanw, gbiw, prim, geom)
 
+def write_vertex_data(geom, columns):
+    """Write the given per-vertex arrays in the vertex data of the geom in one bulk copy.
+    The columns are identified by their internal name and must have one row per vertex."""
+    gvd = geom.modify_vertex_data()
+    array_format = gvd.get_format().get_array(0)
+    data = numpy.empty((gvd.get_num_rows(), array_format.get_stride() // 4), dtype=numpy.float32)
+    for column in array_format.get_columns():
+        start = column.get_start() // 4
+        data[:, start:start + column.get_num_components()] = columns[column.get_name().get_name()]
+    memoryview(gvd.modify_array(0)).cast('B')[:] = data.view(numpy.uint8).ravel()
+
+class IndicesRecorder(object):
+    """Collect the vertices of the primitives to build a shared index array."""
+    def __init__(self):
+        self.indices = []
+
+    def addVertices(self, *vertices):
+        self.indices += vertices
+
+    add_vertices = addVertices
+
+    def closePrimitive(self):
+        pass
+
+indices_cache = {}
+
+def set_primitive_indices(prim, indices):
+    """Set the vertices of the primitive from an array of indices in one bulk copy,
+    using the smallest possible index type. Return the index array of the primitive."""
+    indices = numpy.asarray(indices, dtype=numpy.uint32).ravel()
+    if len(indices) == 0 or indices.max() < 65535:
+        indices = indices.astype(numpy.uint16)
+        prim.set_index_type(Geom.NT_uint16)
+    else:
+        prim.set_index_type(Geom.NT_uint32)
+    vertices = prim.modify_vertices()
+    vertices.unclean_set_num_rows(len(indices))
+    if len(indices) > 0:
+        memoryview(vertices).cast('B')[:] = indices.view(numpy.uint8)
+    return vertices
+
+def set_cached_indices(prim, key, generator, *args):
+    """Set the vertices of the primitive using the index array cached for the given configuration,
+    the generator is only called the first time to create the index array."""
+    vertices = indices_cache.get(key)
+    if vertices is None:
+        recorder = IndicesRecorder()
+        generator(recorder, *args)
+        indices_cache[key] = set_primitive_indices(prim, recorder.indices)
+    else:
+        prim.set_index_type(vertices.get_array_format().get_column(0).get_numeric_type())
+        prim.set_vertices(vertices)
+
+def make_polylines_indices(lengths, closed=False):
+    """Return the pairs of indices of the segments of consecutive polylines with the given numbers of points."""
+    lengths = numpy.asarray(lengths, dtype=numpy.int64)
+    ends = numpy.cumsum(lengths)
+    starts = ends - lengths
+    indices = numpy.arange(ends[-1] if len(ends) > 0 else 0)
+    last = numpy.zeros(len(indices), dtype=bool)
+    last[ends[lengths > 0] - 1] = True
+    first = indices[~last]
+    segments = numpy.column_stack((first, first + 1))
+    if closed:
+        loops = lengths > 1
+        segments = numpy.concatenate((segments, numpy.column_stack((ends[loops] - 1, starts[loops]))))
+    return segments
+
 def BoundingBoxGeom(box):
     (path, node) = empty_node('bb')
     (gvw, gcw, gtw, gnw, gtanw, gbiw, prim, geom) = empty_geom('bb', 8, 12, normal=False, texture=False, tanbin=False)
@@ -259,6 +328,13 @@ def UVPatchNormal(x0, y0, x1, y1):
     z = sin(pi / 2 - pi * (y0 + dy / 2))
     return LVector3d(x, y, z)
 
+def make_uv_patch_primitives(prim, rings, sectors):
+    r_sectors = sectors + 1
+    for r in range(0, rings):
+        for s in range(0, sectors):
+            prim.addVertices(r * r_sectors + s, (r+1) * r_sectors + s, r * r_sectors + (s+1))
+            prim.addVertices((r+1) * r_sectors + (s+1), r * r_sectors + (s+1), (r+1) * r_sectors + s)
+
 def UVPatch(radius, rings, sectors, x0, y0, x1, y1, global_texture=False, inv_texture_u=False, inv_texture_v=True, offset=None):
     r_sectors = sectors + 1
     r_rings = rings + 1
@@ -269,56 +345,30 @@ def UVPatch(radius, rings, sectors, x0, y0, x1, y1, global_texture=False, inv_te
     dx = x1 - x0
     dy = y1 - y0
 
+    (r, s) = numpy.meshgrid(numpy.arange(r_rings, dtype=numpy.float64), numpy.arange(r_sectors, dtype=numpy.float64), indexing='ij')
+    r = r.ravel()
+    s = s.ravel()
+    cos_s = numpy.cos(2*pi * (x0 + s * dx / sectors) + pi)
+    sin_s = numpy.sin(2*pi * (x0 + s * dx / sectors) + pi)
+    sin_r = numpy.sin(pi * (y0 + r * dy / rings))
+    cos_r = numpy.cos(pi * (y0 + r * dy / rings))
+    normals = numpy.column_stack((cos_s * sin_r, sin_s * sin_r, cos_r))
+    if global_texture:
+        texcoords = numpy.column_stack((x0 + s * dx / sectors, y0 + r * dy / rings))
+    else:
+        texcoords = make_texcoords(s / sectors, r / rings, inv_texture_u, inv_texture_v, False)
+    vertices = normals * radius
     if offset is not None:
         normal = UVPatchNormal(x0, y0, x1, y1)
-    
-    for r in range(0, r_rings):
-        for s in range(0, r_sectors):
-            cos_s = cos(2*pi * (x0 + s * dx / sectors) + pi)
-            sin_s = sin(2*pi * (x0 + s * dx / sectors) + pi)
-            sin_r = sin(pi * (y0 + r * dy / rings))
-            cos_r = cos(pi * (y0 + r * dy / rings))
-            x = cos_s * sin_r
-            y = sin_s * sin_r
-            z = cos_r
-            if global_texture:
-                gtw.add_data2f((x0 + s * dx / sectors), (y0 + r * dy / rings))
-            else:
-                u = s / sectors
-                v = r / rings
-                if inv_texture_v:
-                    v = 1.0 - v
-                if inv_texture_u:
-                    u = 1.0 - u
-                gtw.add_data2f(u, v)
-            if offset is not None:
-                gvw.add_data3f(x * radius - normal[0] * offset,
-                               y * radius - normal[1] * offset,
-                               z * radius - normal[2] * offset)
-            else:
-                gvw.add_data3f(x * radius, y * radius, z * radius)
-            gnw.add_data3f(x, y, z)
-            #Derivation wrt s and normalization (sin_r is dropped)
-            gtanw.add_data3f(-sin_s, cos_s, 0) #-y, x, 0
-            #Derivation wrt r
-            binormal = LVector3d(cos_s * cos_r, sin_s * cos_r, -sin_r)
-            binormal.normalize()
-            gbiw.add_data3f(*binormal)
-
-    for r in range(0, r_rings - 1):
-        for s in range(0, r_sectors - 1):
-#             if y0 == 0 and r == 0:
-#                 #prim.addVertices((r+1) * r_sectors + (s+1), (r+1) * r_sectors + s, r * r_sectors + (s+1))
-#             elif y1 == rings and r == r_rings - 1:
-#                 #prim.addVertices((r+1) * r_sectors + (s+1), (r+1) * r_sectors + s, r * r_sectors + (s+1))
-#             else:
-#             if y0 >= 0.5:
-                prim.addVertices(r * r_sectors + s, (r+1) * r_sectors + s, r * r_sectors + (s+1))
-                prim.addVertices((r+1) * r_sectors + (s+1), r * r_sectors + (s+1), (r+1) * r_sectors + s)
-#             else:
-#                 prim.addVertices((r + 1) * r_sectors + s, r * r_sectors + (s+1), r * r_sectors + s)
-#                 prim.addVertices(r * r_sectors + (s+1), (r+1) * r_sectors + s, (r + 1) * r_sectors + (s+1))
-    prim.closePrimitive()
+        vertices -= numpy.array([normal[0], normal[1], normal[2]]) * offset
+    #Derivation wrt s and normalization (sin_r is dropped)
+    tangents = numpy.column_stack((-sin_s, cos_s, numpy.zeros(len(s))))
+    #Derivation wrt r
+    binormals = numpy.column_stack((cos_s * cos_r, sin_s * cos_r, -sin_r))
+    binormals /= numpy.sqrt(numpy.einsum('ij,ij->i', binormals, binormals))[:, numpy.newaxis]
+    write_vertex_data(geom, {'vertex': vertices, 'texcoord': texcoords, 'normal': normals, 'tangent': tangents, 'binormal': binormals})
+
+    set_cached_indices(prim, ('uv', rings, sectors), make_uv_patch_primitives, rings, sectors)
     geom.addPrimitive(prim)
     node.add_geom(geom)
     return path
@@ -517,6 +567,57 @@ def make_config(inner, outer):
     ratio = [inner // x if inner >= x else 1 for x in outer]
     return (nb_vertices, inner, outer, ratio)
 
+grid_cache = {}
+
+def make_grid(inner, nb_vertices, skirt):
+    """Return the (i, j) coordinates of the vertices of a square patch, followed by the
+    coordinates of the four skirt borders if requested."""
+    key = (inner, skirt)
+    grid = grid_cache.get(key)
+    if grid is None:
+        (i, j) = numpy.meshgrid(numpy.arange(nb_vertices, dtype=numpy.float64), numpy.arange(nb_vertices, dtype=numpy.float64), indexing='ij')
+        i = i.ravel()
+        j = j.ravel()
+        if skirt:
+            b = numpy.arange(nb_vertices, dtype=numpy.float64)
+            first = numpy.zeros(nb_vertices)
+            last = numpy.full(nb_vertices, float(inner))
+            i = numpy.concatenate((i, first, last, b, b))
+            j = numpy.concatenate((j, b, b, first, last))
+        grid = (i, j)
+        grid_cache[key] = grid
+    return grid
+
+def make_texcoords(u, v, inv_u, inv_v, swap_uv):
+    if inv_u:
+        u = 1.0 - u
+    if inv_v:
+        v = 1.0 - v
+    if swap_uv:
+        return numpy.column_stack((v, u))
+    else:
+        return numpy.column_stack((u, v))
+
+def set_square_primitives(prim, inner, nb_vertices, ratio, skirt, adaptation=None):
+    if adaptation is None:
+        adaptation = settings.use_patch_adaptation
+    if adaptation:
+        key = ('adapted', inner, tuple(ratio), skirt)
+        set_cached_indices(prim, key, make_adapted_square_all_primitives, inner, nb_vertices, ratio, skirt)
+    else:
+        key = ('square', inner, skirt)
+        set_cached_indices(prim, key, make_square_all_primitives, inner, nb_vertices, skirt)
+
+def make_adapted_square_all_primitives(prim, inner, nb_vertices, ratio, skirt):
+    make_adapted_square_primitives(prim, inner, nb_vertices, ratio)
+    if skirt:
+        make_adapted_square_primitives_skirt(prim, inner, nb_vertices, ratio)
+
+def make_square_all_primitives(prim, inner, nb_vertices, skirt):
+    make_square_primitives(prim, inner, nb_vertices)
+    if skirt:
+        make_primitives_skirt(prim, inner, nb_vertices)
+
 def make_square_primitives(prim, inner, nb_vertices):
     for x in range(0, inner):
         for y in range(0, inner):
@@ -687,78 +788,27 @@ def make_primitives_skirt(prim, inner, nb_vertices):
 def Tile(size, inner, outer=None, inv_u=False, inv_v=True, swap_uv=False):
     (nb_vertices, inner, outer, ratio) = make_config(inner, outer)
     (path, node) = empty_node('uv')
+    skirt = settings.use_patch_skirts
     nb_points = nb_vertices * nb_vertices
     nb_primitives = inner * inner
-    if settings.use_patch_skirts:
+    if skirt:
         nb_points += nb_vertices * 4
         nb_primitives += inner * 4
     (gvw, gcw, gtw, gnw, gtanw, gbiw, prim, geom) = empty_geom('cube', nb_points, nb_primitives, tanbin=True)
     node.add_geom(geom)
 
-    for i in range(0, nb_vertices):
-        for j in range(0, nb_vertices):
-            u = float(i) / inner
-            v = float(j) / inner
-
-            x = u
-            y = v
-
-            if inv_u:
-                u = 1.0 - u
-            if inv_v:
-                v = 1.0 - v
-            if swap_uv:
-                gtw.add_data2f(v, u)
-            else:
-                gtw.add_data2f(u, v)
-            gvw.add_data3f(x * size, y * size, 0)
-            gnw.add_data3f(0, 0, 1.0)
-            gtanw.add_data3f(1, 0, 0)
-            gbiw.add_data3f(0, 1, 0)
-
-    if settings.use_patch_skirts:
-        for a in range(0, 4):
-            for b in range(0, nb_vertices):
-                if a == 0:
-                    i = 0
-                    j = b
-                elif a == 1:
-                    i = inner
-                    j = b
-                elif a == 2:
-                    i = b
-                    j = 0
-                elif a == 3:
-                    i = b
-                    j = inner
-                u = float(i) / inner
-                v = float(j) / inner
-
-                x = u
-                y = v
-
-                if inv_u:
-                    u = 1.0 - u
-                if inv_v:
-                    v = 1.0 - v
-                if swap_uv:
-                    gtw.add_data2f(v, u)
-                else:
-                    gtw.add_data2f(u, v)
-                gvw.add_data3f(x * size, y * size, -size)
-                gnw.add_data3f(0, 0, 1.0)
-                gtanw.add_data3f(1, 0, 0)
-                gbiw.add_data3f(0, 1, 0)
-
-    if settings.use_patch_adaptation:
-        make_adapted_square_primitives(prim, inner, nb_vertices, ratio)
-        if settings.use_patch_skirts:
-            make_adapted_square_primitives_skirt(prim, inner, nb_vertices, ratio)
-    else:
-        make_square_primitives(prim, inner, nb_vertices)
-        if settings.use_patch_skirts:
-            make_primitives_skirt(prim, inner, nb_vertices)
-    prim.closePrimitive()
+    (i, j) = make_grid(inner, nb_vertices, skirt)
+    u = i / inner
+    v = j / inner
+    z = numpy.zeros(nb_points)
+    z[nb_vertices * nb_vertices:] = -size
+    write_vertex_data(geom, {'vertex': numpy.column_stack((u * size, v * size, z)),
+                             'texcoord': make_texcoords(u, v, inv_u, inv_v, swap_uv),
+                             'normal': (0, 0, 1.0),
+                             'tangent': (1, 0, 0),
+                             'binormal': (0, 1, 0)})
+
+    set_square_primitives(prim, inner, nb_vertices, ratio, skirt)
     geom.addPrimitive(prim)
 
     return path
@@ -848,35 +898,16 @@ def SquarePatch(height, inner, outer,
 
     (x0, y0, x1, y1, dx, dy) = convert_xy(x0, y0, x1, y1, x_inverted, y_inverted, xy_swap)
 
-    if offset is None:
-        offset = height
-
-    for i in range(0, nb_vertices):
-        for j in range(0, nb_vertices):
-            x = x0 + i * dx / inner
-            y = y0 + j * dy / inner
-
-            x = 2.0 * x - 1.0
-            y = 2.0 * y - 1.0
-
-            u = float(i) / inner
-            v = float(j) / inner
-
-            if inv_u:
-                u = 1.0 - u
-            if inv_v:
-                v = 1.0 - v
-            if swap_uv:
-                gtw.add_data2f(v, u)
-            else:
-                gtw.add_data2f(u, v)
-            gvw.add_data3f(x * height, y * height, height)
-            gnw.add_data3f(0, 0, 1.0)
-            gtanw.add_data3f(1, 0, 0)
-            gbiw.add_data3f(0, 1, 0)
+    (i, j) = make_grid(inner, nb_vertices, False)
+    x = 2.0 * (x0 + i * dx / inner) - 1.0
+    y = 2.0 * (y0 + j * dy / inner) - 1.0
+    write_vertex_data(geom, {'vertex': numpy.column_stack((x * height, y * height, numpy.full(len(x), float(height)))),
+                             'texcoord': make_texcoords(i / inner, j / inner, inv_u, inv_v, swap_uv),
+                             'normal': (0, 0, 1.0),
+                             'tangent': (1, 0, 0),
+                             'binormal': (0, 1, 0)})
 
-    make_adapted_square_primitives(prim, inner, nb_vertices, ratio)
-    prim.closePrimitive()
+    set_square_primitives(prim, inner, nb_vertices, ratio, False, True)
     geom.addPrimitive(prim)
 
     return path
@@ -887,114 +918,56 @@ def SquaredDistanceSquarePatch(height, inner, outer,
                 x_inverted=False, y_inverted=False, xy_swap=False, offset=None):
     (nb_vertices, inner, outer, ratio) = make_config(inner, outer)
     (path, node) = empty_node('uv')
+    skirt = settings.use_patch_skirts
     nb_points = nb_vertices * nb_vertices
     nb_primitives = inner * inner
-    if settings.use_patch_skirts:
+    if skirt:
         nb_points += nb_vertices * 4
         nb_primitives += inner * 4
     (gvw, gcw, gtw, gnw, gtanw, gbiw, prim, geom) = empty_geom('cube', nb_points, nb_primitives, tanbin=True)
     node.add_geom(geom)
 
-    if offset is not None:
-        normal = SquaredDistanceSquarePatchNormal(x0, y0, x1, y1, x_inverted, y_inverted, xy_swap)
+    normal = SquaredDistanceSquarePatchNormal(x0, y0, x1, y1, x_inverted, y_inverted, xy_swap)
+    normal = numpy.array([normal[0], normal[1], normal[2]])
 
     (x0, y0, x1, y1, dx, dy) = convert_xy(x0, y0, x1, y1, x_inverted, y_inverted, xy_swap)
 
-    for i in range(0, nb_vertices):
-        for j in range(0, nb_vertices):
-            u = float(i) / inner
-            v = float(j) / inner
-            x = x0 + i * dx / inner
-            y = y0 + j * dy / inner
-            x = 2.0 * x - 1.0
-            y = 2.0 * y - 1.0
-            z = 1.0
-            x2 = x * x
-            y2 = y * y
-            z2 = z * z
-            x *= sqrt(1.0 - y2 * 0.5 - z2 * 0.5 + y2 * z2 / 3.0)
-            y *= sqrt(1.0 - z2 * 0.5 - x2 * 0.5 + z2 * x2 / 3.0)
-            z *= sqrt(1.0 - x2 * 0.5 - y2 * 0.5 + x2 * y2 / 3.0)
-            if inv_u:
-                u = 1.0 - u
-            if inv_v:
-                v = 1.0 - v
-            if swap_uv:
-                gtw.add_data2f(v, u)
-            else:
-                gtw.add_data2f(u, v)
-            if offset is not None:
-                gvw.add_data3f(x * height - normal[0] * offset,
-                               y * height - normal[1] * offset,
-                               z * height - normal[2] * offset)
-            else:
-                gvw.add_data3f(x * height, y * height, z * height)
-            gnw.add_data3f(x, y, z)
-            gtanw.add_data3f(z, y, -x)
-            gbiw.add_data3f(x, z, -y)
-
-    if settings.use_patch_skirts:
-        if offset is None:
-            offset = 0
-        offset = offset + sqrt(dx * dx + dy * dy) / inner
-        for a in range(0, 4):
-            for b in range(0, nb_vertices):
-                if a == 0:
-                    i = 0
-                    j = b
-                elif a == 1:
-                    i = inner
-                    j = b
-                elif a == 2:
-                    i = b
-                    j = 0
-                elif a == 3:
-                    i = b
-                    j = inner
-                u = float(i) / inner
-                v = float(j) / inner
-                x = x0 + i * dx / inner
-                y = y0 + j * dy / inner
-                x = 2.0 * x - 1.0
-                y = 2.0 * y - 1.0
-                z = 1.0
-                x2 = x * x
-                y2 = y * y
-                z2 = z * z
-                x *= sqrt(1.0 - y2 * 0.5 - z2 * 0.5 + y2 * z2 / 3.0)
-                y *= sqrt(1.0 - z2 * 0.5 - x2 * 0.5 + z2 * x2 / 3.0)
-                z *= sqrt(1.0 - x2 * 0.5 - y2 * 0.5 + x2 * y2 / 3.0)
-                if inv_u:
-                    u = 1.0 - u
-                if inv_v:
-                    v = 1.0 - v
-                if swap_uv:
-                    gtw.add_data2f(v, u)
-                else:
-                    gtw.add_data2f(u, v)
-                if offset is not None:
-                    gvw.add_data3f(x * height - normal[0] * offset,
-                                   y * height - normal[1] * offset,
-                                   z * height - normal[2] * offset)
-                else:
-                    gvw.add_data3f(x * height, y * height, z * height)
-                gnw.add_data3f(x, y, z)
-                gtanw.add_data3f(z, y, -x)
-                gbiw.add_data3f(x, z, -y)
-
-    if settings.use_patch_adaptation:
-        make_adapted_square_primitives(prim, inner, nb_vertices, ratio)
-        if settings.use_patch_skirts:
-            make_adapted_square_primitives_skirt(prim, inner, nb_vertices, ratio)
-    else:
-        make_square_primitives(prim, inner, nb_vertices)
-        if settings.use_patch_skirts:
-            make_primitives_skirt(prim, inner, nb_vertices)
-    prim.closePrimitive()
+    (i, j) = make_grid(inner, nb_vertices, skirt)
+    x = 2.0 * (x0 + i * dx / inner) - 1.0
+    y = 2.0 * (y0 + j * dy / inner) - 1.0
+    x2 = x * x
+    y2 = y * y
+    #z = 1.0
+    x = x * numpy.sqrt(1.0 - y2 * 0.5 - 0.5 + y2 / 3.0)
+    y = y * numpy.sqrt(1.0 - 0.5 - x2 * 0.5 + x2 / 3.0)
+    z = numpy.sqrt(1.0 - x2 * 0.5 - y2 * 0.5 + x2 * y2 / 3.0)
+    normals = numpy.column_stack((x, y, z))
+    vertices = normals * height
+    offsets = make_offsets(nb_vertices, skirt, offset, dx, dy, inner)
+    if offsets is not None:
+        vertices -= offsets[:, numpy.newaxis] * normal
+    write_vertex_data(geom, {'vertex': vertices,
+                             'texcoord': make_texcoords(i / inner, j / inner, inv_u, inv_v, swap_uv),
+                             'normal': normals,
+                             'tangent': numpy.column_stack((z, y, -x)),
+                             'binormal': numpy.column_stack((x, z, -y))})
+
+    set_square_primitives(prim, inner, nb_vertices, ratio, skirt)
     geom.addPrimitive(prim)
 
     return path
 
+def make_offsets(nb_vertices, skirt, offset, dx, dy, inner):
+    """Return the offset along the patch normal of each vertex, the skirt is moved down by one cell size."""
+    if offset is None and not skirt:
+        return None
+    if offset is None:
+        offset = 0
+    offsets = numpy.full(nb_vertices * nb_vertices + (nb_vertices * 4 if skirt else 0), float(offset))
+    if skirt:
+        offsets[nb_vertices * nb_vertices:] += sqrt(dx * dx + dy * dy) / inner
+    return offsets
+
 def SquaredDistanceSquarePatchPoint(radius,
                                     u, v,
                                     x0, y0, x1, y1,
@@ -1058,98 +1031,36 @@ def NormalizedSquarePatch(height, inner, outer,
                           x_inverted=False, y_inverted=False, xy_swap=False, offset=None):
     (nb_vertices, inner, outer, ratio) = make_config(inner, outer)
     (path, node) = empty_node('uv')
+    skirt = settings.use_patch_skirts
     nb_points = nb_vertices * nb_vertices
     nb_primitives = inner * inner
-    if settings.use_patch_skirts:
+    if skirt:
         nb_points += nb_vertices * 4
         nb_primitives += inner * 4
     (gvw, gcw, gtw, gnw, gtanw, gbiw, prim, geom) = empty_geom('cube', nb_points, nb_primitives, tanbin=True)
     node.add_geom(geom)
 
-    if offset is not None:
-        normal = NormalizedSquarePatchNormal(x0, y0, x1, y1, x_inverted, y_inverted, xy_swap)
+    normal = NormalizedSquarePatchNormal(x0, y0, x1, y1, x_inverted, y_inverted, xy_swap)
+    normal = numpy.array([normal[0], normal[1], normal[2]])
 
     (x0, y0, x1, y1, dx, dy) = convert_xy(x0, y0, x1, y1, x_inverted, y_inverted, xy_swap)
 
-    for i in range(0, nb_vertices):
-        for j in range(0, nb_vertices):
-            x = x0 + i * dx / inner
-            y = y0 + j * dy / inner
-            vec = LVector3d(2.0 * x - 1.0, 2.0 * y - 1.0, 1.0)
-            vec.normalize()
-            u = float(i) / inner
-            v = float(j) / inner
-            if inv_u:
-                u = 1.0 - u
-            if inv_v:
-                v = 1.0 - v
-            if swap_uv:
-                gtw.add_data2f(v, u)
-            else:
-                gtw.add_data2f(u, v)
-            nvec = vec
-            vec = vec * height
-            if offset is not None:
-                vec = vec - normal * offset
-            gvw.add_data3f(*vec)
-            gnw.add_data3f(nvec.x, nvec.y, nvec.z)
-            gtanw.add_data3f(-(1.0 + y*y), x*y, x)
-            gbiw.add_data3f(x * y, -(1.0 + x*x), y)
-            #gtanw.add_data3f(vec.z, vec.y, -vec.x)
-            #gbiw.add_data3f(vec.x, vec.z, -vec.y)
-
-    if settings.use_patch_skirts:
-        if offset is None:
-            offset = 0
-        offset = offset + sqrt(dx * dx + dy * dy) / inner
-        for a in range(0, 4):
-            for b in range(0, nb_vertices):
-                if a == 0:
-                    i = 0
-                    j = b
-                elif a == 1:
-                    i = inner
-                    j = b
-                elif a == 2:
-                    i = b
-                    j = 0
-                elif a == 3:
-                    i = b
-                    j = inner
-                x = x0 + i * dx / inner
-                y = y0 + j * dy / inner
-                vec = LVector3d(2.0 * x - 1.0, 2.0 * y - 1.0, 1.0)
-                vec.normalize()
-                u = float(i) / inner
-                v = float(j) / inner
-                if inv_u:
-                    u = 1.0 - u
-                if inv_v:
-                    v = 1.0 - v
-                if swap_uv:
-                    gtw.add_data2f(v, u)
-                else:
-                    gtw.add_data2f(u, v)
-                nvec = vec
-                vec = vec * height
-                if offset is not None:
-                    vec = vec - normal * offset
-                gvw.add_data3f(*vec)
-                gnw.add_data3f(nvec.x, nvec.y, nvec.z)
-                gtanw.add_data3f(-(1.0 + y*y), x*y, x)
-                gbiw.add_data3f(x * y, -(1.0 + x*x), y)
-                #gtanw.add_data3f(vec.z, vec.y, -vec.x)
-                #gbiw.add_data3f(vec.x, vec.z, -vec.y)
-
-    if settings.use_patch_adaptation:
-        make_adapted_square_primitives(prim, inner, nb_vertices, ratio)
-        if settings.use_patch_skirts:
-            make_adapted_square_primitives_skirt(prim, inner, nb_vertices, ratio)
-    else:
-        make_square_primitives(prim, inner, nb_vertices)
-        if settings.use_patch_skirts:
-            make_primitives_skirt(prim, inner, nb_vertices)
-    prim.closePrimitive()
+    (i, j) = make_grid(inner, nb_vertices, skirt)
+    x = x0 + i * dx / inner
+    y = y0 + j * dy / inner
+    normals = numpy.column_stack((2.0 * x - 1.0, 2.0 * y - 1.0, numpy.ones(len(x))))
+    normals /= numpy.sqrt(numpy.einsum('ij,ij->i', normals, normals))[:, numpy.newaxis]
+    vertices = normals * height
+    offsets = make_offsets(nb_vertices, skirt, offset, dx, dy, inner)
+    if offsets is not None:
+        vertices -= offsets[:, numpy.newaxis] * normal
+    write_vertex_data(geom, {'vertex': vertices,
+                             'texcoord': make_texcoords(i / inner, j / inner, inv_u, inv_v, swap_uv),
+                             'normal': normals,
+                             'tangent': numpy.column_stack((-(1.0 + y*y), x*y, x)),
+                             'binormal': numpy.column_stack((x * y, -(1.0 + x*x), y))})
+
+    set_square_primitives(prim, inner, nb_vertices, ratio, skirt)
     geom.addPrimitive(prim)
 
     return path
@@ -0,0 +1,107 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from .pstats import levelpstat
+
+from collections import OrderedDict
+
+class LRUCache(object):
+    """Least recently used cache bounded by a number of entries and a memory budget.
+    The entries are identified by their owner and a key local to the owner, the owner is
+    notified through release() when one of its entries is evicted.
+    The entries that are still in use must be reported by is_pinned() and are never evicted."""
+    def __init__(self, name, max_entries, max_size):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def add(self, owner, key, item, size=0):
+        self.entries[(owner, key)] = [item, size]
+        self.size += size
+        self.misses += 1
+        self.evict()
+
+    def get(self, owner, key):
+        entry_key = (owner, key)
+        entry = self.entries.pop(entry_key, None)
+        if entry is None:
+            return None
+        self.entries[entry_key] = entry
+        self.hits += 1
+        return entry[0]
+
+    def touch(self, owner, key):
+        entry_key = (owner, key)
+        entry = self.entries.pop(entry_key, None)
+        if entry is not None:
+            self.entries[entry_key] = entry
+            self.hits += 1
+
+    def set_size(self, owner, key, size):
+        entry = self.entries.get((owner, key))
+        if entry is not None:
+            self.size += size - entry[1]
+            entry[1] = size
+            self.evict()
+
+    def remove(self, owner, key):
+        entry = self.entries.pop((owner, key), None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def is_pinned(self, owner, key, item):
+        return False
+
+    def release(self, owner, key, item):
+        pass
+
+    def evict(self):
+        if len(self.entries) <= self.max_entries and self.size <= self.max_size: return
+        evicted = []
+        nb_entries = len(self.entries)
+        size = self.size
+        for (entry_key, entry) in self.entries.items():
+            if nb_entries <= self.max_entries and size <= self.max_size: break
+            if self.is_pinned(entry_key[0], entry_key[1], entry[0]): continue
+            evicted.append((entry_key, entry[0]))
+            nb_entries -= 1
+            size -= entry[1]
+        for ((owner, key), item) in evicted:
+            self.remove(owner, key)
+            self.release(owner, key, item)
+            self.evictions += 1
+
+    def update_stats(self):
+        levelpstat('entries', self.name).set_level(len(self.entries))
+        levelpstat('memory', self.name).set_level(self.size)
+        levelpstat('hits', self.name).set_level(self.hits)
+        levelpstat('misses', self.name).set_level(self.misses)
+        levelpstat('evictions', self.name).set_level(self.evictions)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
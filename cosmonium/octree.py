@@ -23,8 +23,13 @@ try:
     from cosmonium_engine import OctreeNode, OctreeLeaf, InfiniteFrustum, VisibleObjectsTraverser
     hasOctreeLeaf = True
 except ImportError as e:
-    print("WARNING: Could not load Octree C implementation, fallback on python implementation")
+    print("WARNING: Could not load Octree C implementation, fallback on numpy implementation")
     print("\t", e)
-    from .pyengine.pyoctree import OctreeNode, OctreeLeaf, VisibleObjectsTraverser
+    try:
+        from .pyengine.npoctree import OctreeNode, OctreeLeaf, VisibleObjectsTraverser
+    except ImportError as e:
+        print("WARNING: Could not load Octree numpy implementation, fallback on python implementation")
+        print("\t", e)
+        from .pyengine.pyoctree import OctreeNode, OctreeLeaf, VisibleObjectsTraverser
     from .pyengine.pyfrustum import InfiniteFrustum
     hasOctreeLeaf = False
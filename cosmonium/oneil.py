@@ -75,7 +75,7 @@ class ONeilAtmosphere(Atmosphere):
         inside = self.owner.distance_to_obs < radius
         if self.inside != inside:
             self.inside = inside
-            self.shader.scattering.inside = inside
+            self.shader.scattering.set_inside(inside)
             self.update_shader()
             self.update_scattering()
         return Atmosphere.update_instance(self, camera_pos, orientation)
@@ -39,7 +39,8 @@ class PlacerYamlParser(YamlModuleParser):
         extra = {}
         (placer_type, placer_data) = self.get_type_and_data(data, default)
         if placer_type == 'random':
-            placer = RandomObjectPlacer()
+            max_slope = placer_data.get('max-slope', None)
+            placer = RandomObjectPlacer(max_slope)
         else:
             print("Unknown placer", placer_type)
         return placer
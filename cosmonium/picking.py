@@ -0,0 +1,160 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from panda3d.core import LPoint2, LVector3, LVector3d
+
+from .bodies import StellarBody
+from .systems import StellarSystem
+from .utils import mag_to_scale
+from . import settings
+
+from math import sqrt
+
+def ray_sphere_intersection(origin, direction, radius):
+    """Return the distance along the ray to the first intersection with the sphere
+    centered at the origin, or None if the ray misses it."""
+    a = direction.dot(direction)
+    b = origin.dot(direction)
+    c = origin.dot(origin) - radius * radius
+    disc = b * b - a * c
+    if disc < 0.0:
+        return None
+    root = sqrt(disc)
+    distance = (-b - root) / a
+    if distance < 0.0:
+        #The origin is inside the sphere
+        distance = (-b + root) / a
+        if distance < 0.0:
+            return None
+    return distance
+
+class PickingResult(object):
+    def __init__(self):
+        self.body = None
+        self.distance = float('inf')
+        self.point = None
+        self.point_score = float('inf')
+        self.point_distance = float('inf')
+        self.meshes = []
+
+    def add_hit(self, body, distance):
+        if distance < self.distance:
+            self.body = body
+            self.distance = distance
+
+    def add_point(self, body, score, distance):
+        if score < self.point_score:
+            self.point = body
+            self.point_score = score
+            self.point_distance = distance
+
+    def add_mesh(self, body, distance):
+        self.meshes.append((distance, body))
+
+    def get_over(self):
+        if self.point is not None and self.point_distance < self.distance:
+            return self.point
+        return self.body
+
+class AnalyticPicker(object):
+    """Find the object under the mouse using analytic ray tests against the objects updated
+    during the frame instead of traversing the scene graph.
+    Resolved bodies are tested as ellipsoids and the objects rendered as points are tested
+    using their angular distance to the ray, weighted by their apparent size.
+    Only the resolved meshes that can not be approximated by an ellipsoid are reported
+    as candidates to a precise test."""
+
+    def __init__(self, universe, observer):
+        self.universe = universe
+        self.observer = observer
+
+    def get_ray(self, mpos):
+        direction = LVector3()
+        if not self.observer.realCamLens.extrude_vec(LPoint2(mpos), direction):
+            return None
+        direction = self.observer.get_camera_rot().xform(LVector3d(*direction))
+        direction.normalize()
+        return direction
+
+    def pick(self, mpos):
+        result = PickingResult()
+        direction = self.get_ray(mpos)
+        if direction is None:
+            return result
+        pixel_size = self.observer.pixel_size
+        for leaf in self.universe.get_full_leaves():
+            self.test_object(leaf, direction, pixel_size, result)
+        if self.universe.pipeline is not None:
+            point = self.universe.pipeline.pick(direction, pixel_size, settings.picking_tolerance)
+            if point is not None:
+                result.add_point(*point)
+        result.meshes.sort(key=lambda x: x[0])
+        return result
+
+    def test_point(self, body, direction, pixel_size, result):
+        cos_angle = direction.dot(-body.vector_to_obs)
+        if cos_angle <= 0.0: return
+        scale = mag_to_scale(body._app_magnitude)
+        if scale <= 0.0: return
+        cos_angle = min(cos_angle, 1.0)
+        pixels = sqrt(1.0 - cos_angle * cos_angle) / cos_angle / pixel_size
+        size = max(settings.min_point_size, settings.min_point_size + scale * settings.mag_pixel_scale)
+        score = pixels / (size / 2.0 + settings.picking_tolerance)
+        if score <= 1.0:
+            result.add_point(body, score, body.distance_to_obs)
+
+    def test_body(self, body, direction, result):
+        origin = -body.rel_position
+        if isinstance(body, StellarBody):
+            shape = body.surface.shape if body.surface is not None else None
+            if body.ring is None and (shape is None or shape.is_spherical()):
+                #Move the ray in the unit sphere space of the body
+                rotation = body.get_abs_rotation().conjugate()
+                scale = body.get_shape_scale()
+                origin = rotation.xform(origin)
+                ray = rotation.xform(direction)
+                origin = LVector3d(origin[0] / scale[0], origin[1] / scale[1], origin[2] / scale[2])
+                ray = LVector3d(ray[0] / scale[0], ray[1] / scale[1], ray[2] / scale[2])
+                distance = ray_sphere_intersection(origin, ray, 1.0)
+                if distance is not None:
+                    result.add_hit(body, distance)
+                return
+        #Use the bounding sphere to select the meshes to test
+        distance = ray_sphere_intersection(origin, direction, body.get_extend())
+        if distance is not None:
+            result.add_mesh(body, distance)
+
+    def test_object(self, body, direction, pixel_size, result):
+        if not body.visible: return
+        if body.resolved:
+            if isinstance(body, StellarSystem):
+                for child in body.children:
+                    self.test_object(child, direction, pixel_size, result)
+                return
+            if not body.virtual_object:
+                self.test_body(body, direction, result)
+            if body.visible_size < settings.min_body_size * 2:
+                #The body is also drawn as a point
+                self.test_point(body, direction, pixel_size, result)
+        else:
+            self.test_point(body, direction, pixel_size, result)
@@ -0,0 +1,239 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from .foundation import BaseObject
+from .bodyclass import bodyClasses
+from .bodies import StellarObject
+from .astro import units
+from . import settings
+
+import numpy
+
+class PointsUpdatePipeline(object):
+    """Per-frame update of the leaves of the universe that are only rendered as points.
+    The positions, distances, sizes and magnitudes of these leaves are kept in shared arrays
+    and the update_obs, check_visibility and instance passes are done as vector operations.
+    The other leaves, and the points that become resolved, go through the usual methods."""
+    initial_capacity = 1024
+
+    def __init__(self):
+        self.rows = {}
+        self.capacity = 0
+        self.nb_rows = 0
+        self.global_positions = None
+        self.local_positions = None
+        self.extends = None
+        self.abs_magnitudes = None
+        self.point_colors = None
+        self.oid_colors = None
+        self.has_halo = None
+        self.visible = None
+        self.reserve(self.initial_capacity)
+        self.points = []
+        self.full_leaves = []
+        self.indexes = numpy.empty(0, dtype=numpy.intp)
+        self.rel_positions = None
+        self.distances = None
+        self.visible_sizes = None
+        self.app_magnitudes = None
+        self.points_visible = None
+
+    def reserve(self, size):
+        if size <= self.capacity: return
+        capacity = max(self.capacity, self.initial_capacity)
+        while capacity < size:
+            capacity *= 2
+        count = self.nb_rows
+        def grow(array, shape, dtype):
+            new_array = numpy.zeros(shape, dtype=dtype)
+            if array is not None:
+                new_array[:count] = array[:count]
+            return new_array
+        self.global_positions = grow(self.global_positions, (capacity, 3), numpy.float64)
+        self.local_positions = grow(self.local_positions, (capacity, 3), numpy.float64)
+        self.extends = grow(self.extends, capacity, numpy.float64)
+        self.abs_magnitudes = grow(self.abs_magnitudes, capacity, numpy.float64)
+        self.point_colors = grow(self.point_colors, (capacity, 4), numpy.float32)
+        self.oid_colors = grow(self.oid_colors, (capacity, 4), numpy.float32)
+        self.has_halo = grow(self.has_halo, capacity, bool)
+        self.visible = grow(self.visible, capacity, bool)
+        self.capacity = capacity
+
+    def store(self, body):
+        row = self.rows.get(body)
+        if row is None:
+            row = self.nb_rows
+            self.reserve(row + 1)
+            self.rows[body] = row
+            self.nb_rows += 1
+        self.global_positions[row] = tuple(body._global_position)
+        self.local_positions[row] = tuple(body._local_position)
+        self.extends[row] = body._extend
+        self.abs_magnitudes[row] = body.get_abs_magnitude()
+        self.point_colors[row] = tuple(body.point_color)
+        if body.oid_color is not None:
+            self.oid_colors[row] = tuple(body.oid_color)
+        self.has_halo[row] = body.has_halo
+        self.visible[row] = body.visible
+        return row
+
+    def is_point(self, leaf):
+        return leaf.update_frozen and not leaf.resolved and not bodyClasses.get_show_label(leaf.body_class)
+
+    def split(self, leaves, extra):
+        """Select the leaves that can be processed as points for this frame."""
+        previous = set(self.points)
+        points = []
+        full_leaves = []
+        for leaf in leaves:
+            if self.is_point(leaf) and not leaf in extra:
+                points.append(leaf)
+            else:
+                full_leaves.append(leaf)
+        for leaf in points:
+            if leaf not in previous:
+                #The leaf was processed as a full object, remove its instances and refresh its values
+                if leaf.init_components or leaf.init_annotations or leaf.label is not None:
+                    leaf.remove_instance()
+                self.store(leaf)
+        self.points = points
+        self.full_leaves = full_leaves
+        self.indexes = numpy.fromiter((self.rows[leaf] for leaf in points), numpy.intp, len(points))
+
+    def update_obs(self, observer):
+        """Compute the position of the points relative to the observer and return the
+        nearest point and its distance."""
+        indexes = self.indexes
+        StellarObject.nb_obs += len(indexes)
+        camera_global_pos = numpy.array(tuple(observer.camera_global_pos))
+        camera_local_pos = numpy.array(tuple(observer._position))
+        self.rel_positions = (self.global_positions[indexes] - camera_global_pos) + (self.local_positions[indexes] - camera_local_pos)
+        self.distances = numpy.sqrt(numpy.einsum('ij,ij->i', self.rel_positions, self.rel_positions))
+        if len(indexes) > 0:
+            nearest = numpy.argmin(self.distances)
+            return (self.points[nearest], self.distances[nearest])
+        else:
+            return (None, None)
+
+    def check_visibility(self, pixel_size, observer):
+        """Compute the visibility of the points and return the points that are resolved.
+        These are removed from the points list and must be processed as full objects."""
+        indexes = self.indexes
+        StellarObject.nb_visibility += len(indexes)
+        distances = self.distances
+        positive = distances > 0.0
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            self.visible_sizes = numpy.where(positive, self.extends[indexes] / (distances * pixel_size), 0.0)
+            self.app_magnitudes = numpy.where(positive, self.abs_magnitudes[indexes] + 5 * (numpy.log10(distances / units.KmPerParsec) - 1), 99.0)
+        resolved = self.visible_sizes > settings.min_body_size
+        self.points_visible = (self.visible_sizes > 1.0) | (self.app_magnitudes < settings.lowest_app_magnitude)
+        promoted = []
+        if resolved.any():
+            kept = ~resolved
+            for index in numpy.flatnonzero(resolved):
+                leaf = self.points[index]
+                leaf.update_obs(observer)
+                leaf.check_visibility(pixel_size)
+                promoted.append(leaf)
+            self.points = [leaf for (leaf, keep) in zip(self.points, kept) if keep]
+            self.indexes = indexes[kept]
+            self.rel_positions = self.rel_positions[kept]
+            self.distances = distances[kept]
+            self.visible_sizes = self.visible_sizes[kept]
+            self.app_magnitudes = self.app_magnitudes[kept]
+            self.points_visible = self.points_visible[kept]
+            self.full_leaves += promoted
+        #Only update the flags of the objects that changed visibility
+        changed = self.visible[self.indexes] != self.points_visible
+        for index in numpy.flatnonzero(changed):
+            leaf = self.points[index]
+            leaf.visible = bool(self.points_visible[index])
+            leaf.resolved = False
+            leaf.in_view = True
+        self.visible[self.indexes] = self.points_visible
+        return promoted
+
+    def get_real_pos_rel(self, rel_positions, distances):
+        midPlane = BaseObject.context.observer.midPlane
+        distances = distances / settings.scale
+        positions = rel_positions / settings.scale
+        scale_factors = numpy.full(len(distances), 1.0 / settings.scale)
+        if settings.use_depth_scaling:
+            far = distances > midPlane
+            if far.any():
+                far_distances = distances[far]
+                directions = positions[far] / far_distances[:, numpy.newaxis]
+                if settings.use_inv_scaling:
+                    scaled_distances = midPlane * (1 - midPlane / far_distances)
+                else:
+                    scaled_distances = midPlane * (1 - numpy.log2(midPlane / far_distances + 1))
+                new_distances = midPlane + scaled_distances
+                positions[far] = directions * new_distances[:, numpy.newaxis]
+                scale_factors[far] = new_distances / far_distances / settings.scale
+                distances[far] = new_distances
+        return positions, distances, scale_factors
+
+    def update_instances(self, pointset, haloset):
+        StellarObject.nb_instance += len(self.points)
+        visible = self.points_visible
+        if visible is None or not visible.any(): return
+        indexes = self.indexes[visible]
+        app_magnitudes = self.app_magnitudes[visible]
+        positions, _, _ = self.get_real_pos_rel(self.rel_positions[visible], self.distances[visible])
+        scales = settings.min_mag_scale + (1 - settings.min_mag_scale) * (settings.lowest_app_magnitude - app_magnitudes) / (settings.lowest_app_magnitude - settings.max_app_magnitude)
+        scales = numpy.where(app_magnitudes < settings.max_app_magnitude, 1.0, scales)
+        scales = numpy.where(app_magnitudes > settings.lowest_app_magnitude, 0.0, scales)
+        shown = scales > 0
+        if shown.any():
+            colors = self.point_colors[indexes[shown]] * scales[shown, numpy.newaxis]
+            sizes = numpy.maximum(settings.min_point_size, settings.min_point_size + scales[shown] * settings.mag_pixel_scale)
+            pointset.add_points(positions[shown], colors, sizes, self.oid_colors[indexes[shown]])
+        if settings.show_halo:
+            halo = shown & self.has_halo[indexes] & (app_magnitudes < settings.smallest_glare_mag)
+            if halo.any():
+                coefs = settings.smallest_glare_mag - app_magnitudes[halo] + 6.0
+                radius = numpy.maximum(self.visible_sizes[visible][halo], 1.0)
+                sizes = radius * coefs * 2.0
+                haloset.add_points(positions[halo], self.point_colors[indexes[halo]], sizes, self.oid_colors[indexes[halo]])
+
+    def pick(self, direction, pixel_size, tolerance):
+        """Find the point the nearest to the given ray, weighted by its apparent size.
+        Return the point, its score and its distance or None if no point is under the ray."""
+        visible = self.points_visible
+        if visible is None or not visible.any(): return None
+        selection = numpy.flatnonzero(visible)
+        rel_positions = self.rel_positions[selection]
+        distances = self.distances[selection]
+        app_magnitudes = self.app_magnitudes[selection]
+        cos_angles = rel_positions.dot(numpy.array(tuple(direction))) / distances
+        scales = settings.min_mag_scale + (1 - settings.min_mag_scale) * (settings.lowest_app_magnitude - app_magnitudes) / (settings.lowest_app_magnitude - settings.max_app_magnitude)
+        scales = numpy.where(app_magnitudes < settings.max_app_magnitude, 1.0, scales)
+        candidates = (cos_angles > 0.0) & (app_magnitudes <= settings.lowest_app_magnitude)
+        if not candidates.any(): return None
+        cos_angles = numpy.minimum(cos_angles, 1.0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            pixels = numpy.sqrt(1.0 - cos_angles * cos_angles) / cos_angles / pixel_size
+        sizes = numpy.maximum(settings.min_point_size, settings.min_point_size + scales * settings.mag_pixel_scale)
+        scores = numpy.where(candidates, pixels / (sizes / 2.0 + tolerance), numpy.inf)
+        best = numpy.argmin(scores)
+        if scores[best] > 1.0: return None
+        return (self.points[selection[best]], scores[best], distances[best])
@@ -20,7 +20,7 @@
 from __future__ import print_function
 from __future__ import absolute_import
 
-from panda3d.core import GeomVertexArrayFormat, InternalName, GeomVertexFormat, GeomVertexData, GeomVertexWriter
+from panda3d.core import GeomVertexArrayFormat, InternalName, GeomVertexFormat, GeomVertexData
 from panda3d.core import GeomPoints, Geom, GeomNode
 from panda3d.core import NodePath, OmniBoundingVolume
 from .foundation import VisibleObject
@@ -28,8 +28,11 @@ from .appearances import ModelAppearance
 from .shaders import BasicShader, FlatLightingModel, StaticSizePointControl
 from .sprites import SimplePoint, RoundDiskPointSprite
 
+import numpy
+
 class PointsSet(VisibleObject):
     tex = None
+    initial_capacity = 1024
     def __init__(self, use_sprites=True, use_sizes=True, points_size=2, sprite=None, background=None, shader=None):
         self.gnode = GeomNode('starfield')
         self.use_sprites = use_sprites
@@ -40,9 +43,9 @@ class PointsSet(VisibleObject):
             shader = BasicShader(lighting_model=FlatLightingModel(), vertex_oids=True)
         self.shader = shader
 
+        self.geom = self.makeGeom()
+        self.data = numpy.zeros((self.initial_capacity, self.nb_columns), dtype=numpy.float32)
         self.reset()
-
-        self.geom = self.makeGeom([], [], [], [])
         self.gnode.addGeom(self.geom)
         self.instance = NodePath(self.gnode)
         if self.use_sprites:
@@ -72,69 +75,86 @@ class PointsSet(VisibleObject):
         pass
 
     def reset(self):
-        self.points = []
-        self.colors = []
-        self.sizes = []
-        self.oids = []
+        self.count = 0
+
+    def reserve(self, size):
+        capacity = len(self.data)
+        if size <= capacity: return
+        while capacity < size:
+            capacity *= 2
+        data = numpy.zeros((capacity, self.nb_columns), dtype=numpy.float32)
+        data[:self.count] = self.data[:self.count]
+        self.data = data
 
     def add_point_scale(self, position, color, size, oids):
         #Observer is at position (0, 0, 0)
         distance_to_obs = position.length()
         vector_to_obs = -position / distance_to_obs
         point, _, _ = self.get_real_pos_rel(position, distance_to_obs, vector_to_obs)
-        self.points.append(point)
-        self.colors.append(color)
-        self.sizes.append(size)
-        self.oids.append(oids)
+        self.add_point(point, color, size, oids)
 
     def add_point(self, position, color, size, oid):
-        self.points.append(position)
-        self.colors.append(color)
-        self.sizes.append(size)
-        self.oids.append(oid)
+        index = self.count
+        if index == len(self.data):
+            self.reserve(index + 1)
+        row = self.data[index]
+        row[0:3] = (position[0], position[1], position[2])
+        row[3:7] = (color[0], color[1], color[2], color[3])
+        if self.use_sizes:
+            row[self.size_column] = size
+        if self.use_oids:
+            row[self.oid_column:self.oid_column + 4] = (oid[0], oid[1], oid[2], oid[3])
+        self.count += 1
+
+    def add_points(self, positions, colors, sizes, oids):
+        start = self.count
+        end = start + len(positions)
+        self.reserve(end)
+        rows = self.data[start:end]
+        rows[:, 0:3] = positions
+        rows[:, 3:7] = colors
+        if self.use_sizes:
+            rows[:, self.size_column] = sizes
+        if self.use_oids:
+            rows[:, self.oid_column:self.oid_column + 4] = oids
+        self.count = end
 
     def update(self):
-        self.update_arrays(self.points, self.colors, self.sizes, self.oids)
+        count = self.count
+        if count > self.vdata.get_num_rows():
+            #Grow the vertex data only when needed, it is kept for the next frames
+            self.vdata.unclean_set_num_rows(len(self.data))
+        if count > 0:
+            data = self.data[:count]
+            array = self.vdata.modify_array(0)
+            memoryview(array).cast('B')[:data.nbytes] = data.view(numpy.uint8).ravel()
+        self.geompoints.set_nonindexed_vertices(0, count)
+        if not self.use_sprites:
+            self.geom.mark_bounds_stale()
 
-    def makeGeom(self, points, colors, sizes, oids):
+    def make_format(self):
         array = GeomVertexArrayFormat()
         array.addColumn(InternalName.get_vertex(), 3, Geom.NTFloat32, Geom.CPoint)
         array.addColumn(InternalName.get_color(), 4, Geom.NTFloat32, Geom.CColor)
+        nb_columns = 7
         if self.use_sizes:
             array.addColumn(InternalName.get_size(), 1, Geom.NTFloat32, Geom.COther)
+            self.size_column = nb_columns
+            nb_columns += 1
         if self.use_oids:
             oids_column_name = InternalName.make('oid')
             array.addColumn(oids_column_name, 4, Geom.NTFloat32, Geom.COther)
+            self.oid_column = nb_columns
+            nb_columns += 4
+        self.nb_columns = nb_columns
         format = GeomVertexFormat()
         format.addArray(array)
-        format = GeomVertexFormat.registerFormat(format)
-        vdata = GeomVertexData('vdata', format, Geom.UH_static)
-        vdata.unclean_set_num_rows(len(points))
-        self.vwriter = GeomVertexWriter(vdata, InternalName.get_vertex())
-        self.colorwriter = GeomVertexWriter(vdata, InternalName.get_color())
-        if self.use_sizes:
-            self.sizewriter = GeomVertexWriter(vdata, InternalName.get_size())
-        if self.use_oids:
-            self.oidwriter = GeomVertexWriter(vdata, oids_column_name)
-        geompoints = GeomPoints(Geom.UH_static)
-        geompoints.reserve_num_vertices(len(points))
-        index = 0
-        for (point, color, size, oid) in zip(points, colors, sizes, oids):
-            self.vwriter.addData3f(*point)
-            #self.colorwriter.addData3f(color[0], color[1], color[2])
-            self.colorwriter.addData4(color)
-            if self.use_sizes:
-                self.sizewriter.addData1f(size)
-            if self.use_oids:
-                self.oidwriter.addData4(oid)
-            geompoints.addVertex(index)
-            geompoints.closePrimitive()
-            index += 1
-        geom = Geom(vdata)
-        geom.addPrimitive(geompoints)
-        return geom
+        return GeomVertexFormat.registerFormat(format)
 
-    def update_arrays(self, points, colors, sizes, oids):
-        self.gnode.removeAllGeoms()
-        self.geom = self.makeGeom(points, colors, sizes, oids)
-        self.gnode.addGeom(self.geom)
+    def makeGeom(self):
+        self.vdata = GeomVertexData('vdata', self.make_format(), Geom.UH_dynamic)
+        self.geompoints = GeomPoints(Geom.UH_dynamic)
+        self.geompoints.set_nonindexed_vertices(0, 0)
+        geom = Geom(self.vdata)
+        geom.addPrimitive(self.geompoints)
+        return geom
@@ -25,8 +25,10 @@ from ..patchedshapes import PatchLodControl
 from ..textures import TexCoord
 
 from .interpolator import BilinearInterpolator
+from .patchcache import patchCache
 
 from math import floor, ceil
+import numpy
 
 class HeightmapPatch:
     cachable = True
@@ -57,6 +59,8 @@ class HeightmapPatch:
         self.lod = None
         self.patch = None
         self.heightmap_ready = False
+        self.source = None
+        self.nb_dependents = 0
 
     @classmethod
     def create_from_patch(cls, noise, parent,
@@ -128,12 +132,25 @@ class HeightmapPatch:
     def get_height_uv(self, u, v):
         return self.get_height(int(u * (self.width - 1)), int(v * (self.height - 1)))
 
+    def get_heights(self, u, v):
+        """Return the heights at the given arrays of u, v coordinates."""
+        return numpy.array([self.get_height_uv(u_i, v_i) for (u_i, v_i) in zip(u, v)], dtype=numpy.float64)
+
+    def get_average_heights(self, u, v):
+        return numpy.array([self.get_average_height_uv(u_i, v_i) for (u_i, v_i) in zip(u, v)], dtype=numpy.float64)
+
     def generate(self):
         pass
 
     def copy_from(self, heightmap_patch):
         pass
 
+    def get_memory_size(self):
+        return 0
+
+    def release(self):
+        pass
+
 class HeightmapPatchFactory(object):
     def create_patch(self, *args, **kwargs):
         return None
@@ -209,6 +226,13 @@ class Heightmap(object):
     def get_height_uv(self, u, v):
         return self.get_height(int(u * (self.width - 1)), int(v * (self.height - 1)))
 
+    def get_heights(self, u, v):
+        """Return the heights at the given arrays of u, v coordinates."""
+        return numpy.array([self.get_height_uv(u_i, v_i) for (u_i, v_i) in zip(u, v)], dtype=numpy.float64)
+
+    def get_average_heights(self, u, v):
+        return numpy.array([self.get_average_height_uv(u_i, v_i) for (u_i, v_i) in zip(u, v)], dtype=numpy.float64)
+
     def get_heightmap(self):
         return None
 
@@ -245,9 +269,28 @@ class PatchedHeightmap(Heightmap):
         return self.map_patch[patch.str_id()].texture_scale
 
     def get_heightmap(self, patch):
-        return self.map_patch.get(patch.str_id(), None)
+        patch_id = patch.str_id()
+        heightmap = self.map_patch.get(patch_id, None)
+        if heightmap is not None:
+            patchCache.touch(self, patch_id)
+        return heightmap
+
+    def evict_patch(self, patch_id):
+        heightmap = self.map_patch.pop(patch_id)
+        if heightmap.source is not None:
+            heightmap.source.nb_dependents -= 1
+            heightmap.source = None
+        heightmap.release()
+
+    def heightmap_ready_cb(self, heightmap, callback, cb_args):
+        patchCache.update_size(self, heightmap.patch.str_id())
+        if callback is not None:
+            callback(heightmap, *cb_args)
 
     def create_heightmap(self, patch, callback=None, cb_args=()):
+        parent_heightmap = None
+        if patch.lod > self.max_lod and patch.parent is not None:
+            parent_heightmap = self.map_patch.get(patch.parent.str_id())
         if not patch.str_id() in self.map_patch:
             #TODO: Should be done by inheritance
             if patch.coord == TexCoord.Cylindrical:
@@ -268,10 +311,13 @@ class PatchedHeightmap(Heightmap):
             self.map_patch[patch.str_id()] = heightmap
             #TODO: Should be linked properly
             heightmap.patch = patch
-            if patch.lod > self.max_lod and patch.parent is not None:
+            patchCache.add(self, patch.str_id(), heightmap)
+            if parent_heightmap is not None:
                 #print("CLONE", patch.str_id())
-                parent_heightmap = self.map_patch[patch.parent.str_id()]
                 heightmap.copy_from(parent_heightmap)
+                #The parent patch must be kept as long as the clone uses its data
+                heightmap.source = parent_heightmap
+                parent_heightmap.nb_dependents += 1
                 delta = patch.lod - heightmap.lod
                 scale = 1 << delta
                 if patch.coord != TexCoord.Flat:
@@ -294,10 +340,12 @@ class PatchedHeightmap(Heightmap):
                     callback(heightmap, *cb_args)
             else:
                 #print("GEN", patch.str_id())
-                heightmap.generate(callback, cb_args)
+                heightmap.generate(self.heightmap_ready_cb, (callback, cb_args))
         else:
             #print("CACHE", patch.str_id())
             heightmap = self.map_patch[patch.str_id()]
+            heightmap.patch = patch
+            patchCache.touch(self, patch.str_id())
             if heightmap.is_ready() and callback is not None:
                 callback(heightmap, *cb_args)
             else:
@@ -324,6 +372,12 @@ class StackedHeightmapPatch(HeightmapPatch):
             height += patch.get_height(x, y)
         return height
 
+    def get_heights(self, u, v):
+        heights = numpy.zeros(len(u))
+        for patch in self.patches:
+            heights += patch.get_heights(u, v)
+        return heights
+
     def sub_callback(self, patch):
         self.count += 1
         if self.count == len(self.patches):
@@ -27,6 +27,7 @@ from .. import settings
 from .shaders import HeightmapDataSource
 
 from math import floor
+import numpy
 
 class TexInterpolator(object):
     def __init__(self):
@@ -39,10 +40,8 @@ class TexInterpolator(object):
             x = min(max(x, 0.0), 1.0)
             y = min(max(y, 0.0), 1.0)
         value = LColor()
-        result = peeker.lookup(value, x, y)
-        if not result:
-            print("Invalid offsets", x, y)
-            return 0.0
+        #lookup() does not report invalid offsets, they are clamped above
+        peeker.lookup(value, x, y)
         if settings.encode_float:
             value = value[0] + value[1] / 255.0 + value[2] / 65025.0 + value[3] / 16581375.0
         else:
@@ -66,9 +65,38 @@ class TexInterpolator(object):
             value = value[0]
         return value
 
+    def get_single_values(self, data, x, y):
+        """Vectorized version of get_single_value, the values are read from the decoded heightmap array."""
+        (height, width) = data.shape
+        x = numpy.clip(numpy.floor(x), 0, width - 1).astype(numpy.intp)
+        y = numpy.clip(numpy.floor(y), 0, height - 1).astype(numpy.intp)
+        return data[y, x]
+
+    def get_bilinear_values(self, data, x, y):
+        """Vectorized version of get_bilinear_value, the values are read from the decoded heightmap array."""
+        (height, width) = data.shape
+        x = numpy.clip(x, 0.0, width) - 0.5
+        y = numpy.clip(y, 0.0, height) - 0.5
+        x0 = numpy.floor(x)
+        y0 = numpy.floor(y)
+        dx = x - x0
+        dy = y - y0
+        x0 = x0.astype(numpy.intp)
+        y0 = y0.astype(numpy.intp)
+        x1 = numpy.minimum(x0 + 1, width - 1)
+        y1 = numpy.minimum(y0 + 1, height - 1)
+        x0 = numpy.maximum(x0, 0)
+        y0 = numpy.maximum(y0, 0)
+        return (data[y0, x0] * (1.0 - dx) + data[y0, x1] * dx) * (1.0 - dy) + (data[y1, x0] * (1.0 - dx) + data[y1, x1] * dx) * dy
+
     def get_value(self, peeker, x, y):
         return None
 
+    def get_values(self, data, x, y):
+        """Return the values at the given arrays of texel coordinates, or None if the interpolator
+        can only sample the texture through a peeker."""
+        return None
+
     def configure_texture(self, texture):
         pass
 
@@ -79,6 +107,9 @@ class NearestInterpolator(TexInterpolator):
     def get_value(self, peeker, x, y):
         return self.get_single_value(peeker, x, y)
 
+    def get_values(self, data, x, y):
+        return self.get_single_values(data, x, y)
+
     def configure_texture(self, texture):
         texture.setMinfilter(Texture.FT_nearest)
         texture.setMagfilter(Texture.FT_nearest)
@@ -90,6 +121,9 @@ class BilinearInterpolator(TexInterpolator):
     def get_value(self, peeker, x, y):
         return self.get_bilinear_value(peeker, x, y)
 
+    def get_values(self, data, x, y):
+        return self.get_bilinear_values(data, x, y)
+
     def configure_texture(self, texture):
         texture.setMinfilter(Texture.FT_linear)
         texture.setMagfilter(Texture.FT_linear)
@@ -101,6 +135,9 @@ class ImprovedBilinearInterpolator(TexInterpolator):
     def get_value(self, peeker, x, y):
         return self.get_bilinear_value(peeker, x, y)
 
+    def get_values(self, data, x, y):
+        return self.get_bilinear_values(data, x, y)
+
     def configure_texture(self, texture):
         texture.setMinfilter(Texture.FT_nearest)
         texture.setMagfilter(Texture.FT_nearest)
@@ -123,6 +160,20 @@ class QuinticInterpolator(TexInterpolator):
 
         return self.get_bilinear_value(peeker, i_x + f_x - 0.5, i_y + f_y - 0.5)
 
+    def get_values(self, data, x, y):
+        x = x + 0.5
+        y = y + 0.5
+
+        i_x = numpy.floor(x)
+        i_y = numpy.floor(y)
+        f_x = x - i_x
+        f_y = y - i_y
+
+        f_x = f_x*f_x*f_x*(f_x*(f_x*6.0-15.0)+10.0)
+        f_y = f_y*f_y*f_y*(f_y*(f_y*6.0-15.0)+10.0)
+
+        return self.get_bilinear_values(data, i_x + f_x - 0.5, i_y + f_y - 0.5)
+
     def configure_texture(self, texture):
         texture.setMinfilter(Texture.FT_linear)
         texture.setMagfilter(Texture.FT_linear)
@@ -0,0 +1,473 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from .shadernoise import NoiseConst, NoiseCoord, SinCosNoise, AbsNoise, NegNoise, RidgedNoise, SquareNoise, CubeNoise
+from .shadernoise import PositionMap, NoiseAdd, NoiseSub, NoiseMul, NoisePow, NoiseThreshold, NoiseClamp, NoiseMap
+from .shadernoise import Noise1D, FbmNoise, SpiralNoise, NoiseWarp, NoiseRotate
+from .shadernoise import GpuNoiseLibPerlin3D, GpuNoiseLibCellular3D, GpuNoiseLibPolkaDot3D
+from .shadernoise import SteGuPerlin3D, SteGuCellular3D, SteGuCellularDiff3D, QuilezPerlin3D, QuilezGradientNoise3D
+from ..textures import TexCoord
+from .. import settings
+
+from math import pi, ceil
+import multiprocessing
+import numpy
+
+#Vectorized port of the noise shaders generated by shadernoise, the whole grid of points is evaluated at once.
+#The points are (3, N) float32 arrays and the computations are done in float32, like on the GPU.
+#The hash based sources (gpu-noise-lib and iq's noises) depend on the float precision of the GPU
+#and only match the shader approximately.
+
+def fract(x):
+    return x - numpy.floor(x)
+
+def mix(x, y, a):
+    return x + (y - x) * a
+
+def interpolation_c1(x):
+    return x * x * (3.0 - 2.0 * x)
+
+def interpolation_c2(x):
+    return x * x * x * (x * (x * 6.0 - 15.0) + 10.0)
+
+#Stefan Gustavson's webgl-noise, see shaders/stegu
+
+def mod289(x):
+    return x - numpy.floor(x * (1.0 / 289.0)) * 289.0
+
+def mod7(x):
+    return x - numpy.floor(x * (1.0 / 7.0)) * 7.0
+
+def permute(x):
+    return mod289((34.0 * x + 1.0) * x)
+
+def taylor_inv_sqrt(r):
+    return 1.79284291400159 - 0.85373472095314 * r
+
+def snoise(point):
+    i = numpy.floor(point + point.sum(axis=0) * (1.0 / 3.0))
+    x0 = point - i + i.sum(axis=0) * (1.0 / 6.0)
+    g = (x0 >= x0[[1, 2, 0]]).astype(point.dtype)
+    l = 1.0 - g
+    i1 = numpy.minimum(g, l[[2, 0, 1]])
+    i2 = numpy.maximum(g, l[[2, 0, 1]])
+    zeros = numpy.zeros_like(x0[0])
+    ones = numpy.ones_like(x0[0])
+    #Offsets of the four corners of the simplex, as (4, 3, N) arrays
+    corners = numpy.stack((numpy.stack((zeros, zeros, zeros)), i1, i2, numpy.stack((ones, ones, ones))))
+    x = numpy.stack((x0, x0 - i1 + 1.0 / 6.0, x0 - i2 + 1.0 / 3.0, x0 - 0.5))
+    i = mod289(i)
+    p = permute(permute(permute(i[2] + corners[:, 2]) + i[1] + corners[:, 1]) + i[0] + corners[:, 0])
+    n_ = 0.142857142857
+    ns_x = n_ * 2.0
+    ns_y = n_ * 0.5 - 1.0
+    ns_z = n_
+    j = p - 49.0 * numpy.floor(p * ns_z * ns_z)
+    x_ = numpy.floor(j * ns_z)
+    y_ = numpy.floor(j - 7.0 * x_)
+    gx = x_ * ns_x + ns_y
+    gy = y_ * ns_x + ns_y
+    h = 1.0 - abs(gx) - abs(gy)
+    sh = -(h <= 0.0).astype(point.dtype)
+    gx = gx + (numpy.floor(gx) * 2.0 + 1.0) * sh
+    gy = gy + (numpy.floor(gy) * 2.0 + 1.0) * sh
+    grads = numpy.stack((gx, gy, h), axis=1)
+    grads *= taylor_inv_sqrt((grads * grads).sum(axis=1))[:, numpy.newaxis]
+    m = numpy.maximum(0.6 - (x * x).sum(axis=1), 0.0)
+    m = m * m
+    return 42.0 * (m * m * (grads * x).sum(axis=1)).sum(axis=0)
+
+def cellular_offsets(p, K=0.142857142857, Ko=0.428571428571, K2=0.020408163265306, Kz=0.166666666667, Kzo=0.416666666667):
+    return numpy.stack((fract(p * K) - Ko,
+                        mod7(numpy.floor(p * K)) * K - Ko,
+                        numpy.floor(p * K2) * Kz - Kzo))
+
+def cellular(point):
+    """Return F1 and F2 of the 3x3x3 cellular noise."""
+    pi_ = mod289(numpy.floor(point))
+    pf = fract(point) - 0.5
+    distances = []
+    for dx in (-1.0, 0.0, 1.0):
+        px = permute(pi_[0] + dx)
+        for dy in (-1.0, 0.0, 1.0):
+            py = permute(px + pi_[1] + dy)
+            for dz in (-1.0, 0.0, 1.0):
+                pz = permute(py + pi_[2] + dz)
+                delta = pf - numpy.array([dx, dy, dz], dtype=point.dtype)[:, numpy.newaxis] + cellular_offsets(pz)
+                distances.append((delta * delta).sum(axis=0))
+    distances = numpy.partition(numpy.stack(distances), 1, axis=0)
+    return numpy.sqrt(distances[:2])
+
+def cellular2x2x2(point):
+    """Return F1 and F2 of the 2x2x2 cellular noise, F2 is sorted like in the shader."""
+    jitter = 0.8
+    pi_ = mod289(numpy.floor(point))
+    pf = fract(point)
+    corners = ((0.0, 0.0), (1.0, 0.0), (0.0, 1.0), (1.0, 1.0))
+    d1 = []
+    d2 = []
+    for (dx, dy) in corners:
+        p = permute(permute(pi_[0] + dx) + pi_[1] + dy)
+        for (dz, d) in ((0.0, d1), (1.0, d2)):
+            delta = pf - numpy.array([dx, dy, dz], dtype=point.dtype)[:, numpy.newaxis] + jitter * cellular_offsets(permute(p + pi_[2] + dz))
+            d.append((delta * delta).sum(axis=0))
+    d1 = numpy.stack(d1)
+    d2 = numpy.stack(d2)
+    d = numpy.minimum(d1, d2)
+    d2 = numpy.maximum(d1, d2)
+    for k in (1, 2, 3):
+        swap = ~(d[0] < d[k])
+        (d[0], d[k]) = (numpy.where(swap, d[k], d[0]), numpy.where(swap, d[0], d[k]))
+    d[1:] = numpy.minimum(d[1:], d2[1:])
+    d[1] = numpy.minimum(numpy.minimum(d[1], d[2]), numpy.minimum(d[3], d2[0]))
+    return numpy.sqrt(d[:2])
+
+#Brian Sharpe's GPU noise lib, see shaders/gpu-noise-lib
+
+def fast32_hash_3d(gridcell):
+    """Return three hashes for the four low z corners and the four high z corners as (3, 4, N) arrays."""
+    somelargefloats = numpy.array([635.298681, 682.357502, 668.926525], dtype=gridcell.dtype)[:, numpy.newaxis, numpy.newaxis]
+    zinc = numpy.array([48.500388, 65.294118, 63.934599], dtype=gridcell.dtype)[:, numpy.newaxis, numpy.newaxis]
+    gridcell = gridcell - numpy.floor(gridcell * (1.0 / 69.0)) * 69.0
+    gridcell_inc1 = (gridcell <= 69.0 - 1.5) * (gridcell + 1.0)
+    x0 = gridcell[0] + 50.0
+    y0 = gridcell[1] + 161.0
+    x1 = gridcell_inc1[0] + 50.0
+    y1 = gridcell_inc1[1] + 161.0
+    x0 *= x0
+    y0 *= y0
+    x1 *= x1
+    y1 *= y1
+    p = numpy.stack((x0 * y0, x1 * y0, x0 * y1, x1 * y1))
+    lowz_mod = 1.0 / (somelargefloats + gridcell[2] * zinc)
+    highz_mod = 1.0 / (somelargefloats + gridcell_inc1[2] * zinc)
+    return (fract(p * lowz_mod), fract(p * highz_mod))
+
+def fast32_hash_3d_cell(gridcell):
+    """Return four hashes for the given cell as a (4, N) array."""
+    somelargefloats = numpy.array([635.298681, 682.357502, 668.926525, 588.255119], dtype=gridcell.dtype)[:, numpy.newaxis]
+    zinc = numpy.array([48.500388, 65.294118, 63.934599, 63.279683], dtype=gridcell.dtype)[:, numpy.newaxis]
+    gridcell = gridcell - numpy.floor(gridcell * (1.0 / 69.0)) * 69.0
+    x = gridcell[0] + 50.0
+    y = gridcell[1] + 161.0
+    return fract(((x * x) * (y * y)) * (1.0 / (somelargefloats + gridcell[2] * zinc)))
+
+def gnl_perlin3d(point):
+    pi_ = numpy.floor(point)
+    pf = point - pi_
+    pf_min1 = pf - 1.0
+    (lowz_hash, highz_hash) = fast32_hash_3d(pi_)
+    xs = numpy.stack((pf[0], pf_min1[0], pf[0], pf_min1[0]))
+    ys = numpy.stack((pf[1], pf[1], pf_min1[1], pf_min1[1]))
+    def grad_results(hashes, z):
+        grad = hashes - 0.49999
+        return (xs * grad[0] + ys * grad[1] + z * grad[2]) / numpy.sqrt((grad * grad).sum(axis=0))
+    blend = interpolation_c2(pf)
+    res0 = mix(grad_results(lowz_hash, pf[2]), grad_results(highz_hash, pf_min1[2]), blend[2])
+    weights = numpy.stack(((1.0 - blend[0]) * (1.0 - blend[1]), blend[0] * (1.0 - blend[1]), (1.0 - blend[0]) * blend[1], blend[0] * blend[1]))
+    return (res0 * weights).sum(axis=0) * 1.1547005383792515290182975610039
+
+def cellular_weight_samples(samples):
+    samples = samples * 2.0 - 1.0
+    return samples * samples * samples - numpy.sign(samples)
+
+def gnl_cellular3d(point):
+    jitter_window = 0.166666666
+    pi_ = numpy.floor(point)
+    pf = point - pi_
+    (lowz_hash, highz_hash) = fast32_hash_3d(pi_)
+    corners_x = numpy.array([0.0, 1.0, 0.0, 1.0], dtype=point.dtype)[:, numpy.newaxis]
+    corners_y = numpy.array([0.0, 0.0, 1.0, 1.0], dtype=point.dtype)[:, numpy.newaxis]
+    distances = []
+    for (hashes, corner_z) in ((lowz_hash, 0.0), (highz_hash, 1.0)):
+        dx = pf[0] - (cellular_weight_samples(hashes[0]) * jitter_window + corners_x)
+        dy = pf[1] - (cellular_weight_samples(hashes[1]) * jitter_window + corners_y)
+        dz = pf[2] - (cellular_weight_samples(hashes[2]) * jitter_window + corner_z)
+        distances.append(dx * dx + dy * dy + dz * dz)
+    return numpy.minimum(distances[0], distances[1]).min(axis=0) * (9.0 / 12.0)
+
+def gnl_polkadot3d(point, radius_low, radius_high):
+    pi_ = numpy.floor(point)
+    pf = point - pi_
+    cell_hash = fast32_hash_3d_cell(pi_)
+    radius = numpy.maximum(0.0, radius_low + cell_hash[3] * (radius_high - radius_low))
+    value = radius / max(radius_high, radius_low)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        radius = 2.0 / radius
+        pf = pf * radius - (radius - 1.0) + cell_hash[:3] * (radius - 2.0)
+        xsq = 1.0 - numpy.minimum((pf * pf).sum(axis=0), 1.0)
+    return xsq * xsq * xsq * value
+
+#Inigo Quilez's gradient noises, see shaders/quilez
+
+def quilez_hash(p):
+    coefs = numpy.array([[127.1, 311.7, 74.7],
+                         [269.5, 183.3, 246.1],
+                         [113.5, 271.9, 124.6]], dtype=p.dtype)
+    return -1.0 + 2.0 * fract(numpy.sin(coefs.dot(p)) * 43758.5453123)
+
+def quilez_gradient_noise(point, interpolation):
+    i = numpy.floor(point)
+    f = point - i
+    u = interpolation(f)
+    values = {}
+    for dx in (0.0, 1.0):
+        for dy in (0.0, 1.0):
+            for dz in (0.0, 1.0):
+                corner = numpy.array([dx, dy, dz], dtype=point.dtype)[:, numpy.newaxis]
+                values[(dx, dy, dz)] = (quilez_hash(i + corner) * (f - corner)).sum(axis=0)
+    x0 = mix(mix(values[(0.0, 0.0, 0.0)], values[(1.0, 0.0, 0.0)], u[0]),
+             mix(values[(0.0, 1.0, 0.0)], values[(1.0, 1.0, 0.0)], u[0]), u[1])
+    x1 = mix(mix(values[(0.0, 0.0, 1.0)], values[(1.0, 0.0, 1.0)], u[0]),
+             mix(values[(0.0, 1.0, 1.0)], values[(1.0, 1.0, 1.0)], u[0]), u[1])
+    return mix(x0, x1, u[2])
+
+#Evaluation of the noise tree
+
+def evaluate(noise, point):
+    """Return the value of the noise source at the given (3, N) array of points."""
+    evaluator = noise_evaluators.get(noise.__class__)
+    if evaluator is None:
+        raise NotImplementedError("Noise source %s is not supported by the NumPy evaluator" % noise.__class__.__name__)
+    return evaluator(noise, point)
+
+def eval_const(noise, point):
+    return numpy.full(point.shape[1], noise.value, dtype=point.dtype)
+
+def eval_coord(noise, point):
+    return point['xyz'.index(noise.coord)].copy()
+
+def eval_sincos(noise, point):
+    return numpy.sin(point[1]) + numpy.cos(point[0])
+
+def eval_ridged(noise, point):
+    value = 1.0 - abs(evaluate(noise.noise, point)) - noise.offset
+    if noise.shift:
+        value = value * 2.0 - 1.0
+    return value
+
+def eval_square(noise, point):
+    value = evaluate(noise.noise, point)
+    return value * value
+
+def eval_cube(noise, point):
+    value = evaluate(noise.noise, point)
+    return value * value * value
+
+def eval_add(noise, point):
+    value = evaluate(noise.noises[0], point)
+    for child in noise.noises[1:]:
+        value = value + evaluate(child, point)
+    return value
+
+def eval_mul(noise, point):
+    value = evaluate(noise.noises[0], point)
+    for child in noise.noises[1:]:
+        value = value * evaluate(child, point)
+    return value
+
+def eval_pow(noise, point):
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        return numpy.power(evaluate(noise.noise_a, point), evaluate(noise.noise_b, point))
+
+def eval_map(noise, point):
+    value = (evaluate(noise.noise, point) - noise.src_min_value) * noise.range_factor + noise.min_value
+    return numpy.clip(value, noise.min_value, noise.max_value)
+
+def eval_1d(noise, point):
+    point_1d = numpy.zeros_like(point)
+    axis = 'xyz'.index(noise.axis)
+    point_1d[axis] = point[axis]
+    return evaluate(noise.noise, point_1d)
+
+def eval_fbm(noise, point):
+    frequency = noise.frequency
+    if noise.geometric:
+        gain = noise.gain
+    else:
+        gain = pow(noise.lacunarity, -noise.h)
+    result = 0.0
+    amplitude = 1.0
+    max_value = 0.0
+    #The octaves are given as a float uniform to the shader
+    for i in range(int(ceil(noise.octaves))):
+        result = result + evaluate(noise.noise, point * frequency) * amplitude
+        max_value += amplitude
+        amplitude *= gain
+        frequency *= noise.lacunarity
+    return result / max_value
+
+def eval_spiral(noise, point):
+    normalizer = 1.0 / (1.0 + noise.nudge * noise.nudge) ** 0.5
+    frequency = noise.frequency
+    result = 0.0
+    amplitude = 1.0
+    max_value = 0.0
+    point = point.copy()
+    for i in range(int(ceil(noise.octaves))):
+        result = result + evaluate(noise.noise, point * frequency) * amplitude
+        max_value += amplitude
+        amplitude *= noise.gain
+        frequency *= noise.lacunarity
+        (point[0], point[1]) = ((point[0] + point[1] * noise.nudge) * normalizer, (point[1] - point[0] * noise.nudge) * normalizer)
+        (point[0], point[2]) = ((point[0] + point[2] * noise.nudge) * normalizer, (point[2] - point[0] * noise.nudge) * normalizer)
+    return result / max_value
+
+def eval_warp(noise, point):
+    warped_point = numpy.stack((evaluate(noise.noise_warp, point),
+                                evaluate(noise.noise_warp, point + numpy.array([1, 2, 3], dtype=point.dtype)[:, numpy.newaxis]),
+                                evaluate(noise.noise_warp, point + numpy.array([4, 3, 2], dtype=point.dtype)[:, numpy.newaxis])))
+    return evaluate(noise.noise_main, point + noise.scale * warped_point)
+
+def eval_rotate(noise, point):
+    theta = evaluate(noise.noise_angle, point)
+    cos_theta = numpy.cos(theta)
+    sin_theta = numpy.sin(theta)
+    (x, y, z) = point
+    #The mat3 constructor of GLSL is column-major
+    if noise.axis == 'x':
+        rotated = (x, cos_theta * y + sin_theta * z, -sin_theta * y + cos_theta * z)
+    elif noise.axis == 'y':
+        rotated = (cos_theta * x - sin_theta * z, y, sin_theta * x + cos_theta * z)
+    else:
+        rotated = (cos_theta * x + sin_theta * y, -sin_theta * x + cos_theta * y, z)
+    return evaluate(noise.noise_main, numpy.stack(rotated))
+
+def eval_stegu_cellular(noise, point):
+    if noise.fast:
+        return cellular2x2x2(point)[0]
+    else:
+        return cellular(point)[0]
+
+def eval_stegu_cellular_diff(noise, point):
+    if noise.fast:
+        f = cellular2x2x2(point)
+    else:
+        f = cellular(point)
+    return f[1] - f[0]
+
+noise_evaluators = {
+    NoiseConst: eval_const,
+    NoiseCoord: eval_coord,
+    SinCosNoise: eval_sincos,
+    AbsNoise: lambda noise, point: abs(evaluate(noise.noise, point)),
+    NegNoise: lambda noise, point: -evaluate(noise.noise, point),
+    RidgedNoise: eval_ridged,
+    SquareNoise: eval_square,
+    CubeNoise: eval_cube,
+    PositionMap: lambda noise, point: evaluate(noise.noise, point * noise.scale + noise.offset),
+    NoiseAdd: eval_add,
+    NoiseSub: lambda noise, point: evaluate(noise.noise_a, point) - evaluate(noise.noise_b, point),
+    NoiseMul: eval_mul,
+    NoisePow: eval_pow,
+    NoiseThreshold: lambda noise, point: numpy.maximum(evaluate(noise.noise_a, point) - evaluate(noise.noise_b, point), 0.0),
+    NoiseClamp: lambda noise, point: numpy.clip(evaluate(noise.noise, point), noise.min_value, noise.max_value),
+    NoiseMap: eval_map,
+    Noise1D: eval_1d,
+    FbmNoise: eval_fbm,
+    SpiralNoise: eval_spiral,
+    NoiseWarp: eval_warp,
+    NoiseRotate: eval_rotate,
+    GpuNoiseLibPerlin3D: lambda noise, point: gnl_perlin3d(point),
+    GpuNoiseLibCellular3D: lambda noise, point: numpy.sqrt(gnl_cellular3d(point)),
+    GpuNoiseLibPolkaDot3D: lambda noise, point: gnl_polkadot3d(point, noise.min_radius, noise.max_radius),
+    SteGuPerlin3D: lambda noise, point: snoise(point),
+    SteGuCellular3D: eval_stegu_cellular,
+    SteGuCellularDiff3D: eval_stegu_cellular_diff,
+    QuilezPerlin3D: lambda noise, point: quilez_gradient_noise(point, interpolation_c2),
+    QuilezGradientNoise3D: lambda noise, point: quilez_gradient_noise(point, interpolation_c1),
+}
+
+#Evaluation of a whole texture
+
+def texcoords(size):
+    """Return the texture coordinates of the centers of the pixels rendered by TexGenerator."""
+    margin = 1.0 / size / 2.0
+    return -margin + (numpy.arange(size) + 0.5) / size * (1.0 + 2.0 * margin)
+
+def noise_positions(coord, u, v, offset, scale, cube_rot):
+    """Port of NoiseFragmentShader.calc_noise_value(), return the (3, N) array of points to evaluate."""
+    if coord == TexCoord.Cylindrical:
+        nx = 2 * pi * (offset[0] + u * scale[0])
+        ny = pi * (offset[1] + (1.0 - v) * scale[1])
+        sny = numpy.sin(ny)
+        return numpy.stack((numpy.cos(nx) * sny, numpy.sin(nx) * sny, numpy.cos(ny)))
+    elif coord == TexCoord.NormalizedCube or coord == TexCoord.SqrtCube:
+        p = numpy.stack((2.0 * (offset[0] + u * scale[0]) - 1.0,
+                         2.0 * (offset[1] + (1.0 - v) * scale[1]) - 1.0,
+                         numpy.ones_like(u)))
+        p = cube_rot.dot(p)
+        if coord == TexCoord.NormalizedCube:
+            return p / numpy.sqrt((p * p).sum(axis=0))
+        p2 = p * p
+        return numpy.stack((p[0] * numpy.sqrt(1.0 - p2[1] * 0.5 - p2[2] * 0.5 + p2[1] * p2[2] / 3.0),
+                            p[1] * numpy.sqrt(1.0 - p2[2] * 0.5 - p2[0] * 0.5 + p2[2] * p2[0] / 3.0),
+                            p[2] * numpy.sqrt(1.0 - p2[0] * 0.5 - p2[1] * 0.5 + p2[0] * p2[1] / 3.0)))
+    else:
+        return numpy.stack((offset[0] + u * scale[0],
+                            offset[1] + (1.0 - v) * scale[1],
+                            numpy.full_like(u, offset[2])))
+
+def evaluate_rows(params):
+    (noise, coord, offset, scale, cube_rot, global_frequency, global_offset, global_scale, width, height, rows) = params
+    (u, v) = numpy.meshgrid(texcoords(width).astype(numpy.float32), texcoords(height)[rows].astype(numpy.float32))
+    position = noise_positions(coord, u.ravel(), v.ravel(), offset, scale, cube_rot)
+    position = position * global_frequency + global_offset[:, numpy.newaxis]
+    value = evaluate(noise, position) * global_scale
+    return value.reshape(len(rows), width)
+
+#Number of rows of the texture evaluated by each job of the process pool
+rows_per_job = 16
+pool = None
+
+def generate_noise(shader, face, width, height, pool=None):
+    """Return the texture that the noise shader would render for the given face as a 2D float32 array.
+    The rows are in the order of the RAM image of a texture, like decode_heightmap_texture().
+    If a process pool is given, the rows are split among its processes."""
+    cube_rot = None
+    if shader.coord == TexCoord.NormalizedCube or shader.coord == TexCoord.SqrtCube:
+        mat = shader.get_rot_for_face(face)
+        cube_rot = numpy.array([[mat[i][j] for j in range(3)] for i in range(3)], dtype=numpy.float32)
+    params = (shader.noise_source, shader.coord,
+              tuple(shader.offset), tuple(shader.scale), cube_rot,
+              shader.global_frequency, numpy.array(tuple(shader.global_offset), dtype=numpy.float32), shader.global_scale,
+              width, height)
+    if pool is None:
+        return evaluate_rows(params + (numpy.arange(height),))
+    chunks = numpy.array_split(numpy.arange(height), max(1, height // rows_per_job))
+    return numpy.vstack(pool.map(evaluate_rows, [params + (rows,) for rows in chunks]))
+
+def get_pool():
+    """Return the process pool used to generate the heightmaps, or None if it is disabled."""
+    global pool
+    if pool is None and settings.cpu_noise_processes > 0:
+        pool = multiprocessing.Pool(settings.cpu_noise_processes)
+    return pool
+
+def close_pool():
+    """Stop the processes of the pool, if any, and wait for them."""
+    global pool
+    if pool is not None:
+        pool.close()
+        pool.join()
+        pool = None
@@ -0,0 +1,45 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from ..lrucache import LRUCache
+from .. import settings
+
+class PatchCache(LRUCache):
+    """LRU cache of the heightmap patches shared by all the patched heightmaps.
+    The patches that are still in use (instanced, not yet generated or used as source
+    of a cloned patch) are never evicted."""
+    def update_size(self, owner, key):
+        entry = self.entries.get((owner, key))
+        if entry is not None:
+            self.set_size(owner, key, entry[0].get_memory_size())
+
+    def is_pinned(self, owner, key, heightmap_patch):
+        if not heightmap_patch.is_ready() or heightmap_patch.nb_dependents > 0:
+            return True
+        patch = heightmap_patch.patch
+        return patch is not None and (patch.instance is not None or len(patch.children) > 0)
+
+    def release(self, owner, key, heightmap_patch):
+        owner.evict_patch(key)
+
+patchCache = PatchCache('Heightmaps', settings.heightmap_cache_max_patches, settings.heightmap_cache_max_size * 1024 * 1024)
@@ -26,11 +26,11 @@ from panda3d.core import Texture, GeomEnums
 
 from ..shaders import OffsetScaleInstanceControl
 from .. import settings
+from .. import workers
 
 from random import random, uniform
-from array import array
-from itertools import chain
-import sys
+from math import ceil, tan, radians
+import numpy
 
 class TerrainObjectFactory(object):
     def __init__(self):
@@ -69,14 +69,7 @@ class TerrainPopulatorBase(object):
         nb_of_instances = self.calc_nb_of_instances(patch)
         if self.max_instances is not None:
             nb_of_instances = min(nb_of_instances, self.max_instances)
-        count = 0
-        offsets = []
-        while count < nb_of_instances:
-            offset = self.placer.place_new(self.terrain, count, patch)
-            if offset is not None:
-                offsets.append(offset)
-            count += 1
-        return offsets
+        return self.placer.place_batch(self.terrain, int(ceil(nb_of_instances)), patch)
 
     def create_object_template(self):
         if self.object_template.instance is None:
@@ -134,6 +127,28 @@ class PatchedTerrainPopulatorBase(TerrainPopulatorBase):
         data = self.generate_instances_info_for(terrain_patch)
         patch.set_data(data)
 
+    def request_data_for(self, patch, terrain_patch):
+        """Create the instances of the patch, on a worker thread if the placement is asynchronous.
+        The instances of a visible patch are created once its data is available."""
+        if not settings.async_placement or workers.asyncTextureLoader is None:
+            self.create_data_for(patch, terrain_patch)
+            return
+        if patch.pending: return
+        if settings.debug_lod_split_merge:
+            print("Populator request data", terrain_patch.str_id())
+        patch.pending = True
+        workers.asyncTextureLoader.add_job(self.generate_instances_info_for, [terrain_patch],
+                                           self.data_ready_cb, (patch, terrain_patch),
+                                           valid=lambda: self.patch_map.get(terrain_patch) is patch)
+
+    def data_ready_cb(self, data, patch, terrain_patch):
+        patch.pending = False
+        #The data could have been created synchronously meanwhile to split the patch
+        if patch.data is not None: return
+        patch.set_data(data)
+        if self.visible_patches.get(terrain_patch) is patch:
+            self.create_patch_instances(patch, terrain_patch)
+
     def create_root_patch(self, terrain_patch):
         if self.patch_valid(terrain_patch):
             self.create_patch_for(terrain_patch)
@@ -145,30 +160,16 @@ class PatchedTerrainPopulatorBase(TerrainPopulatorBase):
         patch = self.patch_map[terrain_patch]
         if patch.data is None:
             self.create_data_for(patch, terrain_patch)
-        bl = []
-        br = []
-        tr = []
-        tl = []
+        data = patch.data
         #TODO: Terrain scale should be retrieved properly...
         size = self.terrain.size
-        for data in patch.data:
-            (x, y, height, scale) = data
-            (u, v) = terrain_patch.coord_to_uv((x / size, y / size))
-            if u < 0.5:
-                if v < 0.5:
-                    bl.append(data)
-                else:
-                    tl.append(data)
-            else:
-                if v < 0.5:
-                    br.append(data)
-                else:
-                    tr.append(data)
-        #print(len(bl), len(br), len(tr), len(tl))
-        self.patch_map[terrain_patch.children[0]] = TerrainPopulatorPatch(bl)
-        self.patch_map[terrain_patch.children[1]] = TerrainPopulatorPatch(br)
-        self.patch_map[terrain_patch.children[2]] = TerrainPopulatorPatch(tr)
-        self.patch_map[terrain_patch.children[3]] = TerrainPopulatorPatch(tl)
+        (u, v) = terrain_patch.coord_to_uv((data[:, 0] / size, data[:, 1] / size))
+        left = u < 0.5
+        bottom = v < 0.5
+        self.patch_map[terrain_patch.children[0]] = TerrainPopulatorPatch(data[left & bottom])
+        self.patch_map[terrain_patch.children[1]] = TerrainPopulatorPatch(data[~left & bottom])
+        self.patch_map[terrain_patch.children[2]] = TerrainPopulatorPatch(data[~left & ~bottom])
+        self.patch_map[terrain_patch.children[3]] = TerrainPopulatorPatch(data[left & ~bottom])
 
     def merge_patch(self, terrain_patch):
         if not terrain_patch in self.patch_map: return
@@ -191,10 +192,11 @@ class PatchedTerrainPopulatorBase(TerrainPopulatorBase):
         self.create_patch_for(terrain_patch)
         if terrain_patch in self.patch_map:
             patch = self.patch_map[terrain_patch]
-            if patch.data is None:
-                self.create_data_for(patch, terrain_patch)
             self.visible_patches[terrain_patch] = patch
-            self.create_patch_instances(patch, terrain_patch)
+            if patch.data is None:
+                self.request_data_for(patch, terrain_patch)
+            if patch.data is not None:
+                self.create_patch_instances(patch, terrain_patch)
 
     def remove_patch_instances(self, patch, terrain_patch):
         pass
@@ -232,12 +234,133 @@ class CpuTerrainPopulator(PatchedTerrainPopulatorBase):
             instance.remove_node()
         patch.instances = []
 
+class InstancesTable(object):
+    """Offsets and scales of the instances of the visible patches.
+    Each patch owns a contiguous range of slots in the table, adding or removing a patch
+    only rewrites its own range. The freed ranges are filled with null instances
+    and reused by the next patches."""
+    initial_capacity = 1024
+
+    def __init__(self, max_instances):
+        self.max_instances = max_instances
+        self.ranges = {}
+        self.free_ranges = []
+        self.nb_instances = 0
+        if settings.instancing_use_tex:
+            self.capacity = self.initial_capacity
+        else:
+            self.capacity = max_instances
+        self.data = numpy.zeros((self.capacity, 4), dtype=numpy.float32)
+        self.dirty_ranges = []
+        self.offsets = None
+        self.reallocated = True
+        self.changed = True
+
+    def reserve(self, size):
+        if size <= self.capacity: return
+        capacity = self.capacity
+        while capacity < size:
+            capacity *= 2
+        data = numpy.zeros((capacity, 4), dtype=numpy.float32)
+        data[:self.nb_instances] = self.data[:self.nb_instances]
+        self.data = data
+        self.capacity = capacity
+        self.reallocated = True
+
+    def allocate(self, count):
+        for (i, (start, size)) in enumerate(self.free_ranges):
+            if size >= count:
+                if size == count:
+                    del self.free_ranges[i]
+                else:
+                    self.free_ranges[i] = (start + count, size - count)
+                return start
+        start = self.nb_instances
+        if not settings.instancing_use_tex and start + count > self.capacity:
+            print("Too many instances, %d dropped" % (start + count - self.capacity))
+            count = self.capacity - start
+        self.reserve(start + count)
+        self.nb_instances = start + count
+        return start
+
+    def release(self, start, count):
+        free_ranges = self.free_ranges
+        free_ranges.append((start, count))
+        free_ranges.sort()
+        merged = [free_ranges[0]]
+        for (start, size) in free_ranges[1:]:
+            (last_start, last_size) = merged[-1]
+            if last_start + last_size == start:
+                merged[-1] = (last_start, last_size + size)
+            else:
+                merged.append((start, size))
+        #The last range is removed from the table instead of being kept as a hole
+        (last_start, last_size) = merged[-1]
+        if last_start + last_size == self.nb_instances:
+            self.nb_instances = last_start
+            del merged[-1]
+        self.free_ranges = merged
+
+    def add(self, patch, data):
+        if patch in self.ranges:
+            self.remove(patch)
+        count = len(data)
+        if count == 0: return
+        start = self.allocate(count)
+        count = min(count, self.capacity - start)
+        self.changed = True
+        if count <= 0: return
+        self.data[start:start + count] = numpy.array(data[:count], dtype=numpy.float32).reshape(-1, 4)
+        self.ranges[patch] = (start, count)
+        self.dirty_ranges.append((start, count))
+
+    def remove(self, patch):
+        if patch not in self.ranges: return
+        (start, count) = self.ranges.pop(patch)
+        self.changed = True
+        self.data[start:start + count] = 0.0
+        if start + count < self.nb_instances:
+            self.dirty_ranges.append((start, count))
+        self.release(start, count)
+
+    def is_dirty(self):
+        return self.changed
+
+    def update_offsets(self):
+        """Copy the modified ranges into the offsets texture or array.
+        Return True if the offsets object has been replaced."""
+        reallocated = self.reallocated
+        if settings.instancing_use_tex:
+            if reallocated:
+                texture = Texture()
+                texture.setup_buffer_texture(self.capacity, Texture.T_float, Texture.F_rgba32, GeomEnums.UH_dynamic)
+                texture.set_ram_image(self.data.tobytes())
+                self.offsets = texture
+            else:
+                image = memoryview(self.offsets.modify_ram_image())
+                for (start, count) in self.dirty_ranges:
+                    image[start * 16:(start + count) * 16] = self.data[start:start + count].tobytes()
+        else:
+            if reallocated:
+                self.offsets = PTAVecBase4f.emptyArray(self.capacity)
+                dirty_ranges = [(0, self.capacity)]
+            else:
+                dirty_ranges = self.dirty_ranges
+            offsets = self.offsets
+            for (start, count) in dirty_ranges:
+                for i in range(start, start + count):
+                    offsets[i] = Vec4F(*self.data[i])
+        self.dirty_ranges = []
+        self.reallocated = False
+        self.changed = False
+        return reallocated
+
 class GpuTerrainPopulator(PatchedTerrainPopulatorBase):
     def __init__(self, object_template, count, max_instances, placer, min_lod=0):
         PatchedTerrainPopulatorBase.__init__(self, object_template, count, placer, min_lod)
         self.max_instances = max_instances
         self.object_template.shader.set_instance_control(OffsetScaleInstanceControl(self.max_instances))
-        self.rebuild = False
+        self.table = InstancesTable(self.max_instances)
 
     def create_object_template_instance_cb(self, terrain_object):
         bounds = OmniBoundingVolume()
@@ -245,49 +368,32 @@ class GpuTerrainPopulator(PatchedTerrainPopulatorBase):
         terrain_object.instance.node().setFinal(1)
 
     def create_patch_instances(self, patch, terrain_patch):
-        self.rebuild = True
+        self.table.add(patch, patch.data)
 
     def remove_patch_instances(self, patch, terrain_patch):
-        self.rebuild = True
+        self.table.remove(patch)
 
-    def generate_table(self):
-        data = []
-        for patch in self.visible_patches.values():
-            data += patch.data
-        offsets_nb = len(data)
+    def update_table(self):
+        table = self.table
         if settings.debug_lod_split_merge:
-            print("Populator regenerate", offsets_nb)
-        if settings.instancing_use_tex:
-            offsets = data
-        else:
-            offsets = PTAVecBase4f.emptyArray(offsets_nb)
-            for offset in data:
-                    offsets[offsets_nb] = offset
-        if settings.instancing_use_tex:
-            texture = Texture()
-            texture.setup_buffer_texture(len(offsets), Texture.T_float, Texture.F_rgba32, GeomEnums.UH_static)
-            flattened_data = list(chain.from_iterable(offsets))
-            data = array("f", flattened_data)
-            if sys.version_info[0] < 3:
-                texture.setRamImage(data.tostring())
-            else:
-                texture.setRamImage(data.tobytes())
-            self.object_template.appearance.offsets = texture
-        else:
-            self.object_template.appearance.offsets = offsets
-        self.object_template.instance.set_instance_count(offsets_nb)
-        self.object_template.shader.apply(self.object_template.shape, self.object_template.appearance)
-        self.rebuild = False
+            print("Populator update", table.nb_instances, len(table.dirty_ranges))
+        if table.update_offsets():
+            #The shader does not change, only the input needs to be replaced
+            self.object_template.appearance.offsets = table.offsets
+            self.object_template.instance.set_shader_input('instances_offset', table.offsets)
+        self.object_template.instance.set_instance_count(table.nb_instances)
 
     def update_instance(self, camera_pos, orientation):
         if self.object_template.instance is not None and self.object_template.instance_ready:
-            if self.rebuild:
-                self.generate_table()
+            if self.table.is_dirty():
+                self.update_table()
             self.object_template.update_instance(camera_pos, orientation)
 
 class TerrainPopulatorPatch(object):
     def __init__(self, data=None):
         self.data = data
+        self.instances = []
+        self.pending = False
 
     def set_data(self, data):
         self.data = data
@@ -296,10 +402,26 @@ class ObjectPlacer(object):
     def __init__(self):
         pass
 
-    def place_new(self, count):
+    def place_new(self, terrain, count, patch=None):
         return None
 
+    def place_batch(self, terrain, count, patch=None):
+        """Place up to count new objects and return their offsets and scales as an (N, 4) array."""
+        offsets = []
+        for i in range(count):
+            offset = self.place_new(terrain, i, patch)
+            if offset is not None:
+                offsets.append(offset)
+        return numpy.array(offsets, dtype=numpy.float32).reshape(-1, 4)
+
 class RandomObjectPlacer(ObjectPlacer):
+    #Offset, in patch coordinates, used to estimate the slope of the terrain
+    slope_delta = 0.01
+
+    def __init__(self, max_slope=None):
+        ObjectPlacer.__init__(self)
+        self.max_slope = max_slope
+
     def place_new(self, terrain, count, patch=None):
         if patch is not None:
             u = random()
@@ -318,3 +440,33 @@ class RandomObjectPlacer(ObjectPlacer):
             return (x, y, height, scale)
         else:
             return None
+
+    def get_slopes(self, terrain, patch, u, v, heights):
+        delta = self.slope_delta
+        du = numpy.where(u + delta > 1.0, -delta, delta)
+        dv = numpy.where(v + delta > 1.0, -delta, delta)
+        heights_u = terrain.get_heights_patch(patch, u + du, v)
+        heights_v = terrain.get_heights_patch(patch, u, v + dv)
+        length = delta * patch.size * terrain.size
+        return numpy.sqrt((heights_u - heights) ** 2 + (heights_v - heights) ** 2) / length
+
+    def place_batch(self, terrain, count, patch=None):
+        rng = numpy.random.default_rng()
+        if patch is not None:
+            u = rng.random(count)
+            v = rng.random(count)
+            heights = terrain.get_heights_patch(patch, u, v)
+            x, y = patch.get_xy_for(u, v)
+            x = x * terrain.size
+            y = y * terrain.size
+        else:
+            x = rng.uniform(-terrain.size, terrain.size, count)
+            y = rng.uniform(-terrain.size, terrain.size, count)
+            heights = numpy.array([terrain.get_height((x_i, y_i)) for (x_i, y_i) in zip(x, y)])
+        #TODO: Should not have such explicit dependency
+        selected = heights > terrain.water.level
+        if self.max_slope is not None and patch is not None:
+            selected &= self.get_slopes(terrain, patch, u, v, heights) <= tan(radians(self.max_slope))
+        scales = rng.uniform(0.1, 0.5, count)
+        offsets = numpy.column_stack((x, y, heights, scales))[selected]
+        return offsets.astype(numpy.float32)
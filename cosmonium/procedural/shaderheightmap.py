@@ -24,14 +24,39 @@ from panda3d.core import Texture, LColor, LVector2
 
 from .heightmap import Heightmap, HeightmapPatch, HeightmapPatchFactory
 from .generator import TexGenerator, GeneratorPool
-from .shadernoise import NoiseShader, FloatTarget
+from .shadernoise import NoiseShader, FloatTarget, noisePrograms
+from .npnoise import generate_noise, get_pool
+from .tilecache import tileCache
 from ..textures import TexCoord
+from .. import workers
 from .. import settings
 
 import traceback
 import numpy
 import sys
 
+def decode_heightmap_texture(texture):
+    """Return the heights stored in the RAM image of the texture as a 2D float array.
+    The rows are in the order of the RAM image, from the bottom to the top of the texture."""
+    data = texture.getRamImage()
+    if sys.version_info[0] < 3:
+        data = data.getData()
+    if texture.getComponentType() == Texture.T_float:
+        np_buffer = numpy.frombuffer(data, numpy.float32)
+        np_buffer = np_buffer.reshape(texture.getYSize(), texture.getXSize(), texture.getNumComponents())
+        return np_buffer[:, :, 0]
+    else:
+        #The float is encoded in the four channels, the RAM image is in BGRA order
+        np_buffer = numpy.frombuffer(data, numpy.uint8).astype(numpy.float32) / 255.0
+        np_buffer = np_buffer.reshape(texture.getYSize(), texture.getXSize(), texture.getNumComponents())
+        return np_buffer[:, :, 2] + np_buffer[:, :, 1] / 255.0 + np_buffer[:, :, 0] / 65025.0 + np_buffer[:, :, 3] / 16581375.0
+
+def uv_to_texel(heightmap, u, v):
+    """Return the texel coordinates used by get_height_uv for the given arrays of u, v coordinates."""
+    x = numpy.trunc(numpy.asarray(u, dtype=numpy.float64) * (heightmap.width - 1))
+    y = numpy.trunc(numpy.asarray(v, dtype=numpy.float64) * (heightmap.height - 1))
+    return (x, y)
+
 class ShaderHeightmap(Heightmap):
     tex_generators = {}
 
@@ -46,9 +71,11 @@ class ShaderHeightmap(Heightmap):
         self.texture_offset = LVector2()
         self.texture_scale = LVector2(1, 1)
         self.tex_id = str(width) + ':' + str(height)
+        self.heightmap_data = None
 
     def reset(self):
         self.texture = None
+        self.heightmap_data = None
 
     def set_noise(self, noise):
         self.noise = noise
@@ -76,7 +103,22 @@ class ShaderHeightmap(Heightmap):
     def get_texture_scale(self, patch):
         return self.texture_scale
 
+    def get_texel_heights(self, x, y):
+        """Vectorized version of get_height, x and y are arrays of texel coordinates.
+        Return None if the heights can not be read from the decoded texture."""
+        if self.heightmap_data is None: return None
+        new_x = x * self.texture_scale[0] + self.texture_offset[0] * self.width
+        new_y = ((self.height - 1) - y) * self.texture_scale[1] + self.texture_offset[1] * self.height
+        new_x = numpy.minimum(new_x, self.width - 1)
+        new_y = numpy.minimum(new_y, self.height - 1)
+        heights = self.interpolator.get_values(self.heightmap_data, new_x, new_y)
+        if heights is None: return None
+        return heights * self.height_scale
+
     def get_height(self, x, y):
+        heights = self.get_texel_heights(numpy.array([x], dtype=numpy.float64), numpy.array([y], dtype=numpy.float64))
+        if heights is not None:
+            return float(heights[0])
         if self.texture_peeker is None:
             print("No peeker")
             traceback.print_stack()
@@ -88,10 +130,18 @@ class ShaderHeightmap(Heightmap):
         height = self.interpolator.get_value(self.texture_peeker, new_x, new_y)
         return height * self.height_scale# + self.offset
 
+    def get_heights(self, u, v):
+        (x, y) = uv_to_texel(self, u, v)
+        heights = self.get_texel_heights(x, y)
+        if heights is None:
+            return Heightmap.get_heights(self, u, v)
+        return heights
+
     def heightmap_ready_cb(self, texture, callback, cb_args):
         self.heightmap_ready = True
         #print("READY")
         self.texture_peeker = self.texture.peek()
+        self.heightmap_data = decode_heightmap_texture(self.texture)
 #         if self.texture_peeker is None:
 #             print("NOT READY !!!")
         if callback is not None:
@@ -134,6 +184,8 @@ class ShaderHeightmapPatchFactory(HeightmapPatchFactory):
         self.noise = noise
 
     def create_patch(self, *args, **kwargs):
+        if settings.cpu_noise:
+            return CpuHeightmapPatch.create_from_patch(self.noise, *args, **kwargs)
         return ShaderHeightmapPatch.create_from_patch(self.noise, *args, **kwargs)
 
 class ShaderHeightmapPatch(HeightmapPatch):
@@ -160,18 +212,48 @@ class ShaderHeightmapPatch(HeightmapPatch):
         self.min_height = None
         self.max_height = None
         self.mean_height = None
+        self.heightmap_data = None
 
     def copy_from(self, heightmap_patch):
         self.cloned = True
         self.lod = heightmap_patch.lod
         self.texture = heightmap_patch.texture
         self.texture_peeker = heightmap_patch.texture_peeker
+        self.heightmap_data = heightmap_patch.heightmap_data
         self.heightmap_ready = heightmap_patch.heightmap_ready
         self.min_height = heightmap_patch.min_height
         self.max_height = heightmap_patch.max_height
         self.mean_height = heightmap_patch.mean_height
 
+    def get_memory_size(self):
+        if self.cloned or self.texture is None:
+            return 0
+        return self.texture.get_ram_image_size()
+
+    def release(self):
+        self.texture = None
+        self.texture_peeker = None
+        self.heightmap_data = None
+        self.shader = None
+        self.heightmap_ready = False
+
+    def get_texel_heights(self, x, y):
+        """Vectorized version of get_height, x and y are arrays of texel coordinates.
+        Return None if the heights can not be read from the decoded texture."""
+        if self.heightmap_data is None: return None
+        new_x = x * self.texture_scale[0] + self.texture_offset[0] * self.width
+        new_y = ((self.height - 1) - y) * self.texture_scale[1] + self.texture_offset[1] * self.height
+        new_x = numpy.minimum(new_x, self.width - 1)
+        new_y = numpy.minimum(new_y, self.height - 1)
+        heights = self.parent.interpolator.get_values(self.heightmap_data, new_x, new_y)
+        if heights is None: return None
+        #TODO: This should be done in PatchedHeightmap.get_height()
+        return heights * self.parent.height_scale
+
     def get_height(self, x, y):
+        heights = self.get_texel_heights(numpy.array([x], dtype=numpy.float64), numpy.array([y], dtype=numpy.float64))
+        if heights is not None:
+            return float(heights[0])
         if self.texture_peeker is None:
             print("No peeker", self.patch.str_id(), self.patch.instance_ready)
             traceback.print_stack()
@@ -184,36 +266,83 @@ class ShaderHeightmapPatch(HeightmapPatch):
         #TODO: This should be done in PatchedHeightmap.get_height()
         return height * self.parent.height_scale# + self.parent.offset
 
+    def get_heights(self, u, v):
+        (x, y) = uv_to_texel(self, u, v)
+        heights = self.get_texel_heights(x, y)
+        if heights is None:
+            return HeightmapPatch.get_heights(self, u, v)
+        return heights
+
+    def get_average_heights(self, u, v):
+        x = numpy.asarray(u, dtype=numpy.float64) * (self.width - 1)
+        y = numpy.asarray(v, dtype=numpy.float64) * (self.height - 1)
+        x0 = numpy.floor(x)
+        y0 = numpy.floor(y)
+        x1 = numpy.ceil(x)
+        y1 = numpy.ceil(y)
+        dx = x - x0
+        dy = y - y0
+        #The four corners are sampled in a single query
+        heights = self.get_texel_heights(numpy.concatenate((x0, x0, x1, x1)), numpy.concatenate((y0, y1, y0, y1)))
+        if heights is None:
+            return numpy.array([HeightmapPatch.get_average_height_uv(self, u_i, v_i) for (u_i, v_i) in zip(u, v)], dtype=numpy.float64)
+        (h_00, h_01, h_10, h_11) = heights.reshape(4, -1)
+        return h_00 + (h_10 - h_00) * dx + (h_01 - h_00) * dy + (h_00 + h_11 - h_01 - h_10) * dx * dy
+
+    def get_average_height_uv(self, u, v):
+        return float(self.get_average_heights(numpy.array([u], dtype=numpy.float64), numpy.array([v], dtype=numpy.float64))[0])
+
     def generate(self, callback, cb_args=()):
         if self.texture is None:
             self.texture = Texture()
             self.texture.set_wrap_u(Texture.WMClamp)
             self.texture.set_wrap_v(Texture.WMClamp)
             self.parent.interpolator.configure_texture(self.texture)
-            self._make_heightmap(callback, cb_args)
+            if self.shader is None:
+                self.create_shader()
+            if self.load_tile():
+                if callback is not None:
+                    callback(self, *cb_args)
+            else:
+                self._make_heightmap(callback, cb_args)
         else:
             if callback is not None:
                 callback(self, *cb_args)
 
+    def load_tile(self):
+        values = tileCache.load('heightmap', self.shader, self, self.width, self.height, self.texture)
+        if values is None:
+            return False
+        (self.min_height, self.max_height, self.mean_height) = values
+        self.texture_peeker = self.texture.peek()
+        self.heightmap_data = decode_heightmap_texture(self.texture)
+        self.heightmap_ready = True
+        return True
+
+    def store_tile(self):
+        tileCache.store('heightmap', self.shader, self, self.width, self.height, self.texture, self.min_height, self.max_height, self.mean_height)
+
     def heightmap_ready_cb(self, texture, callback, cb_args):
         #print("READY", self.patch.str_id())
         self.texture_peeker = self.texture.peek()
 #         if self.texture_peeker is None:
 #             print("NOT READY !!!")
         self.heightmap_ready = True
-        data = self.texture.getRamImage()
-        if sys.version_info[0] < 3:
-            buf = data.getData()
-            np_buffer = numpy.fromstring(buf, dtype=numpy.float32)
-        else:
-            np_buffer = numpy.frombuffer(data, numpy.float32)
-        np_buffer.shape = (self.texture.getYSize(), self.texture.getXSize(), self.texture.getNumComponents())
-        self.min_height = np_buffer.min()
-        self.max_height = np_buffer.max()
-        self.mean_height = np_buffer.mean()
+        self.heightmap_data = decode_heightmap_texture(self.texture)
+        self.min_height = self.heightmap_data.min()
+        self.max_height = self.heightmap_data.max()
+        self.mean_height = self.heightmap_data.mean()
+        self.store_tile()
         if callback is not None:
             callback(self, *cb_args)
 
+    def create_shader(self):
+        self.shader = noisePrograms.create_instance(self.noise, FloatTarget(), self.coord,
+                                                    offset=(self.x0, self.y0, 0.0),
+                                                    scale=(self.lod_scale_x, self.lod_scale_y, 1.0),
+                                                    global_frequency=self.parent.global_frequency,
+                                                    global_scale=self.parent.global_scale)
+
     def _make_heightmap(self, callback, cb_args):
         if not self.width in ShaderHeightmapPatch.tex_generators:
             ShaderHeightmapPatch.tex_generators[self.width] = GeneratorPool(settings.patch_pool_size)
@@ -224,12 +353,37 @@ class ShaderHeightmapPatch(HeightmapPatch):
             ShaderHeightmapPatch.tex_generators[self.width].make_buffer(self.width, self.height, texture_format)
         tex_generator = ShaderHeightmapPatch.tex_generators[self.width]
         if self.shader is None:
-            self.shader = NoiseShader(coord=self.coord,
-                                      noise_source=self.noise,
-                                      noise_target=FloatTarget(),
-                                      offset=(self.x0, self.y0, 0.0),
-                                      scale=(self.lod_scale_x, self.lod_scale_y, 1.0))
-            self.shader.global_frequency = self.parent.global_frequency
-            self.shader.global_scale = self.parent.global_scale
-            self.shader.create_and_register_shader(None, None)
+            self.create_shader()
+        self.shader.create_and_register_shader(None, None)
         tex_generator.generate(self.shader, self.face, self.texture, self.heightmap_ready_cb, (callback, cb_args))
+
+class CpuHeightmapPatch(ShaderHeightmapPatch):
+    """Heightmap patch generated on the CPU by the NumPy port of the noise shader.
+    The heights are also stored in a float texture so the patch can replace a ShaderHeightmapPatch.
+    The noise is evaluated on a worker thread, like the GPU generation the patch is ready in a callback."""
+    def get_memory_size(self):
+        if self.cloned or self.heightmap_data is None:
+            return 0
+        return self.heightmap_data.nbytes
+
+    def _make_heightmap(self, callback, cb_args):
+        if self.shader is None:
+            self.create_shader()
+        fargs = (self.shader, self.face, self.width, self.height, get_pool())
+        if workers.asyncTextureLoader is None:
+            self.heightmap_data_cb(generate_noise(*fargs), callback, cb_args)
+        else:
+            workers.asyncTextureLoader.add_job(generate_noise, fargs, self.heightmap_data_cb, (callback, cb_args))
+
+    def heightmap_data_cb(self, data, callback, cb_args):
+        self.texture.setup_2d_texture(self.width, self.height, Texture.T_float, Texture.F_r32)
+        self.texture.set_ram_image(data.tobytes())
+        self.texture_peeker = self.texture.peek()
+        self.heightmap_ready = True
+        self.heightmap_data = data
+        self.min_height = data.min()
+        self.max_height = data.max()
+        self.mean_height = data.mean()
+        self.store_tile()
+        if callback is not None:
+            callback(self, *cb_args)
@@ -27,6 +27,8 @@ from ..textures import TexCoord
 from ..parameters import ParametersGroup, AutoUserParameter
 from .. import settings
 
+from weakref import WeakValueDictionary
+
 class NoiseSource(object):
     last_id = 0
     def __init__(self, name, prefix):
@@ -1048,6 +1050,10 @@ class NoiseShader(StructuredShader):
             name += '-' + target
         return name
 
+    def has_stable_id(self):
+        #The uniforms of the noise sources are named after their creation order
+        return False
+
     def get_rot_for_face(self, face):
         if face == 0:
             return LMatrix3(0.0, 0.0, 1.0,
@@ -1078,12 +1084,25 @@ class NoiseShader(StructuredShader):
                             0.0, 1.0, 0.0,
                             0.0, 0.0, 1.0)
 
+    def create_and_register_shader(self, shape, appearance, force=False):
+        #The shader is shared by the instances of the program and is not kept in the global cache,
+        #it is released with the program when the noise graph is no longer used
+        if self.shader is None:
+            self.define_shader(shape, appearance)
+            self.shader = self.create_shader()
+        if self.shader is not None and shape is not None:
+            shape.instance.setShader(self.shader)
+
     def update(self, instance, face):
-        instance.set_shader_input('noiseOffset', self.offset)
-        instance.set_shader_input('noiseScale', self.scale)
-        instance.set_shader_input('global_frequency', self.global_frequency)
-        instance.set_shader_input('global_offset', self.global_offset)
-        instance.set_shader_input('global_scale', self.global_scale)
+        self.update_inputs(instance, face, self)
+
+    def update_inputs(self, instance, face, params):
+        """Set the inputs of the shader, the offset, scale and global parameters are taken from params."""
+        instance.set_shader_input('noiseOffset', params.offset)
+        instance.set_shader_input('noiseScale', params.scale)
+        instance.set_shader_input('global_frequency', params.global_frequency)
+        instance.set_shader_input('global_offset', params.global_offset)
+        instance.set_shader_input('global_scale', params.global_scale)
         #instance.set_shader_input('permTexture', self.texture)
         if self.coord == TexCoord.NormalizedCube or self.coord == TexCoord.SqrtCube:
             mat = self.get_rot_for_face(face)
@@ -1091,6 +1110,58 @@ class NoiseShader(StructuredShader):
             instance.set_shader_input('cube_rot', LMatrix4(mat))
         self.noise_source.update(instance)
 
+class NoiseShaderInstance(object):
+    """Parameters of a patch generated with a shared NoiseShader.
+    It can be used in place of a NoiseShader by the generators, only the inputs differ between the instances."""
+    def __init__(self, program, offset, scale, global_frequency=1.0, global_scale=1.0):
+        self.program = program
+        self.coord = program.coord
+        self.noise_source = program.noise_source
+        self.noise_target = program.noise_target
+        self.offset = offset
+        self.scale = scale
+        self.global_frequency = global_frequency
+        self.global_offset = LVector3(0, 0, 0)
+        self.global_scale = global_scale
+
+    @property
+    def shader(self):
+        return self.program.shader
+
+    def get_shader_id(self):
+        return self.program.get_cached_shader_id()
+
+    def get_rot_for_face(self, face):
+        return self.program.get_rot_for_face(face)
+
+    def create_and_register_shader(self, shape, appearance):
+        self.program.create_and_register_shader(shape, appearance)
+
+    def update(self, instance, face):
+        self.program.update_inputs(instance, face, self)
+
+class NoiseProgramRegistry(object):
+    """Keep one NoiseShader per noise graph, target and coordinate system.
+    The shader is only created when a generator needs it, the CPU generation does not use it.
+    The programs are only referenced by their instances, a program and its noise graph are
+    released once all the patches using it are removed."""
+    def __init__(self):
+        self.programs = WeakValueDictionary()
+
+    def get_program(self, noise_source, noise_target, coord):
+        key = (noise_source, noise_target.get_id(), coord)
+        program = self.programs.get(key)
+        if program is None:
+            program = NoiseShader(coord=coord, noise_source=noise_source, noise_target=noise_target)
+            self.programs[key] = program
+        return program
+
+    def create_instance(self, noise_source, noise_target, coord, offset, scale, global_frequency=1.0, global_scale=1.0):
+        program = self.get_program(noise_source, noise_target, coord)
+        return NoiseShaderInstance(program, offset, scale, global_frequency, global_scale)
+
+noisePrograms = NoiseProgramRegistry()
+
 class NoiseTarget(ShaderComponent):
     pass
 
@@ -440,6 +440,9 @@ vec4 textureGood( sampler2D sam, vec2 uv )
         patch.instance.set_shader_input("heightmap_%s_v_scale" % self.name, self.heightmap.get_v_scale(patch))
 
 class TextureDictionaryDataSource(DataSource):
+    #The id is made from the address of the data source
+    stable_id = False
+
     def __init__(self, dictionary, shader=None):
         DataSource.__init__(self, shader)
         self.dictionary = dictionary
@@ -24,7 +24,8 @@ from panda3d.core import Texture
 
 from ..textures import TextureSource
 from .generator import GeneratorPool
-from .shadernoise import NoiseShader
+from .shadernoise import noisePrograms
+from .tilecache import tileCache, texture_statistics
 from .. import settings
 
 class ProceduralTextureSource(TextureSource):
@@ -112,8 +113,11 @@ class ProceduralVirtualTextureSource(TextureSource):
         else:
             callback(*(self.map_patch[patch] + cb_args))
 
-    def texture_ready_cb(self, texture, patch, callback, cb_args):
+    def texture_ready_cb(self, texture, patch, shader, callback, cb_args):
         #print("READY", patch.str_id())
+        if shader is not None:
+            (min_value, max_value, mean_value) = texture_statistics(texture)
+            tileCache.store('texture', shader, patch, self.texture_size, self.texture_size, texture, min_value, max_value, mean_value)
         self.map_patch[patch] = (texture, self.texture_size, patch.lod)
         if callback is not None:
             callback(*(self.map_patch[patch] + cb_args))
@@ -123,15 +127,11 @@ class ProceduralVirtualTextureSource(TextureSource):
             ProceduralVirtualTextureSource.tex_generators[self.texture_size] = GeneratorPool(settings.patch_pool_size)
             ProceduralVirtualTextureSource.tex_generators[self.texture_size].make_buffer(self.texture_size, self.texture_size, Texture.F_rgba)
         self.tex_generator = ProceduralVirtualTextureSource.tex_generators[self.texture_size]
-        if True:#self.shader is None:
-            shader = NoiseShader(coord = patch.coord,
-                                 noise_source=self.noise,
-                                 noise_target=self.target,
-                                 offset=(patch.x0, patch.y0, 0.0),
-                                 scale=(patch.lod_scale_x, patch.lod_scale_y, 1.0))
-            shader.global_frequency = self.global_frequency
-            shader.global_scale = self.global_scale
-            shader.create_and_register_shader(None, None)
+        shader = noisePrograms.create_instance(self.noise, self.target, patch.coord,
+                                               offset=(patch.x0, patch.y0, 0.0),
+                                               scale=(patch.lod_scale_x, patch.lod_scale_y, 1.0),
+                                               global_frequency=self.global_frequency,
+                                               global_scale=self.global_scale)
         self.texture = Texture()
         self.texture.set_wrap_u(Texture.WMClamp)
         self.texture.set_wrap_v(Texture.WMClamp)
@@ -141,7 +141,11 @@ class ProceduralVirtualTextureSource(TextureSource):
             self.texture.setMinfilter(Texture.FT_linear)
         self.texture.setMagfilter(Texture.FT_linear)
 
-        self.tex_generator.generate(shader, patch.face, self.texture, self.texture_ready_cb, (patch, callback, cb_args))
+        if tileCache.load('texture', shader, patch, self.texture_size, self.texture_size, self.texture) is not None:
+            self.texture_ready_cb(self.texture, patch, None, callback, cb_args)
+            return
+        shader.create_and_register_shader(None, None)
+        self.tex_generator.generate(shader, patch.face, self.texture, self.texture_ready_cb, (patch, shader, callback, cb_args))
 
     def get_texture(self, patch):
         if patch in self.map_patch:
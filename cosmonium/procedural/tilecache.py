@@ -0,0 +1,280 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from panda3d.core import Texture
+
+from ..cache import create_path_for
+from .. import settings
+
+import hashlib
+import numpy
+import json
+import sys
+import os
+
+def texture_statistics(texture):
+    """Return the min, max and mean value of the components of the RAM image of the texture."""
+    data = texture.getRamImage()
+    if sys.version_info[0] < 3:
+        data = data.getData()
+    if texture.getComponentType() == Texture.T_float:
+        values = numpy.frombuffer(data, numpy.float32)
+    else:
+        values = numpy.frombuffer(data, numpy.uint8).astype(numpy.float32) / 255.0
+    return (values.min(), values.max(), values.mean())
+
+class UniformsRecorder(object):
+    """Stand-in for a NodePath that records the shader inputs set by NoiseShader.update()."""
+    def __init__(self):
+        self.inputs = []
+
+    def set_shader_input(self, name, value):
+        self.inputs.append((name, value))
+
+class TileContainer(object):
+    """Append-only container of the tiles generated with the same noise shader.
+    The RAM images of the tiles are stored back to back in a data file that is memory-mapped for reading,
+    the index file holds for each tile its key, its offset in the data file and its min, max and mean value.
+    The modification time of the header is updated each time the container is opened and is used to find
+    the least recently used containers."""
+    index_dtype = numpy.dtype([('face', '<i4'), ('lod', '<i4'),
+                               ('x0', '<f8'), ('y0', '<f8'), ('scale_x', '<f8'), ('scale_y', '<f8'),
+                               ('offset', '<i8'),
+                               ('min', '<f4'), ('max', '<f4'), ('mean', '<f4')])
+
+    extensions = ('.json', '.idx', '.dat')
+
+    def __init__(self, base_path, description):
+        self.base_path = base_path
+        self.header_file = base_path + '.json'
+        self.index_file = base_path + '.idx'
+        self.data_file = base_path + '.dat'
+        self.description = description
+        self.header = None
+        self.tiles = {}
+        self.data = None
+        self.load_header()
+        if self.header is not None:
+            self.load_index()
+
+    def load_header(self):
+        if not os.path.exists(self.header_file): return
+        try:
+            with open(self.header_file) as f:
+                header = json.load(f)
+        except (IOError, ValueError) as e:
+            print("Could not read tile container header", self.header_file, ':', e)
+            return
+        if header.get('description') != self.description:
+            print("Tile container", self.header_file, "does not match the noise shader")
+            return
+        self.header = header
+        try:
+            os.utime(self.header_file, None)
+        except OSError:
+            pass
+
+    @classmethod
+    def remove_files(cls, base_path):
+        for ext in cls.extensions:
+            try:
+                os.remove(base_path + ext)
+            except OSError:
+                pass
+
+    def load_index(self):
+        try:
+            data_size = os.path.getsize(self.data_file)
+            with open(self.index_file, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return
+        #Ignore a truncated record left by an interrupted write
+        nb_records = len(data) // self.index_dtype.itemsize
+        records = numpy.frombuffer(data[:nb_records * self.index_dtype.itemsize], self.index_dtype)
+        tile_size = self.header['tile_size']
+        for record in records:
+            if record['offset'] + tile_size > data_size: continue
+            key = (int(record['face']), int(record['lod']), float(record['x0']), float(record['y0']), float(record['scale_x']), float(record['scale_y']))
+            self.tiles[key] = (int(record['offset']), float(record['min']), float(record['max']), float(record['mean']))
+
+    def create_header(self, texture):
+        self.header = {'description': self.description,
+                       'x_size': texture.getXSize(),
+                       'y_size': texture.getYSize(),
+                       'component_type': int(texture.getComponentType()),
+                       'format': int(texture.getFormat()),
+                       'tile_size': texture.getRamImageSize()}
+        self.tiles = {}
+        self.data = None
+        try:
+            with open(self.header_file, 'w') as f:
+                json.dump(self.header, f, indent=2, sort_keys=True)
+            #The existing tiles, if any, were stored with another header
+            for filename in (self.index_file, self.data_file):
+                if os.path.exists(filename):
+                    os.remove(filename)
+        except (IOError, OSError) as e:
+            print("Could not write tile container header", self.header_file, ':', e)
+            self.header = None
+
+    def get_data(self, end):
+        if self.data is None or len(self.data) < end:
+            self.data = numpy.memmap(self.data_file, dtype=numpy.uint8, mode='r')
+        return self.data
+
+    def load(self, key, texture):
+        """Copy the stored tile into the RAM image of the texture and return its (min, max, mean) value,
+        or None if the tile is not in the container."""
+        entry = self.tiles.get(key)
+        if entry is None: return None
+        (offset, min_value, max_value, mean_value) = entry
+        header = self.header
+        end = offset + header['tile_size']
+        try:
+            data = self.get_data(end)
+        except (IOError, OSError, ValueError) as e:
+            print("Could not map tile container", self.data_file, ':', e)
+            return None
+        texture.setup_2d_texture(header['x_size'], header['y_size'], header['component_type'], header['format'])
+        texture.setRamImage(data[offset:end])
+        return (min_value, max_value, mean_value)
+
+    def store(self, key, texture, min_value, max_value, mean_value):
+        """Append the tile to the container and return the number of bytes written."""
+        if key in self.tiles: return 0
+        if self.header is None or self.header['tile_size'] != texture.getRamImageSize() or \
+                self.header['format'] != int(texture.getFormat()) or self.header['component_type'] != int(texture.getComponentType()):
+            self.create_header(texture)
+            if self.header is None: return 0
+        data = texture.getRamImage()
+        if sys.version_info[0] < 3:
+            data = data.getData()
+        record = numpy.zeros(1, self.index_dtype)
+        (record['face'], record['lod'], record['x0'], record['y0'], record['scale_x'], record['scale_y']) = key
+        (record['min'], record['max'], record['mean']) = (min_value, max_value, mean_value)
+        try:
+            with open(self.data_file, 'ab') as f:
+                offset = f.tell()
+                f.write(data)
+            record['offset'] = offset
+            #The record is written last so an interrupted write only leaves unreferenced data
+            with open(self.index_file, 'ab') as f:
+                f.write(record.tobytes())
+        except (IOError, OSError) as e:
+            print("Could not write tile container", self.data_file, ':', e)
+            return 0
+        self.tiles[key] = (offset, min_value, max_value, mean_value)
+        return len(data) + self.index_dtype.itemsize
+
+class TileCache(object):
+    """Persistent cache of the procedural tiles, stored in the cache directory.
+    There is one container per noise shader, identified by the hash of its shader id, the values of its
+    parameters and the tile size, and the tiles are then keyed by their face, lod and position.
+    As the shader id holds the numbering of the noise sources, a different numbering only leads to a new container.
+    The size of the cache is bounded, the least recently opened containers are removed first."""
+    version = 1
+    #These inputs depend on the tile and not on the noise
+    tile_inputs = ('noiseOffset', 'noiseScale', 'cube_rot')
+
+    def __init__(self):
+        self.containers = {}
+        self.size = None
+        self.cleanup_limit = None
+
+    def scan(self):
+        """Return the (last use, size, base path) of the containers in the cache directory, oldest first."""
+        root = create_path_for('tiles')
+        containers = {}
+        for category in os.listdir(root):
+            path = os.path.join(root, category)
+            if not os.path.isdir(path): continue
+            for filename in os.listdir(path):
+                (base, ext) = os.path.splitext(filename)
+                if ext not in TileContainer.extensions: continue
+                try:
+                    stat = os.stat(os.path.join(path, filename))
+                except OSError:
+                    continue
+                base_path = os.path.join(path, base)
+                (last_use, size) = containers.get(base_path, (0, 0))
+                if ext == '.json':
+                    last_use = stat.st_mtime
+                containers[base_path] = (last_use, size + stat.st_size)
+        return sorted((last_use, size, base_path) for (base_path, (last_use, size)) in containers.items())
+
+    def cleanup(self):
+        """Remove the least recently used containers until the cache fits in its budget,
+        the containers opened in this session are kept."""
+        max_size = settings.procedural_tiles_cache_max_size * 1024 * 1024
+        try:
+            containers = self.scan()
+        except OSError as e:
+            print("Could not scan tile cache:", e)
+            containers = []
+        self.size = sum(size for (last_use, size, base_path) in containers)
+        opened = set(container.base_path for container in self.containers.values())
+        removed = 0
+        for (last_use, size, base_path) in containers:
+            if self.size <= max_size: break
+            if base_path in opened: continue
+            TileContainer.remove_files(base_path)
+            self.size -= size
+            removed += 1
+        if removed > 0:
+            print("Removed %d tile containers from the cache" % removed)
+        #Avoid scanning the cache again at each tile when the opened containers are over the budget
+        self.cleanup_limit = max(max_size, self.size + max_size // 16)
+
+    def get_description(self, shader, width, height):
+        recorder = UniformsRecorder()
+        shader.update(recorder, 0)
+        inputs = [repr(value) for (name, value) in recorder.inputs if name not in self.tile_inputs]
+        return "%s:%d:%s:%d:%d:%s" % (settings.version, self.version, shader.get_shader_id(), width, height, ','.join(inputs))
+
+    def get_container(self, category, shader, width, height):
+        description = self.get_description(shader, width, height)
+        container = self.containers.get(description)
+        if container is None:
+            md5 = hashlib.md5(description.encode()).hexdigest()
+            container = TileContainer(os.path.join(create_path_for('tiles', category), md5), description)
+            self.containers[description] = container
+            if self.size is None:
+                self.cleanup()
+        return container
+
+    def make_key(self, patch):
+        return (patch.face, patch.lod, float(patch.x0), float(patch.y0), float(patch.lod_scale_x), float(patch.lod_scale_y))
+
+    def load(self, category, shader, patch, width, height, texture):
+        if not settings.cache_procedural_tiles: return None
+        return self.get_container(category, shader, width, height).load(self.make_key(patch), texture)
+
+    def store(self, category, shader, patch, width, height, texture, min_value, max_value, mean_value):
+        if not settings.cache_procedural_tiles: return
+        size = self.get_container(category, shader, width, height).store(self.make_key(patch), texture, min_value, max_value, mean_value)
+        self.size += size
+        if self.size > self.cleanup_limit:
+            self.cleanup()
+
+tileCache = TileCache()
@@ -0,0 +1,134 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from .bodies import StellarObject
+from .cache import create_path_for
+from . import workers
+from . import pstats
+from . import settings
+
+from time import strftime
+import atexit
+import numpy
+import json
+import csv
+import os
+
+class FrameProfiler(object):
+    """Record for each frame the wall time of the passes of Cosmonium.time_task, the number of processed
+    bodies, the visited octree cells and leaves and the depth of the loader queues in a ring buffer.
+    Unlike PStats, the data is kept in-process and can be exported to CSV or JSON."""
+    passes = ['time_task', 'update_octree', 'update_universe', 'update_obs', 'update_visibility', 'update_instances']
+    counters = ['nb_update', 'nb_obs', 'nb_visibility', 'nb_instance']
+    #The frame and pass times are in ms
+    columns = ['frame', 'time', 'frame_ms'] + passes + counters + ['nb_cells', 'nb_leaves', 'loader_queue', 'callback_queue']
+
+    def __init__(self, universe, size):
+        self.universe = universe
+        self.size = size
+        self.data = numpy.zeros((size, len(self.columns)), dtype=numpy.float64)
+        self.index = 0
+        self.nb_frames = 0
+        self.task = None
+        self.exit_registered = False
+
+    def start(self):
+        pstats.frame_timings.clear()
+        pstats.record_timings = True
+        #Must run after the time task
+        self.task = taskMgr.add(self.frame_task, 'profiler-frame', sort=1)
+        if settings.profiler_export_at_exit and not self.exit_registered:
+            atexit.register(self.export_at_exit)
+            self.exit_registered = True
+
+    def stop(self):
+        pstats.record_timings = False
+        if self.task is not None:
+            taskMgr.remove(self.task)
+            self.task = None
+
+    def is_running(self):
+        return self.task is not None
+
+    def frame_task(self, task):
+        self.record(self.collect())
+        return task.cont
+
+    def collect(self):
+        row = [globalClock.getFrameCount(), globalClock.getFrameTime(), globalClock.getDt() * 1000.0]
+        row += [pstats.frame_timings.get(name, 0.0) * 1000.0 for name in self.passes]
+        row += [getattr(StellarObject, name) for name in self.counters]
+        row += [self.universe.nb_cells, self.universe.nb_leaves_in_cells]
+        loader = workers.asyncTextureLoader
+        if loader is not None:
+            row += [loader.get_queue_size(), loader.cb_queue.qsize()]
+        else:
+            row += [0, 0]
+        return row
+
+    def record(self, row):
+        self.data[self.index] = row
+        self.index = (self.index + 1) % self.size
+        self.nb_frames += 1
+
+    def get_frames(self, count=None):
+        """Return the last recorded frames, from the oldest to the newest, as an array with one column per entry of columns."""
+        available = min(self.nb_frames, self.size)
+        if count is None or count > available:
+            count = available
+        indexes = numpy.arange(self.index - count, self.index) % self.size
+        return self.data[indexes]
+
+    def get_summary(self, count):
+        """Return the mean and max of each column over the last count frames."""
+        frames = self.get_frames(count)
+        if len(frames) == 0:
+            return None
+        means = frames.mean(axis=0)
+        maxs = frames.max(axis=0)
+        return dict((name, (means[i], maxs[i])) for (i, name) in enumerate(self.columns))
+
+    def export(self, filename):
+        frames = self.get_frames()
+        print("Writing %d profiler frames to" % len(frames), filename)
+        try:
+            if os.path.splitext(filename)[1].lower() == '.json':
+                with open(filename, 'w') as f:
+                    json.dump({'version': settings.version,
+                               'columns': self.columns,
+                               'frames': frames.tolist()}, f)
+            else:
+                with open(filename, 'w') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(self.columns)
+                    writer.writerows(frames.tolist())
+        except IOError as e:
+            print("Could not write profiler data", filename, ':', e)
+
+    def export_default(self):
+        filename = "profile-%s.%s" % (strftime("%Y%m%d-%H%M%S"), settings.profiler_export_format)
+        self.export(os.path.join(create_path_for('profiles'), filename))
+
+    def export_at_exit(self):
+        if self.nb_frames > 0:
+            self.export_default()
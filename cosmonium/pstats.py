@@ -20,17 +20,33 @@
 from panda3d.core import PStatCollector
 from functools import wraps
 
+try:
+    from time import perf_counter as clock
+except ImportError:
+    from time import time as clock
+
 custom_collectors = {}
 
+#When enabled, the wall time spent in each decorated function is accumulated in frame_timings.
+#The timings are cleared at the start of each frame by Cosmonium.time_task.
+record_timings = False
+frame_timings = {}
+
 def pstat(func):
     collectorName = "%s:%s" % ('Engine', func.__name__)
     if not collectorName in custom_collectors.keys():
         custom_collectors[collectorName] = PStatCollector(collectorName)
     pstat = custom_collectors[collectorName]
+    name = func.__name__
     @wraps(func)
     def doPstat(*args, **kargs):
         pstat.start()
-        returned = func(*args, **kargs)
+        if record_timings:
+            start = clock()
+            returned = func(*args, **kargs)
+            frame_timings[name] = frame_timings.get(name, 0.0) + clock() - start
+        else:
+            returned = func(*args, **kargs)
         pstat.stop()
         return returned
     return doPstat
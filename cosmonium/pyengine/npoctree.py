@@ -0,0 +1,294 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from panda3d.core import LPoint3d
+
+from ..astro.astro import abs_to_app_mag
+from ..astro import units
+
+from math import sqrt
+import numpy
+
+#Octree implementation where the leaves of each cell are stored in contiguous
+#arrays, the visibility tests are done for a whole cell at once.
+#The leaves added with add_array() are only created by their source when they
+#are reached by a traverser.
+
+def OctreeLeaf(ref_object, *args):
+    return ref_object
+
+class OctreeNode(object):
+    max_level = 200
+    max_leaves = 75
+    initial_capacity = 8
+    nb_cells = 0
+    nb_leaves = 0
+    child_threshold = 0.5 # + 1.5 #Correspond roughly to 1/4 less luminosity
+    def __init__(self, level, center, width, threshold, index = -1):
+        self.level = level
+        self.width = width
+        self.radius = self.width / 2.0 * sqrt(3)
+        self.center = center
+        self.threshold = threshold
+        self.index = index
+        self.has_children = False
+        self.children = [None, None, None, None, None, None, None, None]
+        self.count = 0
+        #Either the leaf object, or the source of the leaf when its ref is not negative
+        self.leaves = numpy.empty(self.initial_capacity, dtype=object)
+        self.refs = numpy.empty(self.initial_capacity, dtype=numpy.int64)
+        self.positions = numpy.empty((self.initial_capacity, 3), dtype=numpy.float64)
+        self.magnitudes = numpy.empty(self.initial_capacity, dtype=numpy.float64)
+        self.extends = numpy.empty(self.initial_capacity, dtype=numpy.float64)
+        self.max_magnitude = 99.0
+        OctreeNode.nb_cells += 1
+
+    def get_num_children(self):
+        nb_children = 0
+        for child in self.children:
+            if child is not None:
+                nb_children += 1
+        return nb_children
+
+    def get_num_leaves(self):
+        return self.count
+
+    def traverse(self, traverser):
+        traverser.traverse(self)
+        for child in self.children:
+            if child is not None and traverser.enter(child):
+                child.traverse(traverser)
+
+    def add(self, leaf):
+        position = leaf.get_global_position()
+        objs = numpy.empty(1, dtype=object)
+        objs[0] = leaf
+        self._add_array(objs, numpy.full(1, -1, dtype=numpy.int64),
+                        numpy.array([[position[0], position[1], position[2]]], dtype=numpy.float64),
+                        numpy.array([leaf.get_abs_magnitude()], dtype=numpy.float64),
+                        numpy.array([leaf.get_extend()], dtype=numpy.float64))
+
+    def add_array(self, source, positions, magnitudes, extends):
+        """Add the leaves 0 to n-1 of the source, the leaf objects are created using source.get_leaf(index)
+        when they are first reached."""
+        count = len(magnitudes)
+        if count == 0: return
+        objs = numpy.empty(count, dtype=object)
+        objs.fill(source)
+        self._add_array(objs, numpy.arange(count, dtype=numpy.int64),
+                        numpy.asarray(positions, dtype=numpy.float64),
+                        numpy.asarray(magnitudes, dtype=numpy.float64),
+                        numpy.asarray(extends, dtype=numpy.float64))
+
+    def get_child(self, index):
+        return self.children[index]
+
+    def get_leaf(self, index):
+        leaf = self.leaves[index]
+        ref = self.refs[index]
+        if ref >= 0:
+            leaf = leaf.get_leaf(ref)
+            self.leaves[index] = leaf
+            self.refs[index] = -1
+        return leaf
+
+    def get_leaves(self):
+        return [self.get_leaf(index) for index in range(self.count)]
+
+    def _reserve(self, size):
+        capacity = len(self.magnitudes)
+        if size <= capacity: return
+        while capacity < size:
+            capacity *= 2
+        count = self.count
+        leaves = numpy.empty(capacity, dtype=object)
+        leaves[:count] = self.leaves[:count]
+        self.leaves = leaves
+        refs = numpy.empty(capacity, dtype=numpy.int64)
+        refs[:count] = self.refs[:count]
+        self.refs = refs
+        positions = numpy.empty((capacity, 3), dtype=numpy.float64)
+        positions[:count] = self.positions[:count]
+        self.positions = positions
+        magnitudes = numpy.empty(capacity, dtype=numpy.float64)
+        magnitudes[:count] = self.magnitudes[:count]
+        self.magnitudes = magnitudes
+        extends = numpy.empty(capacity, dtype=numpy.float64)
+        extends[:count] = self.extends[:count]
+        self.extends = extends
+
+    def _append_array(self, objs, refs, positions, magnitudes, extends):
+        start = self.count
+        end = start + len(objs)
+        self._reserve(end)
+        self.count = end
+        self.leaves[start:end] = objs
+        self.refs[start:end] = refs
+        self.positions[start:end] = positions
+        self.magnitudes[start:end] = magnitudes
+        self.extends[start:end] = extends
+
+    def _create_child(self, index):
+        child_offset = self.width / 4.0
+        child_center = LPoint3d(self.center)
+        if (index & 1) != 0:
+            child_center.x += child_offset
+        else:
+            child_center.x -= child_offset
+        if (index & 2) != 0:
+            child_center.y += child_offset
+        else:
+            child_center.y -= child_offset
+        if (index & 4) != 0:
+            child_center.z += child_offset
+        else:
+            child_center.z -= child_offset
+        child = OctreeNode(self.level + 1, child_center, self.width / 2.0, self.threshold + self.child_threshold, index)
+        self.children[index] = child
+        return child
+
+    def _add_in_children(self, objs, refs, positions, magnitudes, extends):
+        indexes = (positions[:, 0] >= self.center.x).astype(numpy.int8)
+        indexes |= (positions[:, 1] >= self.center.y).astype(numpy.int8) << 1
+        indexes |= (positions[:, 2] >= self.center.z).astype(numpy.int8) << 2
+        for index in numpy.unique(indexes):
+            selection = numpy.flatnonzero(indexes == index)
+            child = self.children[index]
+            if child is None:
+                child = self._create_child(index)
+            child._add_array(objs[selection], refs[selection], positions[selection], magnitudes[selection], extends[selection])
+
+    def _add_array(self, objs, refs, positions, magnitudes, extends):
+        self.nb_leaves += len(objs)
+        max_magnitude = magnitudes.min()
+        if max_magnitude < self.max_magnitude:
+            self.max_magnitude = max_magnitude
+        if not self.has_children:
+            self._append_array(objs, refs, positions, magnitudes, extends)
+            if self.level < self.max_level and self.count >= self.max_leaves:
+                self._split()
+        else:
+            bright = magnitudes < self.threshold
+            if bright.all():
+                self._append_array(objs, refs, positions, magnitudes, extends)
+            else:
+                selection = numpy.flatnonzero(bright)
+                if len(selection) > 0:
+                    self._append_array(objs[selection], refs[selection], positions[selection], magnitudes[selection], extends[selection])
+                selection = numpy.flatnonzero(~bright)
+                self._add_in_children(objs[selection], refs[selection], positions[selection], magnitudes[selection], extends[selection])
+
+    def _split(self):
+        count = self.count
+        leaves = self.leaves[:count].copy()
+        refs = self.refs[:count].copy()
+        positions = self.positions[:count].copy()
+        magnitudes = self.magnitudes[:count].copy()
+        extends = self.extends[:count].copy()
+        bright = magnitudes < self.threshold
+        faint = numpy.flatnonzero(~bright)
+        bright = numpy.flatnonzero(bright)
+        nb_bright = len(bright)
+        self.count = nb_bright
+        self.leaves[:nb_bright] = leaves[bright]
+        self.leaves[nb_bright:count] = None
+        self.refs[:nb_bright] = refs[bright]
+        self.positions[:nb_bright] = positions[bright]
+        self.magnitudes[:nb_bright] = magnitudes[bright]
+        self.extends[:nb_bright] = extends[bright]
+        self.has_children = True
+        if len(faint) > 0:
+            self._add_in_children(leaves[faint], refs[faint], positions[faint], magnitudes[faint], extends[faint])
+
+    def dump_octree_summary(self):
+        if self.count > 0:
+            print(' ' * self.level, self.level, self.index, self.width, self.threshold, self.count, self.center)
+        for i in range(8):
+            if self.children[i] is not None:
+                self.children[i].dump_octree_summary()
+
+    def dump_octree(self):
+        if self.count > 0:
+            print(' ' * self.level, self.level, self.index, self.width, self.threshold, self.center, self.has_children)
+            print(' ' * self.level, '->', self.max_magnitude, ":", ', '.join(map(lambda x: x.get_name(), self.get_leaves())))
+        for i in range(8):
+            if self.children[i] is not None:
+                self.children[i].dump_octree()
+
+    def print_stats(self):
+        print("Nb cells:", self.nb_cells)
+        print("Nb leaves:", self.nb_leaves)
+
+class VisibleObjectsTraverser(object):
+    def __init__(self, frustum, limit, update_id):
+        self.frustum = frustum
+        self.limit = limit
+        self.update_id = update_id
+        self.collected_leaves = []
+        self.nb_cells = 0
+        self.nb_leaves = 0
+        position = frustum.get_position()
+        self.position = numpy.array([position[0], position[1], position[2]], dtype=numpy.float64)
+        planes = [[plane[0], plane[1], plane[2], plane[3]] for plane in frustum.planes]
+        planes = numpy.array(planes, dtype=numpy.float64)
+        self.planes_normal = planes[:, :3].T.copy()
+        self.planes_offset = planes[:, 3].copy()
+
+    def get_num_leaves(self):
+        return len(self.collected_leaves)
+
+    def get_leaf(self, index):
+        return self.collected_leaves[index]
+
+    def get_leaves(self):
+        return self.collected_leaves
+
+    def get_objects(self):
+        return self.collected_leaves
+
+    def enter(self, octree):
+        distance = (octree.center - self.frustum.get_position()).length() - octree.radius
+        if distance <= 0.0:
+            return True
+        if abs_to_app_mag(octree.max_magnitude, distance) > self.limit:
+            return False
+        return self.frustum.is_sphere_in(octree.center, octree.radius)
+
+    def traverse(self, octree):
+        count = octree.count
+        self.nb_cells += 1
+        self.nb_leaves += count
+        if count == 0: return
+        positions = octree.positions[:count]
+        directions = positions - self.position
+        distances = numpy.sqrt(numpy.einsum('ij,ij->i', directions, directions))
+        with numpy.errstate(divide='ignore'):
+            app_magnitudes = octree.magnitudes[:count] + 5 * (numpy.log10(distances / units.KmPerParsec) - 1)
+        planes_distances = positions.dot(self.planes_normal) + self.planes_offset
+        in_frustum = (planes_distances <= octree.extends[:count, numpy.newaxis]).all(axis=1)
+        selected = (distances <= 0.0) | ((app_magnitudes < self.limit) & in_frustum)
+        update_id = self.update_id
+        collected_leaves = self.collected_leaves
+        for index in numpy.flatnonzero(selected):
+            leaf = octree.get_leaf(index)
+            collected_leaves.append(leaf)
+            leaf.update_id = update_id
@@ -146,6 +146,8 @@ class VisibleObjectsTraverser(object):
         self.limit = limit
         self.update_id = update_id
         self.collected_leaves = []
+        self.nb_cells = 0
+        self.nb_leaves = 0
 
     def get_num_leaves(self):
         return len(self.collected_leaves)
@@ -168,6 +170,8 @@ class VisibleObjectsTraverser(object):
         return self.frustum.is_sphere_in(octree.center, octree.radius)
 
     def traverse(self, octree, leaves):
+        self.nb_cells += 1
+        self.nb_leaves += len(leaves)
         frustum = self.frustum
         frustum_position = frustum.get_position()
         distance = (octree.center - frustum_position).length() - octree.radius
@@ -34,6 +34,10 @@ version = '0.1.2-dev'
 
 use_double = LPoint3 == LPoint3d
 cache_yaml = True
+cache_universe = True
+cache_galaxies = True
+#Maximum number of galaxy point clouds kept in memory
+galaxy_templates_max = 64
 prc_file = 'config.prc'
 
 #OpenGL user configuration
@@ -67,9 +71,25 @@ deferred=False
 deferred_split=False
 deferred_load=True
 patch_pool_size = 4
+loader_threads = 2
+#Generate the instances of the terrain populators on the loader threads
+async_placement = False
+#Maximum number of heightmap patches and memory (in MB) kept in the cache
+heightmap_cache_max_patches = 4096
+heightmap_cache_max_size = 512
+#Maximum number of virtual texture tiles and memory (in MB) kept in the cache
+texture_cache_max_tiles = 4096
+texture_cache_max_size = 1024
+batch_orbits = True
+vectorized_update = False
+batch_orbits_threshold = 16
 
 mouse_over = False
 use_color_picking = True
+#Find the object under the mouse with analytic tests instead of a scene graph traversal
+analytic_picking = True
+#Extra radius, in pixels, around the points when picking
+picking_tolerance = 2.0
 celestia_nav = True
 invert_wheel = False
 damped_nav = True
@@ -77,6 +97,8 @@ damped_nav = True
 global_ambient = 0.0
 corrected_global_ambient = global_ambient
 allow_shadows = True
+#Fraction of the radius of a body it can move before the shadow casters are searched again
+shadow_pair_tolerance = 0.01
 shadow_size = 1024
 max_vertex_size_patch = 64
 max_sprite_size = 800
@@ -131,6 +153,14 @@ min_altitude = 2 * units.m
 
 shader_noise=True
 c_noise=True
+#Generate the noise heightmap patches on the CPU with the NumPy port of the noise shaders, for use without GPU
+cpu_noise = False
+#Number of processes used to generate the CPU noise heightmaps, 0 to generate them in the main process
+cpu_noise_processes = 0
+#Store the generated procedural heightmap patches and textures in the cache directory
+cache_procedural_tiles = True
+#Maximum size (in MB) of the procedural tiles stored in the cache directory
+procedural_tiles_cache_max_size = 1024
 
 debug_vt = False
 debug_lod_show_bb = False
@@ -138,12 +168,26 @@ debug_lod_freeze = False
 debug_lod_split_merge = False
 debug_lod_frustum = False
 dump_shaders = True
+#Store the generated shader sources in the cache directory and reuse them in the next sessions
+cache_shaders = True
+#Create and prepare at startup the shaders used in the previous sessions
+preload_shaders = True
+#Maximum number of recently used shaders recorded for the preload, the sources of the older ones are removed
+preload_shaders_max = 256
 dump_panda_shaders = False
 debug_shadow_frustum = False
 debug_sync_load = False
 
 debug_jump = False
 
+#Record the timings and counters of each frame in the in-process profiler
+profiler = False
+#Number of frames kept by the profiler
+profiler_frames = 3600
+#Export the profiler data in the cache directory at exit, the format is either csv or json
+profiler_export_at_exit = False
+profiler_export_format = 'csv'
+
 use_vertex_shader = False
 
 min_mag_scale = 0.1
@@ -174,6 +218,14 @@ show_orbits = False
 orbit_fade = 20
 label_fade = 20
 orbit_thickness = 0.6
+#Number of points of a circular orbit line, eccentric orbits get more points up to orbit_max_points
+orbit_points = 360
+orbit_max_points = 1440
+#Maximum number of orbit lines and memory (in MB) kept in the cache
+orbit_cache_max_entries = 4096
+orbit_cache_max_size = 64
+#Store the static annotation geoms, like the grids, in the cache directory
+store_annotations = False
 
 grid_thickness = 0.5
 
@@ -193,6 +245,9 @@ help_color = LColor(1.0, 1.0, 1.0, 1.0)
 help_background = LColor(0.5, 0.5, 0.5, 0.7)
 display_fps = True
 display_ms = False
+display_cache_usage = False
+#Show the rolling summary of the frame profiler in the HUD
+display_profiler = False
 ui_font_size = 12
 panel_width = 800
 panel_height = 600
@@ -203,6 +258,7 @@ entry_background = LColor(0.9, 0.9, 0.9, 1)
 menu_text_size = 12
 
 query_delay = 0.333
+query_max_results = 100
 
 #These are the fake depth value used for sorting background bin objects
 skysphere_depth = 0
@@ -29,18 +29,30 @@ from . import settings
 
 from math import asin
 import hashlib
+import json
 import os
 import re
 
 class ShaderBase(object):
     shaders_cache = {}
+    shader_id = None
 
     def __init__(self):
         self.shader = None
+        self.shader_id = None
 
     def get_shader_id(self):
         return None
 
+    def get_cached_shader_id(self):
+        """Return the id of the shader, it is only computed again after invalidate_shader_id() is called."""
+        if self.shader_id is None:
+            self.shader_id = self.get_shader_id()
+        return self.shader_id
+
+    def invalidate_shader_id(self):
+        self.shader_id = None
+
     def define_shader(self, shape, appearance):
         pass
 
@@ -55,12 +67,10 @@ class ShaderBase(object):
     def create_and_register_shader(self, shape, appearance, force=False):
         if force or self.shader is None:
             self.define_shader(shape, appearance)
-            shader_id = self.get_shader_id()
-            self.shader = self.find_shader(shader_id)
+            self.shader = self.find_shader(self.get_cached_shader_id())
         if self.shader is None:
             self.shader = self.create_shader()
-            shader_id = self.get_shader_id()
-            self.shaders_cache[shader_id] = self.shader
+            self.shaders_cache[self.get_cached_shader_id()] = self.shader
         if self.shader is not None and shape is not None:
             shape.instance.setShader(self.shader)
 
@@ -146,7 +156,7 @@ class FileShader(ShaderBase):
         return self.vertex + '-' + self.tess_control + '-' + self.tess_evaluation + '-' + self.fragment
 
     def create_shader(self):
-        print("Loading shader", self.get_shader_id())
+        print("Loading shader", self.get_cached_shader_id())
         return Shader.load(Shader.SL_GLSL,
                            vertex=self.vertex,
                            tess_control=self.tess_control,
@@ -154,14 +164,182 @@ class FileShader(ShaderBase):
                            geometry=self.geometry,
                            fragment=self.fragment)
 
+class ShaderSourcesCache(object):
+    """Generated GLSL sources stored in the cache directory.
+    The sources are keyed by the hash of the shader id, of the settings used by the generators and of the
+    modification time and size of the generator modules, they are discarded when one of the included files has changed.
+    The keys of the most recently used shaders are also recorded so they can be prepared at the next startup."""
+    version = 1
+    source_settings = ('shader_version', 'core_profile', 'encode_float', 'use_double', 'corrected_global_ambient',
+                       'instancing_use_tex', 'color_picking', 'offset_body_center', 'deep_space_depth', 'max_sprite_size')
+    #Modules generating GLSL code, relative to the cosmonium package
+    generator_modules = ('shaders.py', 'shadows.py', 'oneil.py', 'pbr.py', 'galaxies.py',
+                         'celestia/shaders.py', 'celestia/atmosphere.py',
+                         'procedural/shaders.py', 'procedural/shadernoise.py', 'procedural/texturecontrol.py')
+
+    def __init__(self):
+        self.path = None
+        self.used = None
+        self.preloaded = {}
+        self.generators = None
+
+    def get_path(self):
+        if self.path is None:
+            self.path = create_path_for('shaders', 'sources')
+        return self.path
+
+    def get_generators(self):
+        if self.generators is None:
+            base = os.path.dirname(os.path.abspath(__file__))
+            self.generators = []
+            for module in self.generator_modules:
+                try:
+                    stat = os.stat(os.path.join(base, module))
+                    self.generators.append((module, stat.st_mtime, stat.st_size))
+                except OSError:
+                    self.generators.append((module, None, None))
+        return self.generators
+
+    def get_key(self, shader_id):
+        config = [settings.version, self.version, shader_id] + [getattr(settings, name, None) for name in self.source_settings]
+        config += self.get_generators()
+        return hashlib.md5(repr(config).encode()).hexdigest()
+
+    def describe_include(self, filename):
+        stat = os.stat(filename)
+        return (filename, stat.st_mtime, stat.st_size)
+
+    def check_include(self, include):
+        (filename, mtime, size) = include
+        try:
+            stat = os.stat(filename)
+        except OSError:
+            return False
+        return stat.st_mtime == mtime and stat.st_size == size
+
+    def load(self, key):
+        """Return the shader id and the sources of each stage stored under the key,
+        or None if they are missing or outdated."""
+        filename = os.path.join(self.get_path(), key + '.json')
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename) as f:
+                entry = json.load(f)
+        except (IOError, ValueError) as e:
+            print("Could not read shader sources", filename, ':', e)
+            return None
+        for include in entry['includes']:
+            if not self.check_include(include):
+                return None
+        return (entry['id'], entry['stages'])
+
+    def store(self, key, shader_id, stages, includes):
+        filename = os.path.join(self.get_path(), key + '.json')
+        try:
+            entry = {'id': shader_id,
+                     'stages': stages,
+                     'includes': [self.describe_include(include) for include in sorted(set(includes))]}
+            with open(filename, 'w') as f:
+                json.dump(entry, f)
+        except (IOError, OSError) as e:
+            print("Could not write shader sources", filename, ':', e)
+            return
+        self.record_used(key)
+
+    def get_used_filename(self):
+        return os.path.join(self.get_path(), 'used.txt')
+
+    def get_used(self):
+        if self.used is None:
+            self.used = []
+            try:
+                with open(self.get_used_filename()) as f:
+                    for line in f:
+                        key = line.strip()
+                        if key and key not in self.used:
+                            self.used.append(key)
+            except IOError:
+                pass
+        return self.used
+
+    def discard(self, key):
+        try:
+            os.remove(os.path.join(self.get_path(), key + '.json'))
+        except OSError:
+            pass
+
+    def save_used(self):
+        try:
+            with open(self.get_used_filename(), 'w') as f:
+                for key in self.get_used():
+                    f.write(key + '\n')
+        except IOError as e:
+            print("Could not record used shaders:", e)
+
+    def record_used(self, key):
+        """Move the key at the end of the used list, the least recently used keys are dropped."""
+        used = self.get_used()
+        if used and used[-1] == key: return
+        if key in used:
+            used.remove(key)
+        used.append(key)
+        if len(used) > settings.preload_shaders_max:
+            dropped = len(used) - settings.preload_shaders_max
+            for old_key in used[:dropped]:
+                self.discard(old_key)
+            del used[:dropped]
+        self.save_used()
+
+    def record_preloaded(self, shader_id):
+        """Record the use of a preloaded shader, only its first use in the session is recorded."""
+        key = self.preloaded.pop(shader_id, None)
+        if key is not None:
+            self.record_used(key)
+
+    def preload(self, win=None):
+        """Create the shaders recorded in the previous sessions that are still valid and,
+        if a window is given, prepare them so they are compiled before the first frame."""
+        count = 0
+        invalid = []
+        for key in self.get_used():
+            entry = self.load(key)
+            if entry is None:
+                invalid.append(key)
+                continue
+            (shader_id, stages) = entry
+            #The settings used to generate the sources may have changed
+            if self.get_key(shader_id) != key:
+                invalid.append(key)
+                continue
+            if shader_id in ShaderBase.shaders_cache: continue
+            shader = Shader.make(Shader.SL_GLSL, **stages)
+            ShaderBase.shaders_cache[shader_id] = shader
+            self.preloaded[shader_id] = key
+            if win is not None:
+                shader.prepare(win.get_gsg().get_prepared_objects())
+            count += 1
+        if invalid:
+            for key in invalid:
+                self.discard(key)
+            self.used = [key for key in self.used if key not in invalid]
+            self.save_used()
+        print("Preloaded %d shaders" % count)
+
+shaderSources = ShaderSourcesCache()
+
 class ShaderProgram(object):
+    included_files_cache = {}
+
     def __init__(self, shader_type):
         self.shader_type = shader_type
         self.version = settings.shader_version
         self.functions = {}
+        self.included_files = []
 
     def clear_functions(self):
         self.functions = {}
+        self.included_files = []
 
     def add_function(self, code, name, func):
         if not name in self.functions:
@@ -170,9 +348,14 @@ class ShaderProgram(object):
 
     def include(self, code, name, filename):
         if not name in self.functions:
-            data = open(filename)
-            code += data.readlines()
+            lines = self.included_files_cache.get(filename)
+            if lines is None:
+                with open(filename) as data:
+                    lines = data.readlines()
+                self.included_files_cache[filename] = lines
+            code += lines
             self.functions[name] = True
+            self.included_files.append(filename)
 
     def pi(self, code):
         code.append("const float pi  = 3.14159265358;")
@@ -300,8 +483,27 @@ class StructuredShader(ShaderBase):
         self.geometry_shader = None
         self.fragment_shader = None
 
+    def has_stable_id(self):
+        """Return True if the id of the shader, and so its sources, does not depend on the session."""
+        return True
+
+    def find_shader(self, shader_id):
+        shader = ShaderBase.find_shader(self, shader_id)
+        if shader is not None and settings.cache_shaders:
+            shaderSources.record_preloaded(shader_id)
+        return shader
+
     def create_shader(self):
-        shader_id = self.get_shader_id()
+        shader_id = self.get_cached_shader_id()
+        key = None
+        if settings.cache_shaders and self.has_stable_id():
+            key = shaderSources.get_key(shader_id)
+            entry = shaderSources.load(key)
+            if entry is not None:
+                print("Loading shader %s (%s)" % (shader_id, key))
+                shaderSources.record_used(key)
+                (_, stages) = entry
+                return Shader.make(Shader.SL_GLSL, **stages)
         if settings.dump_shaders:
             dump = hashlib.md5(shader_id.encode()).hexdigest()
             print("Creating shader %s (%s)" %(shader_id, dump))
@@ -309,32 +511,21 @@ class StructuredShader(ShaderBase):
             dump = None
             print("Creating shader", shader_id)
 
-        if self.vertex_shader:
-            vertex = self.vertex_shader.generate_shader(dump, shader_id)
-        else:
-            vertex = ''
-        if self.tessellation_control_shader:
-            tess_control = self.tessellation_control_shader.generate_shader(dump, shader_id)
-        else:
-            tess_control = ''
-        if self.tessellation_eval_shader:
-            tess_evaluation = self.tessellation_eval_shader.generate_shader(dump, shader_id)
-        else:
-            tess_evaluation = ''
-        if self.geometry_shader:
-            geometry = self.geometry_shader.generate_shader(dump, shader_id)
-        else:
-            geometry = ''
-        if self.fragment_shader:
-            fragment = self.fragment_shader.generate_shader(dump, shader_id)
-        else:
-            fragment = ''
-        return Shader.make(Shader.SL_GLSL,
-                           vertex=vertex,
-                           tess_control=tess_control,
-                           tess_evaluation=tess_evaluation,
-                           geometry=geometry,
-                           fragment=fragment)
+        stages = {}
+        includes = []
+        for (stage, program) in (('vertex', self.vertex_shader),
+                                 ('tess_control', self.tessellation_control_shader),
+                                 ('tess_evaluation', self.tessellation_eval_shader),
+                                 ('geometry', self.geometry_shader),
+                                 ('fragment', self.fragment_shader)):
+            if program:
+                stages[stage] = program.generate_shader(dump, shader_id)
+                includes += program.included_files
+            else:
+                stages[stage] = ''
+        if key is not None:
+            shaderSources.store(key, shader_id, stages, includes)
+        return Shader.make(Shader.SL_GLSL, **stages)
 
     def get_user_parameters(self):
         params = []
@@ -875,13 +1066,16 @@ class BasicShader(StructuredShader):
         self.fragment_uses_tangent = False
         self.use_model_texcoord = use_model_texcoord
         self.color_picking = settings.color_picking
+        self.configuration = None
 
     def set_instance_control(self, instance_control):
+        self.invalidate_shader_id()
         self.instance_control = instance_control
         #TODO: wrong if there is tessellation
         self.vertex_shader.instance_control = instance_control
 
     def set_scattering(self, scattering):
+        self.invalidate_shader_id()
         self.scattering = scattering
         self.scattering.shader = self
         if self.tessellation_eval_shader is None:
@@ -891,11 +1085,13 @@ class BasicShader(StructuredShader):
         self.fragment_shader.scattering = scattering
 
     def add_shadows(self, shadows):
+        self.invalidate_shader_id()
         self.shadows.append(shadows)
         shadows.shader = self
         #As the list is referenced by the vertex and fragment shader no need to apply to fragment too...
 
     def remove_shadows(self, shape, appearance, shadow):
+        self.invalidate_shader_id()
         if shadow in self.shadows:
             if shape.instance_ready:
                 shadow.clear(shape, appearance)
@@ -906,6 +1102,7 @@ class BasicShader(StructuredShader):
         #As the list is referenced by the vertex and fragment shader no need to apply to fragment too...
 
     def clear_shadows(self, shape, appearance):
+        self.invalidate_shader_id()
         while self.shadows:
             shadow = self.shadows.pop()
             if shape.instance_ready:
@@ -914,6 +1111,7 @@ class BasicShader(StructuredShader):
         #As the list is referenced by the vertex and fragment shader no need to apply to fragment too...
 
     def add_after_effect(self, after_effect):
+        self.invalidate_shader_id()
         self.after_effects.append(after_effect)
         #As the list is referenced by the fragment shader no need to apply to fragment too...
 
@@ -924,6 +1122,13 @@ class BasicShader(StructuredShader):
 
         self.appearance.create_shader_configuration(appearance)
 
+        #The id of the shader only changes when the id of one of its components changes, either through
+        #the configuration created from the appearance or through their attributes, e.g. scattering.inside
+        configuration = tuple(component.get_id() for component in self.get_components())
+        if configuration != self.configuration:
+            self.configuration = configuration
+            self.invalidate_shader_id()
+
 #         if self.has_bump_texture:
 #             self.fragment_uses_vertex = True
 #             self.use_normal = True
@@ -1056,6 +1261,17 @@ class BasicShader(StructuredShader):
             name += "-ncp"
         return name
 
+    def get_components(self):
+        components = [self.appearance, self.lighting_model, self.scattering, self.vertex_control,
+                      self.point_control, self.instance_control, self.tessellation_control]
+        return components + self.shadows + self.data_source.sources + self.after_effects
+
+    def has_stable_id(self):
+        for component in self.get_components():
+            if not getattr(component, 'stable_id', True):
+                return False
+        return True
+
     def define_shader(self, shape, appearance):
         self.create_shader_configuration(appearance)
         self.scattering.define_shader(shape, appearance)
@@ -1136,6 +1352,8 @@ class ShaderComponent(object):
     model_normal = False
     world_normal = False
     use_tangent = False
+    #The id of the component does not depend on the session, see ShaderSourcesCache
+    stable_id = True
 
     def __init__(self, shader=None):
         self.shader = shader
@@ -0,0 +1,132 @@
+#
+#This file is part of Cosmonium.
+#
+#Copyright (C) 2018-2019 Laurent Deru.
+#
+#Cosmonium is free software: you can redistribute it and/or modify
+#it under the terms of the GNU General Public License as published by
+#the Free Software Foundation, either version 3 of the License, or
+#(at your option) any later version.
+#
+#Cosmonium is distributed in the hope that it will be useful,
+#but WITHOUT ANY WARRANTY; without even the implied warranty of
+#MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#GNU General Public License for more details.
+#
+#You should have received a copy of the GNU General Public License
+#along with Cosmonium.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+from __future__ import print_function
+from __future__ import absolute_import
+
+from .dircontext import DirContext
+from .catalogs import objectsDB
+from .cache import create_path_for
+from . import settings
+
+from time import time
+import hashlib
+import pickle
+import sys
+import os
+
+class UniverseSnapshot(object):
+    """Snapshot of the fully built universe, stored in the cache directory.
+    The snapshot is invalidated when one of the data files used to build it is modified."""
+    snapshot_version = 5
+    recursion_limit = 10000
+
+    def __init__(self, universe_id):
+        key = "%s:%d:%r" % (settings.version, self.snapshot_version, universe_id)
+        md5 = hashlib.md5(key.encode()).hexdigest()
+        self.snapshot_file = os.path.join(create_path_for('universe'), md5 + ".dat")
+        self.sources = None
+
+    def start_recording(self):
+        self.sources = set()
+        DirContext.data_sources = self.sources
+
+    def stop_recording(self):
+        DirContext.data_sources = None
+
+    @classmethod
+    def hash_file(cls, filepath):
+        md5 = hashlib.md5()
+        with open(filepath, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                md5.update(chunk)
+        return md5.hexdigest()
+
+    @classmethod
+    def describe_source(cls, filepath):
+        stat = os.stat(filepath)
+        return (filepath, stat.st_mtime, stat.st_size, cls.hash_file(filepath))
+
+    @classmethod
+    def check_source(cls, source):
+        (filepath, mtime, size, md5) = source
+        try:
+            stat = os.stat(filepath)
+            if stat.st_size != size:
+                return False
+            if stat.st_mtime == mtime:
+                return True
+            return cls.hash_file(filepath) == md5
+        except (IOError, OSError):
+            return False
+
+    def load(self):
+        """Return the universe stored in the snapshot and restore the objects DB,
+        or return None if the snapshot is missing or outdated."""
+        if not os.path.exists(self.snapshot_file):
+            return None
+        start = time()
+        universe = None
+        old_limit = sys.getrecursionlimit()
+        try:
+            with open(self.snapshot_file, 'rb') as f:
+                header = pickle.load(f)
+                if header.get('version') != self.snapshot_version:
+                    print("Universe snapshot has wrong version")
+                    return None
+                for source in header.get('sources', []):
+                    if not self.check_source(source):
+                        print("Universe snapshot is outdated,", source[0], "has changed")
+                        return None
+                print("Loading universe snapshot", self.snapshot_file)
+                base.splash.set_text("Loading universe (cached)")
+                sys.setrecursionlimit(max(old_limit, self.recursion_limit))
+                (universe, objects_db) = pickle.load(f)
+                objectsDB.__dict__.update(objects_db)
+        except (IOError, EOFError, ValueError, TypeError, AttributeError, ImportError, pickle.UnpicklingError) as e:
+            print("Could not read universe snapshot", self.snapshot_file, ':', e)
+            universe = None
+        finally:
+            sys.setrecursionlimit(old_limit)
+        end = time()
+        print("Load time:", end - start)
+        return universe
+
+    def store(self, universe):
+        if self.sources is None:
+            print("No sources recorded, universe snapshot not stored")
+            return
+        start = time()
+        print("Storing universe snapshot into", self.snapshot_file)
+        header = {'version': self.snapshot_version,
+                  'sources': [self.describe_source(filepath) for filepath in sorted(self.sources)]}
+        old_limit = sys.getrecursionlimit()
+        try:
+            sys.setrecursionlimit(max(old_limit, self.recursion_limit))
+            #Pickle into memory first to not leave a partial snapshot on disk
+            data = pickle.dumps((universe, objectsDB.__dict__), pickle.HIGHEST_PROTOCOL)
+            with open(self.snapshot_file, "wb") as f:
+                pickle.dump(header, f, pickle.HIGHEST_PROTOCOL)
+                f.write(data)
+        except (IOError, TypeError, AttributeError, RuntimeError, pickle.PicklingError) as e:
+            print("Could not write universe snapshot", self.snapshot_file, ':', e)
+        finally:
+            sys.setrecursionlimit(old_limit)
+        end = time()
+        print("Store time:", end - start)
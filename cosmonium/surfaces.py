@@ -24,6 +24,8 @@ from .shapes import ShapeObject
 from panda3d.core import NodePath
 from cosmonium.shadows import SphereShadowCaster
 
+import numpy
+
 class SurfaceCategory(object):
     def __init__(self, name):
         self.name = name
@@ -79,6 +81,10 @@ class Surface(ShapeObject):
     def get_height_patch(self, patch, u, v):
         raise NotImplementedError
 
+    def get_heights_patch(self, patch, u, v):
+        """Return the heights at the given arrays of u, v coordinates of the patch."""
+        return numpy.array([self.get_height_patch(patch, u_i, v_i) for (u_i, v_i) in zip(u, v)], dtype=numpy.float64)
+
     def get_normals_at(self, x, y):
         coord = self.shape.global_to_shape_coord(x, y)
         return self.shape.get_normals_at(coord)
@@ -93,6 +99,9 @@ class FlatSurface(Surface):
     def get_height_patch(self, patch, u, v):
         return self.owner.get_apparent_radius()
 
+    def get_heights_patch(self, patch, u, v):
+        return numpy.full(len(u), self.owner.get_apparent_radius())
+
 class MeshSurface(Surface):
     def get_height_at(self, x, y):
         coord = self.shape.global_to_shape_coord(x, y)
@@ -226,3 +235,21 @@ class HeightmapSurface(ProceduralSurface):
             h = heightmap.get_height_uv(u, v)
         height = h * self.height_scale + self.heightmap_base
         return height
+
+    def get_heights_patch(self, patch, u, v):
+        if not self.displacement:
+            return numpy.full(len(u), self.radius)
+        heightmap = self.heightmap.get_heightmap(patch)
+        while heightmap is None and patch is not None:
+            patch = patch.parent
+            heightmap = self.heightmap.get_heightmap(patch)
+            u = u / 2.0
+            v = v / 2.0
+        if heightmap is None:
+            print("No heightmap")
+            return numpy.full(len(u), self.radius)
+        if self.average:
+            h = heightmap.get_average_heights(u, v)
+        else:
+            h = heightmap.get_heights(u, v)
+        return h * self.height_scale + self.heightmap_base
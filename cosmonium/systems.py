@@ -20,9 +20,115 @@
 from __future__ import print_function
 from __future__ import absolute_import
 
+from panda3d.core import LVector3d
+
 from .bodies import StellarObject, Star
 from .catalogs import ObjectsDB, objectsDB
 from .astro.astro import lum_to_abs_mag, abs_mag_to_lum
+from . import settings
+
+import numpy
+
+class ShadowPairScheduler(object):
+    """Find the pairs primary-child of a system where one body casts a shadow on the other.
+    The bodies are sorted along the direction of the star and the pairs are pruned using the
+    extent of the umbra and penumbra of the caster. The result is kept until a body, or the
+    direction of the star, moves by more than a fraction of the radius of the bodies."""
+    nb_tested = 0
+    nb_accepted = 0
+
+    def __init__(self):
+        self.primary = None
+        self.children = None
+        self.positions = None
+        self.radii = None
+        self.star_vector = None
+        self.primary_targets = []
+        self.primary_casters = []
+
+    def has_moved(self, primary, children):
+        """Check the positions of the bodies against the cached ones, without rebuilding the arrays."""
+        if primary is not self.primary or self.children is None or len(children) != len(self.children): return True
+        primary_position = primary.get_local_position()
+        #Shift of the shadows due to the change of direction of the star
+        star_shift = (primary.vector_to_star - self.star_vector).length()
+        tolerance = settings.shadow_pair_tolerance
+        for (child, previous, previous_position, radius) in zip(children, self.children, self.positions, self.radii):
+            if child is not previous: return True
+            rel_position = child.get_local_position() - primary_position
+            delta = (rel_position - previous_position).length() + star_shift * rel_position.length()
+            if delta > radius * tolerance: return True
+        return False
+
+    def cast_shadows(self, caster_positions, caster_radii, star_vectors, target_positions, target_radii, star_position, star_radius):
+        ShadowPairScheduler.nb_tested += len(caster_positions)
+        pa = target_positions - caster_positions
+        pa_length = numpy.sqrt((pa ** 2).sum(axis=1))
+        star_distances = numpy.sqrt(((star_position - target_positions) ** 2).sum(axis=1))
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            ar_ratio = (star_radius / star_distances) / (caster_radii / pa_length)
+        along = (star_vectors * pa).sum(axis=1)
+        distances = numpy.sqrt(((pa - star_vectors * along[:, numpy.newaxis]) ** 2).sum(axis=1))
+        #The umbra has no visible impact when the shadow coef is smaller than the min change in pixel color
+        return (ar_ratio * ar_ratio <= 255) & (along < 0.0) & (distances < (1 + ar_ratio) * caster_radii + target_radii)
+
+    def update_pairs(self, primary, children, positions, radii):
+        star = primary.star
+        star_position = numpy.array(tuple(star.get_local_position()))
+        star_radius = star.get_apparent_radius()
+        star_vectors = numpy.array([tuple(child.vector_to_star) for child in children]).reshape(-1, 3)
+        primary_vector = numpy.array(tuple(primary.vector_to_star))
+        children_positions = positions[1:]
+        children_radii = radii[1:]
+        #Sort the children along the star direction, only the bodies behind a caster can receive its shadow
+        projections = children_positions.dot(primary_vector)
+        order = numpy.argsort(projections)
+        split = numpy.searchsorted(projections[order], positions[0].dot(primary_vector))
+        behind = order[:split]
+        front = order[split:]
+        self.primary_targets = []
+        self.primary_casters = []
+        if len(behind) > 0:
+            count = len(behind)
+            accepted = self.cast_shadows(numpy.repeat(positions[:1], count, axis=0), numpy.repeat(radii[:1], count),
+                                         numpy.repeat(primary_vector[numpy.newaxis], count, axis=0),
+                                         children_positions[behind], children_radii[behind],
+                                         star_position, star_radius)
+            self.primary_targets = [children[i] for i in behind[accepted]]
+        if len(front) > 0:
+            count = len(front)
+            accepted = self.cast_shadows(children_positions[front], children_radii[front], star_vectors[front],
+                                         numpy.repeat(positions[:1], count, axis=0), numpy.repeat(radii[:1], count),
+                                         star_position, star_radius)
+            self.primary_casters = [children[i] for i in front[accepted]]
+
+    def update(self, primary, children):
+        if primary.star is None or primary.vector_to_star is None: return
+        #The bodies not yet lit by the star can not cast or receive shadows
+        children = [child for child in children if child.vector_to_star is not None]
+        if not self.has_moved(primary, children): return
+        primary_position = primary.get_local_position()
+        positions = numpy.empty((len(children) + 1, 3))
+        positions[0] = tuple(primary_position)
+        for (i, child) in enumerate(children):
+            positions[i + 1] = tuple(child.get_local_position())
+        radii = numpy.array([primary.get_extend()] + [child.get_extend() for child in children])
+        self.update_pairs(primary, children, positions, radii)
+        self.primary = primary
+        self.children = children
+        self.positions = [LVector3d(child.get_local_position() - primary_position) for child in children]
+        self.radii = radii[1:].tolist()
+        self.star_vector = LVector3d(primary.vector_to_star)
+
+    def add_shadows(self, primary):
+        for child in self.primary_targets:
+            if child.visible and child.resolved and child.in_view:
+                primary.add_shadow_target(child)
+                ShadowPairScheduler.nb_accepted += 1
+        if primary.visible and primary.resolved and primary.in_view:
+            for child in self.primary_casters:
+                child.add_shadow_target(primary)
+                ShadowPairScheduler.nb_accepted += 1
 
 class StellarSystem(StellarObject):
     virtual_object = True
@@ -176,6 +282,12 @@ class StellarSystem(StellarObject):
         for child in self.children:
             child.first_update(time)
 
+    def collect_orbits(self, orbits):
+        StellarObject.collect_orbits(self, orbits)
+        if not self.visible or not self.resolved: return
+        for child in self.children:
+            child.collect_orbits(orbits)
+
     def update(self, time):
         StellarObject.update(self, time)
         #No need to update the children if not visible
@@ -235,6 +347,7 @@ class StellarSystem(StellarObject):
 class SimpleSystem(StellarSystem):
     def __init__(self, names, primary=None, orbit=None, rotation=None, body_class='system', point_color=None, description=''):
         StellarSystem.__init__(self, names, orbit, rotation, body_class, point_color, description)
+        self.shadow_pairs = None
         self.set_primary(primary)
 
     def set_primary(self, primary):
@@ -284,19 +397,12 @@ class SimpleSystem(StellarSystem):
         StellarSystem.update(self, time)
         primary = self.primary
         if primary is None or primary.is_emissive(): return
-        check_primary = primary.visible and primary.resolved and primary.in_view
         for child in self.children:
             child.start_shadows_update()
-        for child in self.children:
-            if child == primary: continue
-            if child.visible and child.resolved and child.in_view:
-                if primary.check_cast_shadow_on(child):
-                    #print(primary.get_friendly_name(), "casts shadow on", child.get_friendly_name())
-                    primary.add_shadow_target(child)
-            if check_primary:
-                if child.check_cast_shadow_on(primary):
-                    #print(child.get_friendly_name(), "casts shadow on", primary.get_friendly_name())
-                    child.add_shadow_target(primary)
+        if self.shadow_pairs is None:
+            self.shadow_pairs = ShadowPairScheduler()
+        self.shadow_pairs.update(primary, [child for child in self.children if child is not primary])
+        self.shadow_pairs.add_shadows(primary)
         for child in self.children:
             child.end_shadows_update()
 
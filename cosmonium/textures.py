@@ -25,9 +25,11 @@ from panda3d.core import TextureStage, Texture, LColor, PNMImage, CS_linear, CS_
 
 from .dircontext import defaultDirContext
 from .utils import TransparencyBlend, srgb_to_linear
+from .lrucache import LRUCache
 from . import workers
 from . import settings
 
+from weakref import WeakKeyDictionary
 import os
 
 class TexCoord(object):
@@ -579,11 +581,24 @@ class DataTexture(TextureBase):
             self.texture.setWrapU(Texture.WM_clamp)
             self.texture.setWrapV(Texture.WM_clamp)
 
+class TextureTileCache(LRUCache):
+    """LRU cache of the tiles of all the virtual textures, the tiles of the patches that are
+    displayed or that have children, which could use them as fallback, are never evicted."""
+    def is_pinned(self, source, patch, texture):
+        return patch.instance is not None or len(patch.children) > 0
+
+    def release(self, source, patch, texture):
+        source.evict_tile(patch)
+
+textureTileCache = TextureTileCache('Tiles', settings.texture_cache_max_tiles, settings.texture_cache_max_size * 1024 * 1024)
+
 class VirtualTextureSource(TextureSource):
     cached = False
     def __init__(self, root, ext, size, attribution=None, context=defaultDirContext):
         TextureSource.__init__(self, attribution)
         self.map_patch = {}
+        #Nearest loaded ancestor of each known patch, None if no ancestor is loaded
+        self.ancestors = WeakKeyDictionary()
         self.root = root
         self.ext = ext
         self.texture_size = size
@@ -606,15 +621,57 @@ class VirtualTextureSource(TextureSource):
         exists = os.path.isfile(tex_name)
         return exists
 
+    def get_load_priority(self, patch):
+        #Load first the tiles of the nearest patches, the patches not yet checked come last
+        distance = getattr(patch, 'distance', None)
+        if distance is None:
+            distance = float('inf')
+        return distance
+
+    def is_patch_alive(self, patch):
+        #Removed patches are detached from their parent
+        return patch.parent is not None or patch.lod == 0
+
+    def find_ancestor(self, patch):
+        if patch in self.ancestors:
+            ancestor = self.ancestors[patch]
+            if ancestor is None or ancestor in self.map_patch:
+                return ancestor
+        parent = patch.parent
+        if parent is None:
+            ancestor = None
+        elif parent in self.map_patch:
+            ancestor = parent
+        else:
+            ancestor = self.find_ancestor(parent)
+        self.ancestors[patch] = ancestor
+        return ancestor
+
+    def update_ancestors(self, patch, ancestor):
+        #The descendants are visited down to the patches having their own tile, even when
+        #an intermediate patch has no cached ancestor
+        for child in patch.children:
+            if child in self.map_patch: continue
+            if child in self.ancestors:
+                self.ancestors[child] = ancestor
+            self.update_ancestors(child, ancestor)
+
+    def add_tile(self, patch, texture):
+        self.map_patch[patch] = (texture, self.texture_size, patch.lod)
+        textureTileCache.add(self, patch, texture, texture.estimate_texture_memory())
+        self.update_ancestors(patch, patch)
+
+    def evict_tile(self, patch):
+        del self.map_patch[patch]
+        self.update_ancestors(patch, self.find_ancestor(patch))
+
     def texture_loaded_cb(self, texture, patch, callback, cb_args):
         if texture is not None:
-            self.map_patch[patch] = (texture, self.texture_size, patch.lod)
+            self.add_tile(patch, texture)
             if callback is not None:
                 callback(texture, self.texture_size, patch.lod, *cb_args)
         else:
-            parent_patch = patch.parent
-            while parent_patch is not None and parent_patch not in self.map_patch:
-                parent_patch = parent_patch.parent
+            parent_patch = self.find_ancestor(patch)
             if parent_patch is not None:
                 if callback is not None:
                     callback(*(self.map_patch[parent_patch] + cb_args))
@@ -633,20 +690,21 @@ class VirtualTextureSource(TextureSource):
                     texture = workers.syncTextureLoader.load_texture(filename, alpha_filename)
                     self.texture_loaded_cb(texture, patch, callback, cb_args)
                 else:
-                    workers.asyncTextureLoader.load_texture(filename, alpha_filename, self.texture_loaded_cb, (patch, callback, cb_args))
+                    workers.asyncTextureLoader.load_texture(filename, alpha_filename, self.texture_loaded_cb, (patch, callback, cb_args),
+                                                            self.get_load_priority(patch), lambda: self.is_patch_alive(patch))
             else:
                 print("File", tex_name, "not found")
                 self.texture_loaded_cb(None, patch, callback, cb_args)
         else:
+            textureTileCache.touch(self, patch)
             callback(*(self.map_patch[patch] +cb_args))
 
     def get_texture(self, patch):
         if patch in self.map_patch:
+            textureTileCache.touch(self, patch)
             return self.map_patch[patch]
         else:
-            parent_patch = patch.parent
-            while parent_patch is not None and parent_patch not in self.map_patch:
-                parent_patch = parent_patch.parent
+            parent_patch = self.find_ancestor(patch)
             if parent_patch is not None:
                 return self.map_patch[parent_patch]
             else:
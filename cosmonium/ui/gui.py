@@ -36,6 +36,8 @@ from ..bodyclass import bodyClasses
 from ..appstate import AppState
 from ..extrainfo import extra_info
 from ..celestia.cel_url import CelUrl
+from ..textures import textureTileCache
+from ..procedural.patchcache import patchCache
 from .. import utils
 from .. import settings
 #TODO: should only be used by Cosmonium main class
@@ -137,6 +139,8 @@ class Gui(object):
         event_ctrl.accept('f1', self.show_info)
         event_ctrl.accept('shift-f1', self.show_help)
         event_ctrl.accept('f2', self.cosmonium.connect_pstats)
+        event_ctrl.accept('control-f2', self.cosmonium.toggle_profiler)
+        event_ctrl.accept('shift-f2', self.cosmonium.export_profiler)
         event_ctrl.accept('f3', self.cosmonium.toggle_filled_wireframe)
         event_ctrl.accept('shift-f3', self.cosmonium.toggle_wireframe)
         event_ctrl.accept('f4', self.cosmonium.toggle_hdr)
@@ -299,6 +303,9 @@ class Gui(object):
         else:
             self.update_info("Normal move")
 
+    def toggle_display_profiler(self):
+        settings.display_profiler = not settings.display_profiler
+
     def toggle_lod_freeze(self):
         settings.debug_lod_freeze = not settings.debug_lod_freeze
         if settings.debug_lod_freeze:
@@ -551,6 +558,9 @@ class Gui(object):
                 0,
                 ('Instant movement>Control-J', settings.debug_jump, self.toggle_jump),
                 ('Connect pstats>F2', 0, self.cosmonium.connect_pstats),
+                ('Frame profiler>Control-F2', self.cosmonium.profiler is not None and self.cosmonium.profiler.is_running(), self.cosmonium.toggle_profiler),
+                ('Export profiler data>Shift-F2', 0, self.cosmonium.export_profiler),
+                ('Show profiler summary', settings.display_profiler, self.toggle_display_profiler),
                 ('Render info', 0, fps),
                 0,
                 ('Freeze LOD>F8', settings.debug_lod_freeze, self.toggle_lod_freeze),
@@ -719,23 +729,22 @@ class Gui(object):
         return True
 
     def select_object(self, body):
-        self.cosmonium.select_body(body)
+        #The bodies of the catalogs are only created when selected
+        self.cosmonium.select_body(objectsDB.resolve(body))
 
     def get_object(self, name):
         result = objectsDB.get(name)
         return result
 
     def list_objects(self, prefix):
-        result = objectsDB.startswith(prefix)
-        text_result = []
-        for entry in result:
-            text_result.append((entry.get_name_startswith(prefix), entry))
-        text_result.sort(key=lambda x: x[0])
-        return text_result
+        return objectsDB.list_startswith(prefix, settings.query_max_results)
 
     def open_find_object(self):
         self.query.open_query(self)
 
+    def format_cache_size(self, cache):
+        return "(%.0f/%.0f MB)" % (cache.size / 1024.0 / 1024.0, cache.max_size / 1024.0 / 1024.0)
+
     def update_status(self):
         over = self.cosmonium.over
         selected = self.cosmonium.selected
@@ -804,6 +813,22 @@ class Gui(object):
                 self.hud.topRight.set(0, "%.1f ms" % fps)
             else:
                 self.hud.topRight.set(0, "")
+            if settings.display_cache_usage:
+                self.hud.topRight.set(1, "Tiles: %d/%d %s" % (len(textureTileCache.entries), textureTileCache.max_entries, self.format_cache_size(textureTileCache)))
+                self.hud.topRight.set(2, "Patches: %d/%d %s" % (len(patchCache.entries), patchCache.max_entries, self.format_cache_size(patchCache)))
+            else:
+                self.hud.topRight.set(1, "")
+                self.hud.topRight.set(2, "")
+            profiler = self.cosmonium.profiler
+            summary = profiler.get_summary(60) if settings.display_profiler and profiler is not None else None
+            if summary is not None:
+                self.hud.topRight.set(3, "Frame: %.1f/%.1f ms Universe: %.1f Obs: %.1f Vis: %.1f Inst: %.1f" %
+                                      (summary['frame_ms'] + (summary['update_universe'][0], summary['update_obs'][0], summary['update_visibility'][0], summary['update_instances'][0])))
+                self.hud.topRight.set(4, "Bodies: %d Cells: %d Leaves: %d Queue: %d/%d" %
+                                      (summary['nb_update'][0], summary['nb_cells'][0], summary['nb_leaves'][0], summary['loader_queue'][1], summary['callback_queue'][1]))
+            else:
+                self.hud.topRight.set(3, "")
+                self.hud.topRight.set(4, "")
             self.last_fps = current_time
         if self.autopilot.current_interval is not None:
             self.hud.bottomRight.set(4, "Traveling (%d)" % (self.autopilot.current_interval.getDuration() - self.autopilot.current_interval.getT()))
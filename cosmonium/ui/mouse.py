@@ -22,13 +22,14 @@ from __future__ import absolute_import
 
 from panda3d.core import CollisionTraverser, CollisionNode
 from panda3d.core import CollisionHandlerQueue, CollisionRay
-from panda3d.core import GeomNode, LColor, Texture
+from panda3d.core import GeomNode, LColor, LPoint2, Texture
 
 from direct.task.Task import Task
 
 from .. import settings
 from cosmonium.utils import color_to_int
 from cosmonium.catalogs import objectsDB
+from cosmonium.picking import AnalyticPicker
 
 class Mouse(object):
     def __init__(self, base, oid_texture):
@@ -43,22 +44,36 @@ class Mouse(object):
         self.pickerNode.addSolid(self.pickerRay)
         self.picker.addCollider(self.pickerNP, self.pq)
         #self.picker.showCollisions(render)
+        if settings.analytic_picking:
+            self.analytic_picker = AnalyticPicker(self.base.universe, self.base.observer)
+        else:
+            self.analytic_picker = None
         if settings.mouse_over:
             taskMgr.add(self.mouse_task, 'mouse-task')
         self.over = None
+        self.last_mpos = None
 
-    def find_over_ray(self):
+    def find_over_ray(self, roots=None):
         over = None
         if self.base.mouseWatcherNode.hasMouse():
             mpos = self.base.mouseWatcherNode.getMouse()
             self.pickerRay.setFromLens(self.base.camNode, mpos.getX(), mpos.getY())
-            self.picker.traverse(render)
-            if self.pq.getNumEntries() > 0:
-                self.pq.sortEntries()
-                np = self.pq.getEntry(0).getIntoNodePath().findNetPythonTag('owner')
+            if roots is None:
+                roots = [render]
+            nearest = None
+            for root in roots:
+                self.picker.traverse(root)
+                if self.pq.getNumEntries() > 0:
+                    self.pq.sortEntries()
+                    entry = self.pq.getEntry(0)
+                    distance = entry.getSurfacePoint(self.pickerNP).length()
+                    if nearest is None or distance < nearest[0]:
+                        nearest = (distance, entry.getIntoNodePath())
+            if nearest is not None:
+                np = nearest[1].findNetPythonTag('owner')
                 owner = np.getPythonTag('owner')
                 over = owner
-                np = self.pq.getEntry(0).getIntoNodePath().findNetPythonTag('patch')
+                np = nearest[1].findNetPythonTag('patch')
                 if np is not None:
                     self.patch = np.getPythonTag('patch')
                 else:
@@ -83,7 +98,37 @@ class Mouse(object):
                         print("Unknown oid", oid, value)
         return over
 
+    def get_mesh_roots(self, bodies):
+        roots = []
+        for body in bodies:
+            for component in body.components:
+                if component is not None and component.instance is not None:
+                    roots.append(component.instance)
+        return roots
+
+    def find_over_analytic(self):
+        if not self.base.mouseWatcherNode.hasMouse():
+            return None
+        self.patch = None
+        result = self.analytic_picker.pick(self.base.mouseWatcherNode.getMouse())
+        over = result.get_over()
+        meshes = [body for (distance, body) in result.meshes if over is None or distance < over.distance_to_obs]
+        if len(meshes) > 0:
+            #The ray crosses resolved meshes in front of the analytic result, use a precise test
+            if settings.color_picking:
+                over_color = self.find_over_color()
+            else:
+                over_color = None
+            over_mesh = self.find_over_ray(self.get_mesh_roots(meshes))
+            if over_color is not None and (over_mesh is None or over_color.distance_to_obs < over_mesh.distance_to_obs):
+                over_mesh = over_color
+            if over_mesh is not None and (over is None or over_mesh.distance_to_obs < over.distance_to_obs):
+                over = over_mesh
+        return over
+
     def find_over(self):
+        if self.analytic_picker is not None:
+            return self.find_over_analytic()
         if settings.color_picking:
             over_color = self.find_over_color()
         else:
@@ -104,6 +149,12 @@ class Mouse(object):
 
     def mouse_task(self, task):
         if self.base.mouseWatcherNode.hasMouse():
-            self.over = self.find_over()
+            mpos = LPoint2(self.base.mouseWatcherNode.getMouse())
+            #Only search for the object under the mouse when the mouse has moved
+            if mpos != self.last_mpos:
+                self.last_mpos = mpos
+                self.over = self.find_over()
+        else:
+            self.last_mpos = None
         return Task.cont
 
@@ -22,16 +22,19 @@ from __future__ import absolute_import
 
 from panda3d.core import LPoint3d, LQuaterniond
 
-from .astro.orbits import FixedOrbit
+from .astro.orbits import FixedOrbit, EllipticalOrbit
 from .astro.rotations import FixedRotation
 from .astro.astro import app_to_abs_mag
 from .astro.frame import AbsoluteReferenceFrame
 from .astro import units
 
 from .foundation import CompositeObject
+from .catalogs import CatalogEntry, objectsDB
 from .systems import StellarSystem
+from .pipeline import PointsUpdatePipeline
 from .octree import OctreeNode, OctreeLeaf, InfiniteFrustum, VisibleObjectsTraverser, hasOctreeLeaf
 from .pstats import pstat
+from . import settings
 
 from math import sqrt
 from time import time
@@ -44,26 +47,44 @@ class Universe(StellarSystem):
                                description='Universe')
         self.visible = True
         self.octree_width = 100000.0 * units.Ly
-        abs_mag = app_to_abs_mag(6.0, self.octree_width * sqrt(3))
-        self.octree = OctreeNode(0,
-                             LPoint3d(10 * units.Ly, 10 * units.Ly, 10 * units.Ly),
-                             self.octree_width,
-                             abs_mag)
+        self.octree = self.create_octree_root()
         self.update_id = 0
         self.previous_leaves = []
         self.to_update_leaves = []
         self.to_update = []
         self.to_update_extra = []
         self.to_remove = []
+        self.catalogs = []
+        self.pipeline = PointsUpdatePipeline() if settings.vectorized_update else None
         self.nb_cells = 0
         self.nb_leaves = 0
         self.nb_leaves_in_cells = 0
         self.dump_octree = False
         self.dump_octree_stats = False
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        if hasOctreeLeaf:
+            #The C octree can not be pickled, it will be rebuilt after loading
+            state['octree'] = None
+        #The pipeline only holds per-frame data, it is recreated after loading
+        del state['pipeline']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.pipeline = PointsUpdatePipeline() if settings.vectorized_update else None
+
     def get_fullname(self, separator='/'):
         return ''
 
+    def create_octree_root(self):
+        abs_mag = app_to_abs_mag(6.0, self.octree_width * sqrt(3))
+        return OctreeNode(0,
+                          LPoint3d(10 * units.Ly, 10 * units.Ly, 10 * units.Ly),
+                          self.octree_width,
+                          abs_mag)
+
     def dumpOctree(self):
         self.octree.dump_octree()
 
@@ -73,11 +94,33 @@ class Universe(StellarSystem):
     def dumpOctreeStats(self):
         self.dump_octree_stats = not self.dump_octree_stats
 
+    def add_catalog(self, catalog):
+        self.catalogs.append(catalog)
+        objectsDB.add_catalog(catalog)
+
+    def is_in_catalog(self, child):
+        for catalog in self.catalogs:
+            if catalog.owns(child):
+                return True
+        return False
+
     def create_octree(self):
         print("Creating octree...")
         start = time()
+        if self.octree is None:
+            self.octree = self.create_octree_root()
         for child in self.children:
+            #Bodies created by a catalog are already in the octree through their entry
+            if self.catalogs and self.is_in_catalog(child): continue
             self.octree.add(OctreeLeaf(child, child.get_global_position(), child.get_abs_magnitude(), child.get_extend()))
+        for catalog in self.catalogs:
+            arrays = catalog.get_arrays()
+            if arrays is not None and hasattr(self.octree, 'add_array'):
+                #The entries are inserted in bulk, their leaves are created when the octree traverser reaches them
+                self.octree.add_array(catalog, *arrays)
+            else:
+                for entry in catalog.get_entries():
+                    self.octree.add(OctreeLeaf(entry, entry.get_global_position(), entry.get_abs_magnitude(), entry.get_extend()))
         end = time()
         print("Creation time:", end - start)
 
@@ -91,6 +134,9 @@ class Universe(StellarSystem):
         t = VisibleObjectsTraverser(f, 6.0, self.update_id)
         self.octree.traverse(t)
         self.to_update_leaves = t.get_leaves()
+        #The C++ traverser does not count the visited cells
+        self.nb_cells = getattr(t, 'nb_cells', 0)
+        self.nb_leaves_in_cells = getattr(t, 'nb_leaves', 0)
         self.to_remove = []
         if hasOctreeLeaf:
             self.to_update = list(map(lambda x: x.get_object(), self.to_update_leaves))
@@ -102,6 +148,9 @@ class Universe(StellarSystem):
             for old in self.previous_leaves:
                 if old.update_id != self.update_id:
                     self.to_remove.append(old)
+        if self.catalogs:
+            self.to_update = self.resolve_entries(self.to_update)
+            self.to_remove = self.resolve_entries(self.to_remove)
         self.octree_cells_to_clean = []
         self.to_update_extra = []
 #         cells = pstats.levelpstat('cells')
@@ -117,6 +166,15 @@ class Universe(StellarSystem):
 #         in_cells.set_level(self.in_cells)
 #         in_view.set_level(self.in_view)
 
+    def resolve_entries(self, objects):
+        resolved = []
+        for obj in objects:
+            if isinstance(obj, CatalogEntry):
+                obj = obj.get_body()
+                if obj is None: continue
+            resolved.append(obj)
+        return resolved
+
     def first_update(self):
         for child in self.children:
             child.first_update(self.context.time.time_full)
@@ -130,9 +188,29 @@ class Universe(StellarSystem):
             if extra is not None:
                 self.to_update_extra.append(extra)
 
+    def get_full_leaves(self):
+        if self.pipeline is not None:
+            return self.pipeline.full_leaves
+        else:
+            return self.to_update
+
+    def propagate_orbits(self, time):
+        orbits = []
+        for leaf in self.get_full_leaves():
+            if isinstance(leaf, StellarSystem) or not leaf.update_frozen:
+                leaf.collect_orbits(orbits)
+        for extra in self.to_update_extra:
+            extra.collect_orbits(orbits)
+        if len(orbits) >= settings.batch_orbits_threshold:
+            EllipticalOrbit.propagate(orbits, time)
+
     def update(self, time):
         CompositeObject.update(self, time)
-        for leaf in self.to_update:
+        if self.pipeline is not None:
+            self.pipeline.split(self.to_update, self.to_update_extra)
+        if settings.batch_orbits:
+            self.propagate_orbits(time)
+        for leaf in self.get_full_leaves():
             if isinstance(leaf, StellarSystem):
                 #print("Update system", leaf.get_name())
                 leaf.update(time)
@@ -146,17 +224,25 @@ class Universe(StellarSystem):
     def update_obs(self, observer):
         CompositeObject.update_obs(self, observer)
         self.nearest_system = None
-        for leaf in self.to_update:
+        for leaf in self.get_full_leaves():
             leaf.update_obs(observer)
             if self.nearest_system is None or leaf.distance_to_obs < self.nearest_system.distance_to_obs:
                 self.nearest_system = leaf
+        if self.pipeline is not None:
+            (nearest, distance) = self.pipeline.update_obs(observer)
+            if nearest is not None and (self.nearest_system is None or distance < self.nearest_system.distance_to_obs):
+                #The values of the points are not stored in the objects, update it explicitly
+                nearest.update_obs(observer)
+                self.nearest_system = nearest
         for extra in self.to_update_extra:
             extra.update_obs(observer)
 
     def check_visibility(self, pixel_size):
         CompositeObject.check_visibility(self, pixel_size)
-        for leaf in self.to_update:
+        for leaf in self.get_full_leaves():
             leaf.check_visibility(pixel_size)
+        if self.pipeline is not None:
+            self.pipeline.check_visibility(pixel_size, self.context.observer)
         for extra in self.to_update_extra:
             pass#extra.check_visibility(pixel_size)
 
@@ -171,8 +257,10 @@ class Universe(StellarSystem):
 
     def check_and_update_instance(self, camera_pos, orientation, pointset):
         CompositeObject.check_and_update_instance(self, camera_pos, orientation, pointset)
-        for leaf in self.to_update:
+        for leaf in self.get_full_leaves():
             leaf.check_and_update_instance(camera_pos, orientation, pointset)
+        if self.pipeline is not None:
+            self.pipeline.update_instances(pointset, self.context.haloset)
         for leaf in self.to_remove:
             leaf.remove_instance()
 
@@ -21,10 +21,12 @@ from __future__ import print_function
 
 from panda3d.core import Texture, Filename
 from direct.task.Task import Task
+from direct.stdpy import threading
 try:
     import queue
 except ImportError:
     import Queue as queue
+import heapq
 import sys
 import traceback
 
@@ -66,61 +68,134 @@ class AsyncMethod():
             self.callback()
             return task.done
 
+class LoaderJob(object):
+    """A job of the loader, all the requests for the same key are coalesced in the same job.
+    Each request can provide a validity check, the job is skipped when no request is still valid."""
+    def __init__(self, key, func, fargs, priority):
+        self.key = key
+        self.func = func
+        self.fargs = fargs
+        self.priority = priority
+        self.requests = []
+        self.cancelled = False
+
+    def add_request(self, callback, cb_args, valid):
+        self.requests.append((callback, cb_args, valid))
+
+    def is_valid(self):
+        if self.cancelled: return False
+        for (callback, cb_args, valid) in self.requests:
+            if valid is None or valid():
+                return True
+        return False
+
+    def cancel(self):
+        self.cancelled = True
+
 class AsyncLoader():
-    def __init__(self, base, name):
+    def __init__(self, base, name, nb_threads=1):
         self.base = base
-        self.in_queue = queue.Queue()
+        self.jobs = []
+        self.pending = {}
+        self.counter = 0
+        self.condition = threading.Condition()
         self.cb_queue = queue.Queue()
         self.base.taskMgr.setupTaskChain(name,
-                                         numThreads = 1,
+                                         numThreads = nb_threads,
                                          tickClock = False,
                                          threadPriority = None,
                                          frameBudget = -1,
                                          frameSync = False,
                                          timeslicePriority = True)
 
-        self.process_task = self.base.taskMgr.add(self.processTask, name + 'ProcessTask', taskChain=name)
+        self.process_tasks = []
+        for i in range(nb_threads):
+            self.process_tasks.append(self.base.taskMgr.add(self.processTask, name + 'ProcessTask%d' % i, taskChain=name))
         self.callback_task = self.base.taskMgr.add(self.callbackTask, name + 'CallbackTask')
 
     def remove(self):
-        self.base.taskMgr.remove(self.process_task)
-        self.process_task = None
+        for process_task in self.process_tasks:
+            self.base.taskMgr.remove(process_task)
+        self.process_tasks = []
         self.base.taskMgr.remove(self.callback_task)
         self.callback_task = None
 
-    def add_job(self, func, fargs, callback, cb_args):
-        job = [func, fargs, callback, cb_args]
-        self.in_queue.put(job)
+    def get_queue_size(self):
+        return len(self.pending)
+
+    def add_job(self, func, fargs, callback, cb_args, priority=0, key=None, valid=None):
+        """Queue a new job, the jobs with the lowest priority value are processed first.
+        If a job with the same key is still pending, the request is added to that job instead."""
+        with self.condition:
+            job = None
+            if key is not None:
+                job = self.pending.get(key)
+                if job is not None and job.cancelled:
+                    job = None
+            if job is None:
+                job = LoaderJob(key, func, fargs, priority)
+                if key is not None:
+                    self.pending[key] = job
+                else:
+                    self.pending[id(job)] = job
+                self.push_job(job)
+            elif priority < job.priority:
+                #The old heap entry will be discarded when popped
+                job.priority = priority
+                self.push_job(job)
+            job.add_request(callback, cb_args, valid)
+            self.condition.notify()
+        return job
+
+    def push_job(self, job):
+        self.counter += 1
+        heapq.heappush(self.jobs, (job.priority, self.counter, job))
+
+    def pop_job(self):
+        with self.condition:
+            while True:
+                if not self.jobs:
+                    self.condition.wait(0.1)
+                    if not self.jobs:
+                        return None
+                (priority, counter, job) = heapq.heappop(self.jobs)
+                if priority != job.priority:
+                    continue
+                key = job.key if job.key is not None else id(job)
+                if self.pending.get(key) is not job:
+                    continue
+                del self.pending[key]
+                if job.is_valid():
+                    return job
 
     def processTask(self, task):
-        try:
-            job = self.in_queue.get_nowait()
-            (func, fargs, callback, cb_args) = job
-            result = func(*fargs)
-            self.cb_queue.put([callback, result, cb_args])
-        except queue.Empty:
-            pass
+        job = self.pop_job()
+        if job is not None:
+            result = job.func(*job.fargs)
+            self.cb_queue.put([job, result])
         return Task.cont
 
     def callbackTask(self, task):
         try:
             while True:
-                job = self.cb_queue.get_nowait()
-                (callback, result, cb_args) = job
-                callback(result, *cb_args)
+                (job, result) = self.cb_queue.get_nowait()
+                if job.cancelled: continue
+                for (callback, cb_args, valid) in job.requests:
+                    if valid is None or valid():
+                        callback(result, *cb_args)
         except queue.Empty:
             pass
         return Task.cont
 
 class AsyncTextureLoader(AsyncLoader):
-    def __init__(self, base):
-        AsyncLoader.__init__(self, base, 'TextureLoader')
+    def __init__(self, base, nb_threads=1):
+        AsyncLoader.__init__(self, base, 'TextureLoader', nb_threads)
 
-    def load_texture(self, filename, alpha_filename, callback, args):
-        self.add_job(self.do_load_texture, [filename, alpha_filename], callback, args)
+    def load_texture(self, filename, alpha_filename, callback, args, priority=0, valid=None):
+        return self.add_job(self.do_load_texture, [filename, alpha_filename], callback, args, priority, (filename, alpha_filename), valid)
 
-    def load_texture_array(self, textures, callback, args):
-        self.add_job(self.do_load_texture_array, [textures], callback, args)
+    def load_texture_array(self, textures, callback, args, priority=0, valid=None):
+        return self.add_job(self.do_load_texture_array, [textures], callback, args, priority, None, valid)
 
     def do_load_texture(self, filename, alpha_filename):
         tex = Texture()
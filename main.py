@@ -78,6 +78,7 @@ class CosmoniumConfig(object):
         self.celestia_start_script = 'start.cel'
         self.prc_file = 'config.prc'
         self.test_start = False
+        self.headless = False
 
     def update_from_args(self, args):
         #TODO: add input checking here
@@ -100,6 +101,7 @@ class CosmoniumConfig(object):
         if self.celestia and self.script is None and self.default is None:
             self.script = self.celestia_start_script
         self.test_start = args.test_start
+        self.headless = args.headless or args.test_start
 
 class CosmoniumConfigParser(YamlParser):
     def __init__(self, config_file):
@@ -214,6 +216,23 @@ class CosmoniumApp(Cosmonium):
             else:
                 self.load_file(parser, extra)
 
+    def get_universe_id(self):
+        config = self.app_config
+        if config.celestia:
+            return ('celestia', config.celestia_data_list, config.celestia_support,
+                    config.celestia_stars_catalog, config.celestia_stars_names,
+                    config.celestia_stc, config.celestia_ssc,
+                    config.celestia_asterisms, config.celestia_boundaries)
+        else:
+            extra = []
+            for path in config.extra:
+                #New files in an extra directory must invalidate the snapshot
+                if os.path.isdir(path):
+                    extra.append((path, sorted(os.listdir(path))))
+                else:
+                    extra.append(path)
+            return ('cosmonium', config.common, config.main, extra)
+
     def load_universe(self):
         if self.app_config.celestia:
             self.load_universe_celestia()
@@ -259,6 +278,10 @@ parser.add_argument("--extra",
                     help="Extra configuration files or directories to load",
                     nargs='+',
                     default=None)
+parser.add_argument("--headless",
+                    help="Run without window, the scene is not rendered",
+                    action='store_true',
+                    default=False)
 parser.add_argument("--test-start",
                     help=argparse.SUPPRESS,
                     action='store_true',
@@ -266,7 +289,8 @@ parser.add_argument("--test-start",
 if sys.platform == "darwin":
     #Ignore -psn_<app_id> from MacOS
     parser.add_argument('-p', help=argparse.SUPPRESS)
-args = parser.parse_args()
 
-app = CosmoniumApp(args)
-app.run()
+if __name__ == '__main__':
+    args = parser.parse_args()
+    app = CosmoniumApp(args)
+    app.run()
@@ -61,6 +61,7 @@ from cosmonium import settings
 
 from math import pow, pi, sqrt
 import argparse
+import numpy
 
 from cosmonium.cosmonium import CosmoniumBase
 from cosmonium.camera import CameraBase
@@ -440,6 +441,7 @@ class RalphNav(NavBase):
 class RalphAppConfig:
     def __init__(self):
         self.test_start = False
+        self.headless = False
 
 class RoamingRalphDemo(CosmoniumBase):
 
@@ -555,6 +557,12 @@ class RoamingRalphDemo(CosmoniumBase):
             height = self.water.level
         return height
 
+    def get_heights_patch(self, patch, u, v):
+        heights = self.terrain_object.get_heights_patch(patch, u, v)
+        if self.has_water and self.water.visible:
+            heights = numpy.maximum(heights, self.water.level)
+        return heights
+
     def skybox_init(self):
         skynode = base.cam.attachNewNode('skybox')
         self.skybox = loader.loadModel('ralph-data/models/rgbCube')